@@ -1,11 +1,45 @@
-"""Lambda interface to initiate password expiration checking."""
+"""Lambda interface to initiate password expiration checking.
+
+When the pool cannot be processed within one invocation and a password_state_table is configured, the run stops
+before the Lambda times out, saving a checkpoint, and is resumed by a new asynchronous invocation of this function
+(or, with resume_by set to "schedule", by the next scheduled invocation).
+
+Messages are logged at the log_level set in SSM (INFO by default, DEBUG in develop_mode), and the time spent in each
+phase of the run, the API calls and the outcomes are written as CloudWatch Embedded Metric Format metrics in the
+metrics_namespace, with the user pool id as dimension.
+"""
 import json
+import logging
 import sys
+from functools import partial
 
-from common import close_smtp  # type: ignore[import]
+import boto3
 from common import get_ssm_parameters_by_path  # type: ignore[import]
 from common import open_smtp  # type: ignore[import]
+from enforce_password_expiration import auth_events_request_rate  # type: ignore[import]
 from enforce_password_expiration import password_expiration_check  # type: ignore[import]
+from enforce_password_expiration import validation_workers  # type: ignore[import]
+from notification_outbox import SmtpOutbox  # type: ignore[import]
+from password_state import DynamoDBPasswordStateStore  # type: ignore[import]
+from run_metrics import RunMetrics  # type: ignore[import]
+
+
+# Most consecutive invocations of one run, guarding against a run that never completes
+max_invocations = 100
+
+# SMTP connections delivering the notifications
+smtp_connections = 2
+
+# Emails sent per second, the default SES maximum send rate
+email_send_rate = 14
+
+# CloudWatch namespace of the run metrics
+metrics_namespace = "PDS/Cognito/PasswordExpiration"
+
+# Loggers of the password expiration modules, set to the configured log level (leaving boto's at the Lambda default)
+tool_loggers = ("check_password_lambda", "enforce_password_expiration", "notification_outbox", "run_metrics")
+
+logger = logging.getLogger(__name__)
 
 
 def lambda_handler(event, context):
@@ -30,7 +64,8 @@ def lambda_handler(event, context):
         "warning_message_template",
         "warning_subject_template",
     )
-    # optional_fields are ("apply_changes", "develop_mode")
+    # optional_fields are ("apply_changes", "develop_mode", "validation_workers", "auth_events_request_rate",
+    # "password_state_table", "resume_by", "smtp_connections", "email_send_rate", "log_level", "metrics_namespace")
 
     ssm_parameters = get_ssm_parameters_by_path(config_ssm_path)
 
@@ -58,35 +93,70 @@ def lambda_handler(event, context):
     warning_subject_template = config_params["warning_subject_template"]
     apply_changes = eval(config_params.get("apply_changes", "True"))
     develop_mode = eval(config_params.get("develop_mode", "False"))
-
-    print(f"apply_changes : {apply_changes}")
-    print(f"develop_mode : {develop_mode}")
+    max_workers = int(config_params.get("validation_workers", validation_workers))
+    request_rate = float(config_params.get("auth_events_request_rate", auth_events_request_rate))
+    state_table = config_params.get("password_state_table")
+    state_store = DynamoDBPasswordStateStore(state_table) if state_table else None
+    resume_by = config_params.get("resume_by", "reinvoke")
+    connections = int(config_params.get("smtp_connections", smtp_connections))
+    send_rate = float(config_params.get("email_send_rate", email_send_rate))
+    namespace = config_params.get("metrics_namespace", metrics_namespace)
+    invocation = event.get("invocation", 1)
+
+    log_level = config_params.get("log_level", "DEBUG" if develop_mode else "INFO").upper()
+    for logger_name in tool_loggers:
+        logging.getLogger(logger_name).setLevel(log_level)
+    logger.info("apply_changes : %s", apply_changes)
+    logger.info("develop_mode : %s", develop_mode)
     if develop_mode:
-        print(json.dumps(config_params, indent=4))
+        logger.debug(json.dumps(config_params, indent=4))
 
     smtp_host, smtp_port = smtp_server.split(":")
-    smtp_endpoint = None
+    metrics = RunMetrics()
+    outbox = None
     if apply_changes:
-        smtp_endpoint = open_smtp(smtp_username, smtp_password, smtp_host, int(smtp_port))
+        connect = partial(open_smtp, smtp_username, smtp_password, smtp_host, int(smtp_port))
+        outbox = SmtpOutbox(connect, sender, connections, send_rate, metrics=metrics)
+
+    remaining_millis = context.get_remaining_time_in_millis if context is not None else None
+    run_id = context.aws_request_id if context is not None else None
 
     try:
-        password_expiration_check(
+        completed = password_expiration_check(
             user_pool_id,
             cognito_login_url,
             valid_period,
             warn_window,
-            smtp_endpoint,
-            sender,
+            outbox,
             expired_message_template,
             expired_subject_template,
             warning_message_template,
             warning_subject_template,
             apply_changes,
             develop_mode,
+            max_workers,
+            request_rate,
+            state_store,
+            remaining_millis,
+            run_id,
+            metrics,
         )
     finally:
-        if smtp_endpoint is not None:
-            close_smtp(smtp_endpoint)
+        if outbox is not None:
+            outbox.close()
+        metrics.print_emf(namespace, {"UserPoolId": user_pool_id})
+
+    if completed is False and resume_by == "reinvoke" and context is not None:
+        if invocation >= max_invocations:
+            raise RuntimeError(f"The password expiration run did not complete within {max_invocations} invocations")
+        logger.info("Invoking %s to resume the run (invocation %d).", context.function_name, invocation + 1)
+        boto3.client("lambda").invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps({**event, "invocation": invocation + 1}),
+        )
+
+    return {"completed": bool(completed), "invocation": invocation}
 
 
 """For testing"""
@@ -95,6 +165,7 @@ if __name__ == "__main__":
         print(f"Usage:\n\t{sys.argv[0]} <ssm_path>")
         sys.exit(0)
 
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     event = {"config_ssm_path": sys.argv[1]}
 
     lambda_handler(event, None)
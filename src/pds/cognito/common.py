@@ -4,6 +4,8 @@ import random
 import smtplib
 import string
 import sys
+import threading
+import time
 from email.mime.text import MIMEText
 
 import boto3
@@ -51,6 +53,33 @@ def generate_random_string(length=8):
     return "".join(random_string_list)
 
 
+class RateLimiter:
+    """Token bucket limiting the rate of API requests made from any number of threads.
+
+    Cognito enforces per-category request quotas (in requests per second) across an account, so concurrent callers
+    share one limiter per API category and wait for their turn rather than receive TooManyRequestsException.
+    """
+
+    def __init__(self, rate, burst=1):
+        """Allow rate requests per second on average, and at most burst requests at once."""
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request may be made."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
 def cognito_tool_usage(exit_status=None):
     """Provide command line instructions."""
     print(f"Usage:\n\t{sys.argv[0]} <cognito_user_pool_id> {{--page-size=<page_size>}} {{--region=<aws_region>}}")
@@ -83,9 +112,13 @@ def get_ssm_parameters_by_path(ssm_path):
     return result_params
 
 
-def open_smtp(smtp_user, smtp_password, smtp_endpoint_host, smtp_endpoint_port):
-    """Open a TLS-mode connection to the indicated smtp host."""
-    smtp_endpoint = smtplib.SMTP(smtp_endpoint_host, smtp_endpoint_port)
+# Seconds after which a stalled SMTP operation fails, rather than blocking its caller indefinitely
+smtp_timeout = 60
+
+
+def open_smtp(smtp_user, smtp_password, smtp_endpoint_host, smtp_endpoint_port, timeout=smtp_timeout):
+    """Open a TLS-mode connection to the indicated smtp host, with operations timing out after timeout seconds."""
+    smtp_endpoint = smtplib.SMTP(smtp_endpoint_host, smtp_endpoint_port, timeout=timeout)
     smtp_endpoint.starttls()
     smtp_endpoint.login(smtp_user, smtp_password)
 
@@ -1,11 +1,19 @@
 """Determine which users in the identified user pool have expired passwords."""
 import json
+import logging
+import time
+from collections import ChainMap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
 
 import boto3
+from botocore.config import Config
 from common import generate_random_string  # type: ignore[import]
-from common import send_mail  # type: ignore[import]
+from common import RateLimiter  # type: ignore[import]
+from notification_outbox import MessageTemplate  # type: ignore[import]
+from run_metrics import RunMetrics  # type: ignore[import]
 
 
 """
@@ -24,9 +32,26 @@ By default, no status changes are applied to user records and no email notificat
 changes applied, '--apply' must be specified as the last argument on the command line. Additionally, another
 optional argument to this script of --dev which considers the units of validity and warning periods from days
 to minutes (to more easily simulate account event states).
+
+The auth event histories of several users are examined at the same time, with the rate of requests held below
+the Cognito quota. Email notifications are then queued one user at a time, in user pool order, to an outbox
+delivering them over a pool of SMTP connections (see notification_outbox), and the password of a user is reset once
+its notification is delivered.
+
+Given a password state store (see password_state), the last password change and the auth events examined for each
+user are recorded, and later runs only read the auth events that are newer. The store also holds a checkpoint of
+the run (its start time, the user list page being processed and the users of that page already handled), so that a
+run given a time budget can stop before running out of time and be resumed by a later invocation without resetting
+or notifying any user twice. A run takes a lease on the checkpoint, with a conditional write, so that two invocations
+never resume it at the same time, and stops waiting for notifications in time to save the checkpoint. The states and
+the checkpoint are also saved each time the notifications of a page are settled, so that a run killed without
+warning (a Lambda timeout or out of memory) only handles the users of its last page again. Users whose notification
+could not be delivered are not recorded as handled, so that a run resuming their page notifies them again.
 """
 
 
+logger = logging.getLogger(__name__)
+
 # List of states which constitute an inactive user - Note that ARCHIVED is no longer used
 inactive_user_statuses = {"RESET_REQUIRED", "FORCE_CHANGE_PASSWORD", "EXTERNAL_PROVIDER"}
 
@@ -36,6 +61,29 @@ password_change_events = {"PasswordChange", "ForgotPassword"}
 # Temporary password length
 temporary_password_length = 8
 
+# User attributes listed with each user, besides the username, status and creation date which are always listed
+user_attributes_to_get = ["email"]
+
+# Number of users whose auth event history is examined at the same time
+validation_workers = 8
+
+# AdminListUserAuthEvents requests per second, kept well below the account quota of Cognito user read requests
+auth_events_request_rate = 20
+
+# Attempts made for a throttled or failed Cognito request, with backoff in between
+cognito_max_attempts = 10
+
+# Seconds of the time budget left when a run stops handling users and saves its checkpoint
+checkpoint_margin = 60
+
+# Most users whose notification may await delivery, so that those left when a run stops are delivered within the
+# checkpoint_margin
+notification_backlog = 100
+
+# Seconds of the time budget kept for saving the password states and the checkpoint, which notifications awaiting
+# delivery are not waited for
+state_save_margin = 10
+
 
 def datetime_serializable(obj):
     """Support JSON serializaion of datetimes."""
@@ -44,28 +92,56 @@ def datetime_serializable(obj):
     return obj
 
 
-def get_userpool_users(client, user_pool_id):
-    """Obtain the ids of the users in the identified user pool."""
-    has_next_page = True
-    next_token = None
+def iter_userpool_pages(client, user_pool_id, pagination_token=None, attributes_to_get=None, metrics=None):
+    """Yield (pagination_token, users) for each page of users in the identified user pool, as pages are listed.
 
-    users = []
-    while has_next_page:
-        response = (
-            client.list_users(UserPoolId=user_pool_id)
-            if next_token is None
-            else client.list_users(UserPoolId=user_pool_id, PaginationToken=next_token)
-        )
-        users.extend(response["Users"])
+    pagination_token is the token the page was requested with (None for the first page), from which the listing
+    can be restarted. If attributes_to_get is given, only those user attributes are listed. The requests are timed
+    in the "listing" phase of metrics, if given.
+    """
+    metrics = metrics if metrics is not None else RunMetrics()
+    request = {"UserPoolId": user_pool_id}
+    if attributes_to_get is not None:
+        request["AttributesToGet"] = attributes_to_get
+    next_token = pagination_token
+    while True:
+        metrics.call("ListUsers")
+        with metrics.time("listing"):
+            response = (
+                client.list_users(**request)
+                if next_token is None
+                else client.list_users(**request, PaginationToken=next_token)
+            )
+        yield next_token, response["Users"]
 
         next_token = response.get("PaginationToken")
         if next_token is None:
-            has_next_page = False
+            return
+
 
-    return users
+def get_userpool_users(client, user_pool_id, attributes_to_get=None):
+    """Yield the users in the identified user pool as they are listed, with only attributes_to_get if given."""
+    for _pagination_token, page_users in iter_userpool_pages(client, user_pool_id, attributes_to_get=attributes_to_get):
+        yield from page_users
 
 
-def validate_user_creation(user_record, valid_datetime, warn_datetime):
+def map_in_order(executor, function, items, lookahead):
+    """Yield (item, function(item)) for each item, in order, running up to lookahead calls ahead on the executor.
+
+    Items are drawn from the iterable only as results are consumed, so a long listing is never held in memory.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= lookahead:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def validate_user_creation(user_record, valid_datetime, warn_datetime, log=logger.debug):
     """Validate user's password validity based on the user's creation date."""
     password_change_required = True
     issue_warning = False
@@ -73,24 +149,102 @@ def validate_user_creation(user_record, valid_datetime, warn_datetime):
 
     user_create_date = user_record["UserCreateDate"].replace(tzinfo=None)
     if user_create_date > valid_datetime:
-        print("User creation date preceeds validity datetime, password change required.")
+        log("User creation date preceeds validity datetime, password change required.")
         password_change_required = False
     elif warn_datetime is not None and warn_datetime < user_create_date:
-        print("User creation date preceeds warning datetime, warning required.")
+        log("User creation date preceeds warning datetime, warning required.")
         issue_warning = True
         last_event_date = user_create_date
 
     return password_change_required, issue_warning, last_event_date
 
 
-def validate_user_password(client, user_pool_id, user_record, valid_datetime, warn_datetime):
+def scan_auth_events(client, user_pool_id, username, valid_datetime, state=None, limiter=None, metrics=None):
+    """Page through a user's auth events, newest first, and return the user's updated password state.
+
+    The state (see password_state) records the last qualifying password change and the newest and oldest events
+    examined. Paging stops at the first qualifying password change, at the first event before valid_datetime, or at
+    the newest event examined by an earlier run (recorded in state), so that each event is only read once. Each
+    request first waits for the limiter, if given. Waits and requests are timed in metrics, if given.
+    """
+    metrics = metrics if metrics is not None else RunMetrics()
+    state = dict(state) if state is not None else {"last_change": None, "newest_event": None, "oldest_event": None}
+    watermark = state["newest_event"]
+
+    next_token = None
+    while True:
+        if limiter is not None:
+            with metrics.time("rate_limit_wait"):
+                limiter.acquire()
+        metrics.call("AdminListUserAuthEvents")
+        with metrics.time("auth_events"):
+            response = (
+                client.admin_list_user_auth_events(UserPoolId=user_pool_id, Username=username)
+                if next_token is None
+                else client.admin_list_user_auth_events(
+                    UserPoolId=user_pool_id, Username=username, NextToken=next_token
+                )
+            )
+
+        for user_event in response["AuthEvents"]:
+            event_datetime = user_event["CreationDate"].replace(tzinfo=None)
+            if watermark is not None and event_datetime <= watermark:
+                # this and older events were examined by an earlier run
+                return state
+            if state["newest_event"] is None or event_datetime > state["newest_event"]:
+                state["newest_event"] = event_datetime
+            if state["oldest_event"] is None or event_datetime < state["oldest_event"]:
+                state["oldest_event"] = event_datetime
+            if user_event["EventType"] in password_change_events and user_event["EventResponse"] == "Pass":
+                if state["last_change"] is None or event_datetime > state["last_change"]:
+                    state["last_change"] = event_datetime
+                return state
+            if event_datetime < valid_datetime:
+                # event is before the validity window, done
+                return state
+
+        next_token = response.get("NextToken")
+        if next_token is None:
+            return state
+
+
+def is_password_current(state, valid_datetime, warn_datetime):
+    """Return whether a recorded password state shows a password change after the warning (or validity) datetime.
+
+    Newer auth events cannot change the outcome for such a user, so they need not be read.
+    """
+    if state is None or state["last_change"] is None:
+        return False
+    return state["last_change"] >= max(valid_datetime, warn_datetime if warn_datetime is not None else valid_datetime)
+
+
+def validate_user_password(
+    client,
+    user_pool_id,
+    user_record,
+    valid_datetime,
+    warn_datetime,
+    limiter=None,
+    log=None,
+    states=None,
+    metrics=None,
+):
     """Validate user's password state.
 
     Based on the authentication events history of the identified user/user-pool prior to valid_datetime, determine if a
     password change occurred or if a warning message is merited (according to warn_datetime). If the user is not in an
-    active state, it is ignored.
+    active state, it is ignored. Each auth events request first waits for the limiter, if given. Messages, starting
+    with the user record, are passed to log if given; none is built otherwise.
+
+    states, if given, maps usernames to the password states recorded by earlier runs: only the events newer than
+    those already examined for the user are read, none at all if the recorded password change is recent enough, and
+    the user's entry is updated. Auth event paging and the decision are timed in metrics, if given.
     """
-    print(f"{json.dumps(user_record, indent=4, default=datetime_serializable)}")
+    metrics = metrics if metrics is not None else RunMetrics()
+    if log is None:
+        log = _ignore
+    else:
+        log(f"{json.dumps(user_record, indent=4, default=datetime_serializable)}")
 
     password_change_required = False
     issue_warning = False
@@ -98,49 +252,43 @@ def validate_user_password(client, user_pool_id, user_record, valid_datetime, wa
     username = user_record["Username"]
 
     if user_record["UserStatus"] in inactive_user_statuses:
-        print(f"User {username} is not active, skipping.")
+        log(f"User {username} is not active, skipping.")
     else:
-        password_change_required = True
-
-        continue_on = True
-        next_token = None
-        while continue_on:
-            response = (
-                client.admin_list_user_auth_events(UserPoolId=user_pool_id, Username=username)
-                if next_token is None
-                else client.admin_list_user_auth_events(
-                    UserPoolId=user_pool_id, Username=username, NextToken=next_token
-                )
-            )
-
-            for user_event in response["AuthEvents"]:
-                event_datetime = user_event["CreationDate"].replace(tzinfo=None)
-                if event_datetime < valid_datetime:
-                    # event is before the validity window, done
-                    print("Change password not identified within validity period, password change required.")
-                    continue_on = False
-                    break
-                elif user_event["EventType"] in password_change_events and user_event["EventResponse"] == "Pass":
-                    print("An event constituting a password change has been found within validity period.")
-                    continue_on = False
-                    password_change_required = False
-                    if warn_datetime is not None and event_datetime < warn_datetime:
-                        print("Password change is within warning period, warning required.")
-                        issue_warning = True
-                        last_event_date = event_datetime
-                    break
-
-            next_token = response.get("NextToken")
-            if continue_on and next_token is None:
-                print("User has no auth event history before validity window - checking user creation.")
+        user_create_date = user_record["UserCreateDate"].replace(tzinfo=None)
+        state = states.get(username) if states is not None else None
+        if state is not None and state.get("user_create_date") != user_create_date:
+            # the user was recreated under the same name, its earlier state does not apply
+            state = None
+        if not is_password_current(state, valid_datetime, warn_datetime):
+            state = scan_auth_events(client, user_pool_id, username, valid_datetime, state, limiter, metrics)
+            state["user_create_date"] = user_create_date
+            if states is not None:
+                states[username] = state
+
+        with metrics.time("decision"):
+            last_change = state["last_change"]
+            if last_change is not None and last_change >= valid_datetime:
+                log("An event constituting a password change has been found within validity period.")
+                if warn_datetime is not None and last_change < warn_datetime:
+                    log("Password change is within warning period, warning required.")
+                    issue_warning = True
+                    last_event_date = last_change
+            elif state["oldest_event"] is not None and state["oldest_event"] < valid_datetime:
+                log("Change password not identified within validity period, password change required.")
+                password_change_required = True
+            else:
+                log("User has no auth event history before validity window - checking user creation.")
                 password_change_required, issue_warning, last_event_date = validate_user_creation(
-                    user_record, valid_datetime, warn_datetime
+                    user_record, valid_datetime, warn_datetime, log
                 )
-                continue_on = False
 
     return password_change_required, issue_warning, last_event_date
 
 
+def _ignore(message):
+    """Drop a log message."""
+
+
 def extract_user_email(user):
     """Extract email address from the user record.
 
@@ -158,17 +306,71 @@ def password_expiration_check(
     cognito_login_url,
     valid_period,
     warn_window,
-    smtp_endpoint,
-    sender,
+    outbox,
     expired_message_template,
     expired_subject_template,
     warning_message_template,
     warning_subject_template,
     apply_changes=True,
     develop_mode=False,
+    max_workers=validation_workers,
+    request_rate=auth_events_request_rate,
+    state_store=None,
+    remaining_millis=None,
+    run_id=None,
+    metrics=None,
 ):
-    """Run through the given pool to handle expired passwords and issue warnings as necessary."""
-    current_date = datetime.now()
+    """Run through the given pool to handle expired passwords and issue warnings as necessary.
+
+    Users are validated by max_workers threads making at most request_rate auth events requests per second, and the
+    resulting notifications are queued to outbox (a notification_outbox.SmtpOutbox, or None to send no email) in
+    user pool order. An expired password is reset once the user's notification is delivered, and left as is if it
+    cannot be. The message and subject templates are str.format strings. The password states of the users are loaded
+    from, and the changed ones saved to, state_store if given.
+
+    With a state_store, the run resumes the checkpoint of an unfinished run if there is one. If remaining_millis (a
+    callable returning the milliseconds left to the caller, such as a Lambda context's get_remaining_time_in_millis)
+    is also given, the run stops when fewer than checkpoint_margin seconds are left, saving its checkpoint, and no
+    notification is waited for once fewer than state_save_margin seconds are left: the queued ones are cancelled and
+    their users left to the next run. run_id identifies the caller, which takes a lease on the checkpoint so that a run
+    still in progress elsewhere is not resumed at the same time.
+
+    The time spent in each phase, the API calls made and the outcomes are added to metrics (a run_metrics.RunMetrics)
+    if given, and logged when the run ends. Details of each user are only logged at the DEBUG level.
+
+    Returns True if the whole pool was processed, False if the run stopped early to be resumed, or None if another
+    run of the pool is in progress.
+    """
+    metrics = metrics if metrics is not None else RunMetrics()
+    with metrics.time("state_store"):
+        checkpoint = state_store.load_checkpoint(user_pool_id) if state_store is not None else None
+    # The checkpoint as loaded, which the lease is only taken on if it is still the one recorded
+    loaded_checkpoint = dict(checkpoint) if checkpoint is not None else None
+    if checkpoint is not None:
+        lease_expires = checkpoint.get("lease_expires")
+        if lease_expires is not None and datetime.fromisoformat(lease_expires) > datetime.now():
+            if checkpoint.get("owner") != run_id:
+                logger.info(
+                    "A run of %s is in progress (%s) until %s.", user_pool_id, checkpoint.get("owner"), lease_expires
+                )
+                return None
+        current_date = datetime.fromisoformat(checkpoint["run_started"])
+        logger.info(
+            "Resuming the run started at %s, %d user(s) into the page.", current_date, len(checkpoint["processed"])
+        )
+    else:
+        current_date = datetime.now()
+        checkpoint = {"run_started": current_date.isoformat(), "pagination_token": None, "processed": []}
+    if state_store is not None:
+        # Hold the run until the caller's time is up, or for a day without a time budget
+        budget = remaining_millis() / 1000 if remaining_millis is not None else 86400
+        checkpoint["owner"] = run_id
+        checkpoint["lease_expires"] = (datetime.now() + timedelta(seconds=budget)).isoformat()
+        with metrics.time("state_store"):
+            leased = state_store.take_lease(user_pool_id, checkpoint, loaded_checkpoint)
+        if not leased:
+            logger.info("Another run of %s took the checkpoint first.", user_pool_id)
+            return None
     # datetime at which passwords expire from now
     valid_time_diff = timedelta(days=valid_period)
     if develop_mode:
@@ -181,14 +383,21 @@ def password_expiration_check(
         warn_time_diff = timedelta(minutes=warn_window)
     warn_datetime = valid_datetime + warn_time_diff
 
-    print(f"Password expiration datetime {valid_datetime}")
-    print(f"Password warning datetime {warn_datetime}")
+    logger.info("Password expiration datetime %s", valid_datetime)
+    logger.info("Password warning datetime %s", warn_datetime)
 
-    client = boto3.client("cognito-idp")
+    client = boto3.client(
+        "cognito-idp",
+        config=Config(
+            max_pool_connections=max(10, max_workers),
+            retries={"mode": "standard", "max_attempts": cognito_max_attempts},
+        ),
+    )
 
+    metrics.call("DescribeUserPool")
     user_pool_info = client.describe_user_pool(UserPoolId=user_pool_id)
     if develop_mode:
-        print(user_pool_info)
+        logger.debug("%s", user_pool_info)
 
     user_pool = user_pool_info.get("UserPool", {})
     user_pool_name = user_pool.get("Name", "Undefined")
@@ -207,62 +416,216 @@ def password_expiration_check(
         "temp_password_validity_days": temp_password_validity_days,
     }
 
-    users = get_userpool_users(client, user_pool_id)
-    for user in users:
-        username = user["Username"]
-        user_email = extract_user_email(user)
-
-        password_change_required, issue_warning, last_event_date = validate_user_password(
-            client, user_pool_id, user, valid_datetime, warn_datetime
+    # Templates are parsed once, and rendered for each user with its own data over the pool's message data
+    expired_message_template = MessageTemplate(expired_message_template)
+    expired_subject_template = MessageTemplate(expired_subject_template)
+    warning_message_template = MessageTemplate(warning_message_template)
+    warning_subject_template = MessageTemplate(warning_subject_template)
+
+    limiter = RateLimiter(request_rate)
+    with metrics.time("state_store"):
+        states = state_store.load(user_pool_id) if state_store is not None else None
+    saved_states = dict(states) if states is not None else None
+    # Per user messages are only built if they are logged
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    def validate(item):
+        # Messages are held until the user's turn so that the log reads as if users were validated one at a time
+        _pagination_token, user = item
+        messages = []
+        validation = validate_user_password(
+            client,
+            user_pool_id,
+            user,
+            valid_datetime,
+            warn_datetime,
+            limiter,
+            messages.append if debug else None,
+            states,
+            metrics,
         )
-
-        if develop_mode:
-            print(f"User : {username}")
-
-        if last_event_date is not None:
-            # calculate actual expiration date based on last qualifying event
-            actual_expire_date = last_event_date + timedelta(days=valid_period)
-            message_data["expiration_date"] = actual_expire_date.strftime("%D")
-        else:
-            message_data["expiration_date"] = "N/A"
-        message_data["username"] = username
-        message_data["user_email"] = user_email
-        if password_change_required:
-            temp_password = generate_random_string(temporary_password_length)
-            message_data["temp_password"] = temp_password
-            expired_message = expired_message_template.format(**message_data)
-            expired_subject = expired_subject_template.format(**message_data)
-            if develop_mode:
-                print(expired_message)
-            if user_email is None:
-                print(
-                    f"WARNING: {username} does not have an assigned email address in user pool "
-                    f"{user_pool_id}/{user_pool_name}. Account password has been reset but an email "
-                    "message will not be sent."
-                )
-            elif smtp_endpoint is not None:
-                send_mail(smtp_endpoint, sender, user_email, expired_subject, expired_message)
-            if apply_changes:
+        return validation, messages
+
+    resumed_token = checkpoint["pagination_token"]
+    resumed_users = set(checkpoint["processed"])
+    pages = iter_userpool_pages(client, user_pool_id, resumed_token, user_attributes_to_get, metrics)
+    # Users are streamed from the listing to validation, leaving out those of a resumed page already handled
+    items = (
+        (pagination_token, user)
+        for pagination_token, page_users in pages
+        for user in page_users
+        if pagination_token != resumed_token or user["Username"] not in resumed_users
+    )
+    # Users handled but not yet recorded in the checkpoint, in user pool order: (username, notification Future or
+    # None, temporary password or None). An expired password is only reset once its notification is delivered.
+    pending = deque()
+
+    def wait_limit():
+        # Seconds notifications may be waited for, leaving the time to save the states and checkpoint
+        if remaining_millis is None:
+            return None
+        return max(0.0, remaining_millis() / 1000 - state_save_margin)
+
+    def finish_users(backlog=0, timeout=None):
+        # Record the users at the front of pending whose notification is settled, waiting while more than backlog are
+        # for at most timeout seconds in all, if given. Returns False if the wait timed out.
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while pending and (len(pending) > backlog or pending[0][1] is None or pending[0][1].done()):
+            notification = pending[0][1]
+            if notification is not None:
+                try:
+                    notification.exception(timeout=max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+                except TimeoutError:
+                    return False
+            username, notification, temp_password = pending.popleft()
+            failed = notification is not None and notification.exception() is not None
+            if failed:
+                if temp_password is not None:
+                    logger.warning(
+                        "%s could not be notified, the expired password is not reset.",
+                        username,
+                        extra={"username": username, "action": "not_reset"},
+                    )
+                    metrics.count("not_reset")
+            elif temp_password is not None and apply_changes:
                 """
                 Change the user password.
                 admin_set_user_password is used because it is functionally cleaner. The alternative of
                 admin_reset_user_password requires construction of a web-app that performs the
                 confirm_user_password portion of that process.
                 """
-                client.admin_set_user_password(
-                    UserPoolId=user_pool_id, Username=username, Password=temp_password, Permanent=False
+                metrics.call("AdminSetUserPassword")
+                with metrics.time("reset"):
+                    client.admin_set_user_password(
+                        UserPoolId=user_pool_id, Username=username, Password=temp_password, Permanent=False
+                    )
+                logger.info("Reset the password of %s.", username, extra={"username": username, "action": "reset"})
+                metrics.count("resets")
+            if not failed:
+                checkpoint["processed"].append(username)
+        return True
+
+    def save_progress(recorded_checkpoint, log=logger.debug):
+        # Save the states changed since the last save, and the checkpoint (removed if None)
+        changed_states = {
+            username: state for username, state in list(states.items()) if saved_states.get(username) != state
+        }
+        log("Saving the password state of %d user(s).", len(changed_states))
+        with metrics.time("state_store"):
+            state_store.save(user_pool_id, changed_states)
+            state_store.save_checkpoint(user_pool_id, recorded_checkpoint)
+        saved_states.update(changed_states)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    completed = False
+    try:
+        for (pagination_token, user), (validation, messages) in map_in_order(
+            executor, validate, items, 4 * max_workers
+        ):
+            seconds_left = remaining_millis() / 1000 if remaining_millis is not None else None
+            if state_store is not None and seconds_left is not None and seconds_left < checkpoint_margin:
+                logger.info("Stopping with %.0f seconds left, the run will resume from here.", seconds_left)
+                break
+            if pagination_token != checkpoint["pagination_token"]:
+                if not finish_users(timeout=wait_limit()):
+                    break
+                checkpoint["pagination_token"] = pagination_token
+                checkpoint["processed"] = []
+                if state_store is not None:
+                    # Saved with the lease held: a run killed after this is resumed from here once the lease expires
+                    save_progress(checkpoint)
+            username = user["Username"]
+            for message in messages:
+                logger.debug(message, extra={"username": username})
+            user_email = extract_user_email(user)
+            password_change_required, issue_warning, last_event_date = validation
+            metrics.count("users")
+
+            user_data = {"username": username, "user_email": user_email}
+            if last_event_date is not None:
+                # calculate actual expiration date based on last qualifying event
+                actual_expire_date = last_event_date + timedelta(days=valid_period)
+                user_data["expiration_date"] = actual_expire_date.strftime("%D")
+            else:
+                user_data["expiration_date"] = "N/A"
+            notification = None
+            temp_password = None
+            if password_change_required:
+                logger.info("Password of %s has expired.", username, extra={"username": username, "action": "expired"})
+                metrics.count("expired")
+                temp_password = generate_random_string(temporary_password_length)
+                user_data["temp_password"] = temp_password
+                data = ChainMap(user_data, message_data)
+                expired_message = expired_message_template.render(data)
+                expired_subject = expired_subject_template.render(data)
+                if develop_mode:
+                    logger.debug(expired_message)
+                if user_email is None:
+                    logger.warning(
+                        "%s does not have an assigned email address in user pool %s/%s. Account password has been "
+                        "reset but an email message will not be sent.",
+                        username,
+                        user_pool_id,
+                        user_pool_name,
+                        extra={"username": username},
+                    )
+                elif outbox is not None:
+                    notification = outbox.send(user_email, expired_subject, expired_message)
+            elif issue_warning:
+                # send out a message indicating that the user's password is about to expire
+                logger.info(
+                    "Password of %s expires on %s.",
+                    username,
+                    user_data["expiration_date"],
+                    extra={"username": username, "action": "warned"},
+                )
+                metrics.count("warned")
+                data = ChainMap(user_data, message_data)
+                warning_message = warning_message_template.render(data)
+                warning_subject = warning_subject_template.render(data)
+                if develop_mode:
+                    logger.debug(warning_message)
+                if user_email is None:
+                    logger.warning(
+                        "%s does not have an assigned email address in user pool %s/%s. A password expiration "
+                        "imminent warning email message will not be sent.",
+                        username,
+                        user_pool_id,
+                        user_pool_name,
+                        extra={"username": username},
+                    )
+                elif outbox is not None:
+                    notification = outbox.send(user_email, warning_subject, warning_message)
+            pending.append((username, notification, temp_password))
+            if not finish_users(notification_backlog, wait_limit()):
+                break
+        else:
+            completed = True
+    finally:
+        # Stop validating the remaining users if handling one of them failed
+        executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            if not finish_users(timeout=wait_limit()):
+                # The users left are handled again by the next run; cancelling their unsent notifications keeps them
+                # from being sent twice
+                completed = False
+                cancelled = sum(
+                    1 for _username, notification, _password in pending if notification and notification.cancel()
                 )
-        elif issue_warning:
-            # send out a message indicating that the user's password is about to expire
-            warning_message = warning_message_template.format(**message_data)
-            warning_subject = warning_subject_template.format(**message_data)
-            if develop_mode:
-                print(warning_message)
-            if user_email is None:
-                print(
-                    f"WARNING: {username} does not have an assigned email address in user pool "
-                    f"{user_pool_id}/{user_pool_name}. A password expiration imminent warning email "
-                    "message will not be sent."
+                logger.warning(
+                    "Out of time with %d notification(s) awaiting delivery, %d of them not sent and cancelled; "
+                    "their users are left to the next run.",
+                    len(pending),
+                    cancelled,
                 )
-            elif smtp_endpoint is not None:
-                send_mail(smtp_endpoint, sender, user_email, warning_subject, warning_message)
+        except BaseException:
+            completed = False
+            raise
+        finally:
+            if state_store is not None:
+                if not completed:
+                    checkpoint["lease_expires"] = None
+                save_progress(None if completed else checkpoint, logger.info)
+            metrics.log_summary()
+
+    return completed
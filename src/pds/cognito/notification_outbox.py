@@ -0,0 +1,220 @@
+"""Outbox of email notifications delivered by a small pool of SMTP connections.
+
+Messages are queued by send, which returns at once with a Future, and delivered by worker threads each holding its
+own SMTP connection. A worker reconnects when its connection drops and retries a message on transient failures
+(dropped connections, network errors and 4xx replies) with exponential backoff, so that one slow or broken SMTP
+session neither stalls nor aborts a run. Deliveries of all the workers are held below a common rate, such as the
+SES maximum send rate.
+
+Connections are opened by a callable given to the outbox, normally open_smtp from common. Any other SMTP server,
+such as a local aiosmtpd stand-in, can be used by giving a callable returning a connected smtplib.SMTP.
+
+Message subjects and bodies are str.format templates, parsed once by MessageTemplate and rendered for each user.
+"""
+import logging
+import smtplib
+import string
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue
+
+from common import RateLimiter  # type: ignore[import]
+from common import send_mail  # type: ignore[import]
+from run_metrics import RunMetrics  # type: ignore[import]
+
+
+logger = logging.getLogger(__name__)
+
+# Attempts made to deliver a message, with exponential backoff in between
+smtp_max_attempts = 4
+
+# Seconds before the first retry of a message, doubled at each following one
+smtp_retry_delay = 1.0
+
+
+class MessageTemplate:
+    """A str.format template parsed once and rendered for any number of messages.
+
+    Only keyword fields are supported, as templates are rendered with named message data.
+    """
+
+    _formatter = string.Formatter()
+
+    def __init__(self, template):
+        """Parse the template, raising ValueError if it is malformed or has positional fields."""
+        self.template = template
+        # (literal text, field name, format spec, conversion) with field name None after the last field
+        self._parts = list(self._formatter.parse(template))
+        for _literal, field_name, _format_spec, _conversion in self._parts:
+            if field_name is not None and (field_name == "" or field_name[0].isdigit()):
+                raise ValueError(f"Positional field in message template: {template!r}")
+        # Names of the data entries the template refers to
+        self.fields = {
+            field_name.split(".")[0].split("[")[0]
+            for _literal, field_name, _format_spec, _conversion in self._parts
+            if field_name
+        }
+
+    def render(self, data):
+        """Return the template with its fields replaced by the values in the data mapping."""
+        formatter = self._formatter
+        pieces = []
+        for literal, field_name, format_spec, conversion in self._parts:
+            pieces.append(literal)
+            if field_name is None:
+                continue
+            value, _first = formatter.get_field(field_name, (), data)
+            value = formatter.convert_field(value, conversion)
+            if format_spec and "{" in format_spec:
+                format_spec = formatter.vformat(format_spec, (), data)
+            pieces.append(formatter.format_field(value, format_spec))
+        return "".join(pieces)
+
+
+def is_transient(error):
+    """Return whether delivering a message may succeed when retried after the given error."""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _message in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Network errors (smtplib.SMTPException is itself an OSError)
+    return isinstance(error, OSError)
+
+
+def keeps_connection(error):
+    """Return whether an SMTP connection can still be used after the given error."""
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 421: the server is closing the connection
+        return error.smtp_code != 421
+    return isinstance(error, smtplib.SMTPRecipientsRefused)
+
+
+class SmtpOutbox:
+    """Queue of email messages delivered by a pool of SMTP connections.
+
+    The outbox is thread-safe. It must be closed, which waits until every queued message is delivered or has failed.
+    """
+
+    def __init__(
+        self,
+        connect,
+        sender,
+        connections=2,
+        rate=None,
+        max_attempts=smtp_max_attempts,
+        retry_delay=smtp_retry_delay,
+        metrics=None,
+    ):
+        """Start delivering messages from sender over the given number of connections opened by connect.
+
+        Args:
+            connect: Callable returning a new, logged in smtplib.SMTP connection.
+            sender (str): Email address the messages are sent from.
+            connections (int): Number of SMTP connections, each used by its own worker thread.
+            rate (float): Most messages delivered per second by all connections together, or None for no limit.
+            max_attempts (int): Attempts made to deliver a message before giving up.
+            retry_delay (float): Seconds before the first retry of a message, doubled at each following retry.
+            metrics (RunMetrics): Metrics to which delivery attempts are added, in the "email" phase.
+        """
+        self.connect = connect
+        self.sender = sender
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.reconnects = 0
+        self._limiter = RateLimiter(rate) if rate else None
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._workers = [threading.Thread(target=self._deliver, daemon=True) for _ in range(connections)]
+        for worker in self._workers:
+            worker.start()
+
+    def send(self, to_email, subject, body):
+        """Queue a message to to_email and return a Future of the number of attempts its delivery took.
+
+        The Future raises the error of the last attempt if the message could not be delivered.
+        """
+        future = Future()
+        self._queue.put((to_email, subject, body, future))
+        return future
+
+    def close(self):
+        """Deliver the queued messages, then close the connections."""
+        for _worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        logger.info(
+            "Notifications: %d sent, %d failed, %d retried, %d reconnection(s).",
+            self.sent,
+            self.failed,
+            self.retries,
+            self.reconnects,
+        )
+
+    def _deliver(self):
+        """Deliver queued messages over one connection until the outbox is closed."""
+        connection = None
+        try:
+            while True:
+                message = self._queue.get()
+                if message is None:
+                    return
+                to_email, subject, body, future = message
+                if not future.set_running_or_notify_cancel():
+                    continue
+                for attempt in range(1, self.max_attempts + 1):
+                    if self._limiter is not None:
+                        self._limiter.acquire()
+                    self.metrics.call("SendMail")
+                    try:
+                        with self.metrics.time("email"):
+                            if connection is None:
+                                connection = self.connect()
+                            send_mail(connection, self.sender, to_email, subject, body)
+                    except Exception as error:
+                        if not keeps_connection(error):
+                            # Open a new connection for the next attempt
+                            _close_quietly(connection)
+                            connection = None
+                            with self._lock:
+                                self.reconnects += 1
+                        if attempt == self.max_attempts or not is_transient(error):
+                            logger.warning(
+                                "Email to %s could not be sent after %d attempt(s): %s", to_email, attempt, error
+                            )
+                            self.metrics.count("emails_failed")
+                            with self._lock:
+                                self.failed += 1
+                            future.set_exception(error)
+                            break
+                        self.metrics.count("email_retries")
+                        with self._lock:
+                            self.retries += 1
+                        time.sleep(self.retry_delay * 2 ** (attempt - 1))
+                    else:
+                        self.metrics.count("emails_sent")
+                        with self._lock:
+                            self.sent += 1
+                        future.set_result(attempt)
+                        break
+        finally:
+            _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    """End an SMTP connection, if any, ignoring the errors of a connection that is already broken."""
+    if connection is None:
+        return
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
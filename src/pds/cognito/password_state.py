@@ -0,0 +1,207 @@
+"""Persistent record of the auth events already examined for each user of a user pool.
+
+For each user, the state holds the date of the last qualifying password change found, the newest and oldest auth
+events examined, and the user's creation date (so that a user deleted and recreated under the same name starts
+over). With it, a password expiration check only pages through the auth events newer than the newest one examined
+by the previous run.
+
+The stores also keep the checkpoint of a password expiration run that stopped before the end of the pool, so
+that a later invocation can resume it. A checkpoint is a JSON-serializable dict, kept apart from the user states.
+A run holds a lease on the checkpoint (its "owner" and "lease_expires" entries), taken with take_lease: the lease is
+only granted if the checkpoint is still the one the run loaded and no other run holds an unexpired lease on it, so
+that two invocations cannot resume the same checkpoint.
+
+States are kept in a DynamoDB table whose partition key is "user_pool_id" and sort key is "username" (both strings),
+or in a local JSON file for development and tests.
+"""
+import json
+import os
+from datetime import datetime
+
+import boto3
+
+
+# Fields of a user's password state, all datetimes (or None)
+state_fields = ("last_change", "newest_event", "oldest_event", "user_create_date")
+
+
+def checkpoint_key(user_pool_id):
+    """Return the key under which the checkpoint of a pool is kept (pool ids do not contain "#")."""
+    return f"{user_pool_id}#checkpoint"
+
+
+def is_leased_to_other(checkpoint, owner, now):
+    """Return whether a checkpoint (or None) is leased, after the datetime now, to another owner than the given one."""
+    lease_expires = checkpoint.get("lease_expires") if checkpoint is not None else None
+    return (
+        lease_expires is not None
+        and datetime.fromisoformat(lease_expires) > now
+        and checkpoint.get("owner") != owner
+    )
+
+
+def serialize_state(state):
+    """Convert a password state to a dict of ISO 8601 strings, leaving out unknown dates."""
+    return {field: state[field].isoformat() for field in state_fields if state.get(field) is not None}
+
+
+def deserialize_state(record):
+    """Convert a serialized password state back to a dict of datetimes."""
+    return {field: datetime.fromisoformat(record[field]) if record.get(field) else None for field in state_fields}
+
+
+class JsonPasswordStateStore:
+    """Password states kept in a local JSON file, keyed by user pool id and username."""
+
+    def __init__(self, path):
+        """Use the JSON file at path, which is created on the first save."""
+        self.path = path
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as state_file:
+            return json.load(state_file)
+
+    def _write(self, pools):
+        partial_path = f"{self.path}.partial"
+        with open(partial_path, "w") as state_file:
+            json.dump(pools, state_file, indent=4, sort_keys=True)
+        os.replace(partial_path, self.path)
+
+    def load(self, user_pool_id):
+        """Return the states of the users of a pool, by username."""
+        records = self._read().get(user_pool_id, {})
+        return {username: deserialize_state(record) for username, record in records.items()}
+
+    def save(self, user_pool_id, states):
+        """Add or replace the given states of users of a pool."""
+        pools = self._read()
+        records = pools.setdefault(user_pool_id, {})
+        for username, state in states.items():
+            records[username] = serialize_state(state)
+        self._write(pools)
+
+    def load_checkpoint(self, user_pool_id):
+        """Return the checkpoint of the run in progress on a pool, or None."""
+        return self._read().get(checkpoint_key(user_pool_id))
+
+    def save_checkpoint(self, user_pool_id, checkpoint):
+        """Record the checkpoint of the run in progress on a pool, or remove it if checkpoint is None."""
+        pools = self._read()
+        if checkpoint is None:
+            pools.pop(checkpoint_key(user_pool_id), None)
+        else:
+            pools[checkpoint_key(user_pool_id)] = checkpoint
+        self._write(pools)
+
+    def take_lease(self, user_pool_id, checkpoint, previous):
+        """Record a checkpoint leased to its owner, unless the checkpoint recorded is no longer previous or is leased.
+
+        The lease is taken at once in one process only: the JSON file is not locked.
+
+        Args:
+            user_pool_id (str): The pool of the run.
+            checkpoint (dict): The checkpoint of the run, whose "owner" and "lease_expires" entries are set.
+            previous (dict): The checkpoint loaded by the run, or None if there was none.
+
+        Returns:
+            bool: Whether the lease was taken.
+        """
+        pools = self._read()
+        recorded = pools.get(checkpoint_key(user_pool_id))
+        if recorded != previous or is_leased_to_other(recorded, checkpoint["owner"], datetime.now()):
+            return False
+        pools[checkpoint_key(user_pool_id)] = checkpoint
+        self._write(pools)
+        return True
+
+
+class DynamoDBPasswordStateStore:
+    """Password states kept in a DynamoDB table keyed by user_pool_id and username."""
+
+    def __init__(self, table_name, dynamodb=None):
+        """Use the named table, through the given DynamoDB service resource if any."""
+        self.table = (dynamodb or boto3.resource("dynamodb")).Table(table_name)
+
+    def load(self, user_pool_id):
+        """Return the states of the users of a pool, by username."""
+        states = {}
+        query = {
+            "KeyConditionExpression": "user_pool_id = :user_pool_id",
+            "ExpressionAttributeValues": {":user_pool_id": user_pool_id},
+        }
+        while True:
+            response = self.table.query(**query)
+            for item in response["Items"]:
+                states[item["username"]] = deserialize_state(item)
+            if "LastEvaluatedKey" not in response:
+                return states
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def save(self, user_pool_id, states):
+        """Add or replace the given states of users of a pool."""
+        with self.table.batch_writer() as batch:
+            for username, state in states.items():
+                batch.put_item(Item={"user_pool_id": user_pool_id, "username": username, **serialize_state(state)})
+
+    def load_checkpoint(self, user_pool_id):
+        """Return the checkpoint of the run in progress on a pool, or None."""
+        response = self.table.get_item(
+            Key={"user_pool_id": checkpoint_key(user_pool_id), "username": "checkpoint"}, ConsistentRead=True
+        )
+        item = response.get("Item")
+        return json.loads(item["checkpoint"]) if item is not None else None
+
+    def save_checkpoint(self, user_pool_id, checkpoint):
+        """Record the checkpoint of the run in progress on a pool, or remove it if checkpoint is None."""
+        if checkpoint is None:
+            self.table.delete_item(Key={"user_pool_id": checkpoint_key(user_pool_id), "username": "checkpoint"})
+        else:
+            self.table.put_item(Item=self._checkpoint_item(user_pool_id, checkpoint))
+
+    def take_lease(self, user_pool_id, checkpoint, previous):
+        """Record a checkpoint leased to its owner, unless the checkpoint recorded is no longer previous or is leased.
+
+        The checkpoint is written with a conditional put, so that of several runs taking the lease at the same time,
+        only one gets it.
+
+        Args:
+            user_pool_id (str): The pool of the run.
+            checkpoint (dict): The checkpoint of the run, whose "owner" and "lease_expires" entries are set.
+            previous (dict): The checkpoint loaded by the run, or None if there was none.
+
+        Returns:
+            bool: Whether the lease was taken.
+        """
+        # ISO 8601 datetimes of the same form compare as strings; "owner" is a DynamoDB reserved word
+        condition = "(attribute_not_exists(lease_expires) OR lease_expires < :now OR #owner = :owner) AND "
+        values = {":now": datetime.now().isoformat(), ":owner": checkpoint["owner"]}
+        if previous is None:
+            condition += "attribute_not_exists(checkpoint)"
+        else:
+            condition += "checkpoint = :previous"
+            values[":previous"] = json.dumps(previous)
+        try:
+            self.table.put_item(
+                Item=self._checkpoint_item(user_pool_id, checkpoint),
+                ConditionExpression=condition,
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues=values,
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    @staticmethod
+    def _checkpoint_item(user_pool_id, checkpoint):
+        # The lease is also kept in attributes of its own, for the condition of take_lease
+        item = {
+            "user_pool_id": checkpoint_key(user_pool_id),
+            "username": "checkpoint",
+            "checkpoint": json.dumps(checkpoint),
+        }
+        for name in ("owner", "lease_expires"):
+            if checkpoint.get(name) is not None:
+                item[name] = checkpoint[name]
+        return item
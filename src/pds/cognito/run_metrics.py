@@ -0,0 +1,125 @@
+"""Time spent in each phase of a password expiration run, with its API calls and outcomes.
+
+Phases are timed wherever they run, so the seconds of a phase done by several threads at once (auth event paging,
+email delivery) add up to more than the wall time of the run. The metrics are logged as a summary at the end of a
+run, and can be emitted in the CloudWatch Embedded Metric Format (EMF): a JSON line written to the Lambda's standard
+output, from which CloudWatch extracts the metrics without any PutMetricData call.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Phases of a run, in the order they are reported
+phases = ("listing", "rate_limit_wait", "auth_events", "decision", "email", "reset", "state_store")
+
+
+def metric_name(name, suffix=""):
+    """Return the CloudWatch metric name of a snake_case or CamelCase name, e.g. "auth_events" gives "AuthEvents"."""
+    return "".join(word[:1].upper() + word[1:] for word in name.split("_")) + suffix
+
+
+class RunMetrics:
+    """Seconds per phase, API calls and outcome counts of a run; thread-safe."""
+
+    def __init__(self):
+        """Start measuring a run."""
+        self.started = time.monotonic()
+        self.seconds = defaultdict(float)
+        self.api_calls = defaultdict(int)
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, phase):
+        """Add the time spent in the with block to the phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.seconds[phase] += elapsed
+
+    def call(self, api):
+        """Count a request to the named API (e.g. "ListUsers")."""
+        with self._lock:
+            self.api_calls[api] += 1
+
+    def count(self, name, number=1):
+        """Add number to the count of an outcome (e.g. "users", "resets")."""
+        with self._lock:
+            self.counts[name] += number
+
+    def elapsed(self):
+        """Seconds since the run started."""
+        return time.monotonic() - self.started
+
+    def to_dict(self):
+        """Return the metrics as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                "elapsed_seconds": round(self.elapsed(), 3),
+                "phase_seconds": {phase: round(self.seconds[phase], 3) for phase in _ordered(self.seconds)},
+                "api_calls": dict(self.api_calls),
+                "counts": dict(self.counts),
+            }
+
+    def log_summary(self):
+        """Log the metrics in one line, with the metrics dict as the structured field run_metrics."""
+        summary = self.to_dict()
+        phase_seconds = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in summary["phase_seconds"].items())
+        api_calls = ", ".join(f"{api} {calls}" for api, calls in summary["api_calls"].items())
+        counts = ", ".join(f"{name} {number}" for name, number in summary["counts"].items())
+        logger.info(
+            "Run took %.2fs. Phases: %s. API calls: %s. Counts: %s.",
+            summary["elapsed_seconds"],
+            phase_seconds or "none",
+            api_calls or "none",
+            counts or "none",
+            extra={"run_metrics": summary},
+        )
+
+    def emf(self, namespace, dimensions):
+        """Return the metrics as a CloudWatch Embedded Metric Format document.
+
+        Args:
+            namespace (str): CloudWatch namespace of the metrics.
+            dimensions (dict): Dimension names and values shared by all the metrics, e.g. the user pool id.
+        """
+        summary = self.to_dict()
+        values = {"ElapsedSeconds": (summary["elapsed_seconds"], "Seconds")}
+        for phase, seconds in summary["phase_seconds"].items():
+            values[metric_name(phase, "Seconds")] = (seconds, "Seconds")
+        for api, calls in summary["api_calls"].items():
+            values[metric_name(api, "Calls")] = (calls, "Count")
+        for name, number in summary["counts"].items():
+            values[metric_name(name)] = (number, "Count")
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (_value, unit) in values.items()],
+                    }
+                ],
+            },
+            **dimensions,
+            **{name: value for name, (value, _unit) in values.items()},
+        }
+
+    def print_emf(self, namespace, dimensions):
+        """Write the metrics as an EMF line to the standard output, where the Lambda log agent picks them up."""
+        print(json.dumps(self.emf(namespace, dimensions)), flush=True)
+
+
+def _ordered(seconds):
+    """Return the phases timed, known phases first in their reporting order."""
+    return [phase for phase in phases if phase in seconds] + sorted(set(seconds) - set(phases))
@@ -0,0 +1,118 @@
+"""Sequential writer of downloaded objects into a single tar or zip archive.
+
+Writing hundreds of thousands of small files costs a directory lookup, an inode and a file creation each, which is
+slow on shared filesystems and strains inode quotas. pdc-s3-download can instead append every downloaded object to
+one archive. Objects arrive from concurrent downloads in any order and are appended one at a time by a single
+writer, so the archive is written strictly sequentially.
+
+Compressing tar archives with zstd requires the optional zstandard package.
+"""
+import contextlib
+import importlib
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+
+
+ARCHIVE_FORMATS = ("tar", "tar.gz", "tar.zst", "zip")
+
+# File name suffixes recognized for each format.
+ARCHIVE_SUFFIXES = {
+    ".tar": "tar",
+    ".tar.gz": "tar.gz",
+    ".tgz": "tar.gz",
+    ".tar.zst": "tar.zst",
+    ".tzst": "tar.zst",
+    ".zip": "zip",
+}
+
+ZSTD_LEVEL = 3
+
+# Earliest timestamp a zip entry can hold (1980-01-01).
+ZIP_EPOCH = 315532800
+
+
+def archive_format_for(path):
+    """Return the archive format matching the suffix of path, or None if it is not recognized."""
+    for suffix, archive_format in ARCHIVE_SUFFIXES.items():
+        if path.lower().endswith(suffix):
+            return archive_format
+    return None
+
+
+class ArchiveWriter:
+    """Append files to a tar, gzipped tar, zstd-compressed tar or zip archive.
+
+    The archive is written under a temporary name and renamed to its final path by ``close``, so an interrupted run
+    never leaves a truncated archive that looks complete.
+    """
+
+    def __init__(self, path, archive_format):
+        """Create the archive at path in one of ARCHIVE_FORMATS."""
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unsupported archive format: {archive_format}")
+        self.path = path
+        self.archive_format = archive_format
+        self.entries = 0
+        zstandard = _import_zstandard() if archive_format == "tar.zst" else None
+        self._partial_path = f"{path}.pdc-partial"
+        self._file = open(self._partial_path, "wb")
+        self._compressor = None
+        if archive_format == "zip":
+            self._archive = zipfile.ZipFile(self._file, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        elif archive_format == "tar.zst":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self._file, closefd=False)
+            self._archive = tarfile.open(fileobj=self._compressor, mode="w|", format=tarfile.PAX_FORMAT)
+        else:
+            mode = "w|gz" if archive_format == "tar.gz" else "w|"
+            self._archive = tarfile.open(fileobj=self._file, mode=mode, format=tarfile.PAX_FORMAT)
+
+    def add(self, name, fileobj, size, mtime=None):
+        """Append size bytes read from fileobj as the archive member name, modified at mtime (default: now)."""
+        mtime = time.time() if mtime is None else mtime
+        if self.archive_format == "zip":
+            info = zipfile.ZipInfo(name, time.gmtime(max(mtime, ZIP_EPOCH))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with self._archive.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as member:
+                shutil.copyfileobj(fileobj, member)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            self._archive.addfile(info, fileobj)
+        self.entries += 1
+
+    def close(self):
+        """Finish the archive and move it to its final path."""
+        self._archive.close()
+        if self._compressor is not None:
+            self._compressor.close()
+        self._file.close()
+        os.replace(self._partial_path, self.path)
+
+    def abort(self):
+        """Stop writing and remove the incomplete archive."""
+        try:
+            # Closed first so that they do not flush into the closed file when garbage collected.
+            with contextlib.suppress(Exception):
+                self._archive.close()
+                if self._compressor is not None:
+                    self._compressor.close()
+            self._file.close()
+        finally:
+            if os.path.exists(self._partial_path):
+                os.remove(self._partial_path)
+
+
+def _import_zstandard():
+    """Import zstandard, explaining how to install the optional dependency if it is missing."""
+    try:
+        return importlib.import_module("zstandard")
+    except ImportError as error:
+        raise RuntimeError(
+            "zstd-compressed archives require zstandard; install it with 'pip install pds.pdc-cloud-tools[zstd]'"
+        ) from error
@@ -0,0 +1,144 @@
+"""Content-addressed store of downloaded objects, deduplicated by ETag and size.
+
+PDS bundles hold many byte-identical objects under different keys, across versions and collections. With a content
+store, pdc-s3-download downloads each distinct (ETag, size) once into the store and gives every key its local path
+as a link to the stored copy:
+
+1. a hard link, which costs no space or copying but requires the store and the destination to be on the same
+   filesystem;
+2. otherwise a reflink (a copy-on-write clone, on filesystems such as Btrfs and XFS);
+3. otherwise a plain copy.
+
+Hard-linked files share their data and modification time with the stored copy, so they should not be modified in
+place. When several keys of the same content are downloaded at the same time, one of them downloads it and the
+others wait for it.
+"""
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+# ioctl request cloning a whole file on Linux (FICLONE, _IOW(0x94, 9, int)).
+FICLONE = 0x40049409
+
+_UNSAFE_CHARACTERS = re.compile(r"[^0-9A-Za-z-]")
+
+
+class ContentStore:
+    """Directory of object contents named by ETag and size, shared by the keys holding the same content.
+
+    The store is thread-safe.
+    """
+
+    def __init__(self, root):
+        """Open (creating if needed) the store in the root directory."""
+        self.root = root
+        self.stored_objects = 0
+        self.reused_objects = 0
+        self.reused_bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def path_for(self, e_tag, size):
+        """Return the path of the stored content with the given ETag and size."""
+        name = _UNSAFE_CHARACTERS.sub("_", e_tag.strip('"')) + f"-{size}"
+        return os.path.join(self.root, name[:2], name)
+
+    def materialize(self, e_tag, size, local_file_path, fetch, last_modified=None):
+        """Give local_file_path the content with the given ETag and size, downloading it only if it is not stored.
+
+        Args:
+            e_tag (str): ETag of the object.
+            size (int): Size of the object in bytes.
+            local_file_path (str): Path of the object's local copy.
+            fetch: Callable downloading the object to the path it is given, which it must write atomically.
+            last_modified (float): POSIX timestamp given to a copy of the content (linked files share the stored
+                copy's time).
+
+        Returns:
+            str: How the local copy was made: "hardlink", "reflink" or "copy".
+        """
+        store_path = self.path_for(e_tag, size)
+        with self._lock:
+            future = self._in_flight.get(store_path)
+            owner = future is None and not _has_size(store_path, size)
+            if owner:
+                future = self._in_flight[store_path] = Future()
+
+        if owner:
+            try:
+                os.makedirs(os.path.dirname(store_path), exist_ok=True)
+                fetch(store_path)
+                future.set_result(None)
+            except BaseException as error:
+                future.set_exception(error)
+                raise
+            finally:
+                with self._lock:
+                    del self._in_flight[store_path]
+            with self._lock:
+                self.stored_objects += 1
+        else:
+            if future is not None:
+                future.result()
+            with self._lock:
+                self.reused_objects += 1
+                self.reused_bytes += size
+
+        return link_or_copy(store_path, local_file_path, last_modified)
+
+
+def link_or_copy(source_path, target_path, last_modified=None):
+    """Replace target_path with a hard link to source_path, or else a reflink or a copy of it.
+
+    The directory of target_path is created if needed. A reflink or copy is given the last_modified time, if set.
+    Returns "hardlink", "reflink" or "copy".
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    partial_path = target_path + ".pdc-partial"
+    if os.path.lexists(partial_path):
+        os.remove(partial_path)
+    try:
+        try:
+            os.link(source_path, partial_path)
+            method = "hardlink"
+        except OSError:
+            method = "reflink" if _reflink(source_path, partial_path) else "copy"
+            if method == "copy":
+                shutil.copyfile(source_path, partial_path)
+            if last_modified is not None:
+                os.utime(partial_path, (last_modified, last_modified))
+        os.replace(partial_path, target_path)
+    finally:
+        # Renaming a link over another link to the same file does nothing, leaving the partial link behind.
+        if os.path.lexists(partial_path):
+            os.remove(partial_path)
+    return method
+
+
+def _reflink(source_path, target_path):
+    """Clone source_path into target_path with the FICLONE ioctl; return whether the filesystem supports it."""
+    if fcntl is None:
+        return False
+    try:
+        with open(source_path, "rb") as source, open(target_path, "wb") as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _has_size(path, size):
+    """Return whether a file exists at path with the given size."""
+    try:
+        return os.stat(path).st_size == size
+    except OSError:
+        return False
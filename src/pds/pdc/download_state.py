@@ -0,0 +1,177 @@
+"""Persistent record of the objects pdc-s3-download has written to a local directory.
+
+Each completed download is recorded with the object's size, ETag and LastModified time, together with the
+modification time given to the local file. A later run in sync mode uses the record to skip objects whose local copy
+is still current, so an interrupted transfer picks up where it stopped instead of starting over.
+
+Records are committed in batches; if a run is killed, at most the last batch of records is lost and those objects
+are compared by size and modification time (or downloaded again when comparing ETags).
+
+Objects that could not be downloaded are written to a separate failure journal, one JSON object per line with the
+object's key, size, ETag and LastModified time, the class and message of the error and the attempts made, so that a
+later run can retry only those objects.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+
+STATE_FILE_NAME = ".pdc-s3-download-state.sqlite"
+
+FAILURES_FILE_NAME = ".pdc-s3-download-failures.jsonl"
+
+# Records written per transaction, and the longest time a record waits to be committed.
+COMMIT_EVERY = 1000
+COMMIT_INTERVAL = 5.0
+
+
+def default_state_path(local_dest_dir):
+    """Return the state journal path for a local destination directory."""
+    return os.path.join(local_dest_dir, STATE_FILE_NAME)
+
+
+def default_failures_path(local_dest_dir):
+    """Return the failure journal path for a local destination directory."""
+    return os.path.join(local_dest_dir, FAILURES_FILE_NAME)
+
+
+class DownloadStateJournal:
+    """SQLite-backed record of downloaded objects, keyed by object key."""
+
+    def __init__(self, state_path):
+        """Open (creating if needed) the journal at state_path."""
+        self.state_path = state_path
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._connection = sqlite3.connect(state_path)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS downloads ("
+            "key TEXT PRIMARY KEY, size INTEGER, e_tag TEXT, last_modified REAL, local_path TEXT, mtime_ns INTEGER)"
+        )
+        self._connection.commit()
+
+    def get(self, key):
+        """Return the (size, e_tag, last_modified, local_path, mtime_ns) record of a key, or None."""
+        return self._connection.execute(
+            "SELECT size, e_tag, last_modified, local_path, mtime_ns FROM downloads WHERE key = ?", (key,)
+        ).fetchone()
+
+    def record(self, key, size, e_tag, last_modified, local_path):
+        """Record a completed download; last_modified is a POSIX timestamp or None."""
+        mtime_ns = os.stat(local_path).st_mtime_ns
+        self._connection.execute(
+            "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?)",
+            (key, size, e_tag, last_modified, os.path.abspath(local_path), mtime_ns),
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY or time.monotonic() - self._last_commit >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        """Commit the records written since the last commit."""
+        self._connection.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        """Commit pending records and close the journal."""
+        self.commit()
+        self._connection.close()
+
+
+class FailureJournal:
+    """JSON Lines record of the objects that could not be downloaded.
+
+    The journal is shared by runs over different buckets and prefixes. The entries it holds when it is opened are
+    kept until a run downloads (or finds up to date) their object, reported with ``record_success``. Failures of the
+    run are written to a temporary file as they happen, and ``close`` writes the journal back with the earlier
+    entries still failing followed by those of the run, or removes it if none remain.
+    """
+
+    def __init__(self, path):
+        """Open the journal at path, loading its entries; nothing is written until ``close``."""
+        self.path = path
+        self.failures = 0
+        self._partial_path = f"{path}.pdc-partial"
+        self._file = None
+        self._earlier = _read_entries(path) if os.path.exists(path) else {}
+
+    def record(self, bucket_name, obj, error, attempts):
+        """Record that an object (a ListObjectsV2 ``Contents`` entry) failed with error after attempts attempts."""
+        last_modified = obj.get("LastModified")
+        entry = {
+            "bucket": bucket_name,
+            "key": obj["Key"],
+            "size": obj["Size"],
+            "e_tag": obj.get("ETag"),
+            "last_modified": last_modified.isoformat() if last_modified is not None else None,
+            "error": type(error).__name__,
+            "code": error.response.get("Error", {}).get("Code") if isinstance(error, ClientError) else None,
+            "message": str(error),
+            "attempts": attempts,
+        }
+        self._earlier.pop((bucket_name, obj["Key"]), None)
+        if self._file is None:
+            self._file = open(self._partial_path, "w")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self.failures += 1
+
+    def record_success(self, bucket_name, key):
+        """Drop the earlier entry of an object this run has downloaded or found up to date, if there is one."""
+        self._earlier.pop((bucket_name, key), None)
+
+    def close(self):
+        """Write the earlier entries still failing and the failures of this run, or remove the journal if none."""
+        if self._file is not None:
+            self._file.close()
+        if self._earlier or self._file is not None:
+            merged_path = f"{self.path}.pdc-merged"
+            with open(merged_path, "w") as merged_file:
+                for entry in self._earlier.values():
+                    merged_file.write(json.dumps(entry) + "\n")
+                if self._file is not None:
+                    with open(self._partial_path) as partial_file:
+                        shutil.copyfileobj(partial_file, merged_file)
+            os.replace(merged_path, self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        if self._file is not None:
+            os.remove(self._partial_path)
+            self._file = None
+
+    def abort(self):
+        """Write the journal as ``close`` does when a run is interrupted.
+
+        Earlier entries are only dropped for objects the run completed, so the journal stays accurate.
+        """
+        self.close()
+
+
+def _read_entries(path):
+    """Return the entries of a failure journal as a dict of the last entry of each (bucket, key), in file order."""
+    entries = {}
+    with open(path) as journal_file:
+        for line in journal_file:
+            if line.strip():
+                entry = json.loads(line)
+                entries[(entry["bucket"], entry["key"])] = entry
+    return entries
+
+
+def read_failure_journal(path):
+    """Return the entries of a failure journal, the last entry of each bucket and key, in the order first recorded.
+
+    The ``last_modified`` values are parsed back into datetimes.
+    """
+    entries = list(_read_entries(path).values())
+    for entry in entries:
+        if entry.get("last_modified"):
+            entry["last_modified"] = datetime.fromisoformat(entry["last_modified"])
+    return entries
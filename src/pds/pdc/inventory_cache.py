@@ -0,0 +1,145 @@
+"""Persistent cache of per-file inventory summary results.
+
+Daily inventory directories mostly hold the same parts from run to run, so pdc-inventory-summary records the
+result of each file it scans in a SQLite sidecar file and reuses it while the file is unchanged. A file is
+considered unchanged when its size and modification time (and, optionally, a SHA-256 digest of its content) match
+the cached entry, and when the entry was computed with the same summary settings. Each file has one entry, replaced
+when the file is scanned again, so that entries of changed files or earlier settings do not accumulate.
+
+The fingerprints of the files are computed by the processes scanning them (see scan_unless_cached), not by the
+cache, so that hashing the files is spread over the workers as well.
+
+Cached aggregators are stored pickled, so a cache file should only be shared between users who trust each other.
+"""
+import hashlib
+import os
+import pickle  # nosec: the cache holds results written by this tool for the same user
+import sqlite3
+
+
+CACHE_FILE_NAME = ".pdc-inventory-summary-cache.sqlite"
+
+# Bumped whenever the cache format changes, invalidating every existing entry (kept as the SQLite user_version).
+CACHE_VERSION = 2
+
+
+def default_cache_path(inventory_path):
+    """Return the sidecar cache path for an inventory directory or manifest.json path."""
+    directory = inventory_path if os.path.isdir(inventory_path) else os.path.dirname(os.path.abspath(inventory_path))
+    return os.path.join(directory, CACHE_FILE_NAME)
+
+
+def file_fingerprint(file_path, use_hash=False):
+    """Return (size, mtime_ns, digest) identifying the current content of a file; digest is None without use_hash."""
+    stat = os.stat(file_path)
+    digest = None
+    if use_hash:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as content:
+            for block in iter(lambda: content.read(1024 * 1024), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+
+    return stat.st_size, stat.st_mtime_ns, digest
+
+
+def scan_unless_cached(file_path, cached_fingerprint=None, use_hash=False, scan=None):
+    """Return (fingerprint, result) of scanning a file with scan, or (fingerprint, None) if cached_fingerprint matches.
+
+    The fingerprint is None if the file cannot be read, in which case it is scanned anyway so that scan reports the
+    error.
+    """
+    try:
+        fingerprint = file_fingerprint(file_path, use_hash)
+    except OSError:
+        fingerprint = None
+    if fingerprint is not None and fingerprint == cached_fingerprint:
+        return fingerprint, None
+    return fingerprint, scan(file_path)
+
+
+class InventorySummaryCache:
+    """SQLite-backed store of per-file (count, total_size, aggregators) results.
+
+    Results are keyed by absolute path, and only reused by runs with the same settings signature (e.g. the same
+    rollups).
+    """
+
+    def __init__(self, cache_path, use_hash=False):
+        """Open (creating if needed) the cache at cache_path.
+
+        Args:
+            cache_path (str): Path of the SQLite cache file.
+            use_hash (bool): Also require a matching SHA-256 digest of the file content, at the cost of reading
+                every file on each run.
+        """
+        self.cache_path = cache_path
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(cache_path)
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version != CACHE_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS file_results")
+            self._connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_results ("
+            "path TEXT PRIMARY KEY, signature TEXT, size INTEGER, mtime_ns INTEGER, digest TEXT, "
+            "count INTEGER, total_size INTEGER, aggregators BLOB)"
+        )
+        self._connection.commit()
+
+    def cached_fingerprint(self, file_path, signature):
+        """Return the (size, mtime_ns, digest) fingerprint of the result of a file cached with the same settings."""
+        row = self._connection.execute(
+            "SELECT size, mtime_ns, digest FROM file_results WHERE path = ? AND signature = ?",
+            (os.path.abspath(file_path), signature),
+        ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def get(self, file_path, signature):
+        """Return the cached (count, total_size, aggregators, None) result of a file found unchanged, or None."""
+        row = self._connection.execute(
+            "SELECT count, total_size, aggregators FROM file_results WHERE path = ? AND signature = ?",
+            (os.path.abspath(file_path), signature),
+        ).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return row[0], row[1], pickle.loads(row[2]), None  # nosec: see module docstring
+
+    def put(self, file_path, signature, fingerprint, result):
+        """Store the result of scanning a file, replacing its previous entry; failed scans are not stored.
+
+        Args:
+            file_path (str): Path of the file.
+            signature (str): Settings signature of the result.
+            fingerprint (tuple): Fingerprint of the file taken before it was scanned, or None if it was unreadable.
+            result (tuple): (count, total_size, aggregators, error) of the scan.
+        """
+        self.misses += 1
+        count, total_size, aggregators, error = result
+        path = os.path.abspath(file_path)
+        if error is not None or fingerprint is None:
+            self._connection.execute("DELETE FROM file_results WHERE path = ?", (path,))
+        else:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO file_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, signature, *fingerprint, count, total_size, pickle.dumps(aggregators)),
+            )
+        self._connection.commit()
+
+    def evict_missing(self):
+        """Remove the entries of files that no longer exist and return how many files were removed."""
+        missing = [
+            (path,)
+            for (path,) in self._connection.execute("SELECT DISTINCT path FROM file_results")
+            if not os.path.exists(path)
+        ]
+        self._connection.executemany("DELETE FROM file_results WHERE path = ?", missing)
+        self._connection.commit()
+        return len(missing)
+
+    def close(self):
+        """Close the cache."""
+        self._connection.close()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""Compare two S3 inventory snapshots.
+
+This script reports the keys added, deleted and modified (resized or re-ETagged) between two inventory runs of a
+bucket, together with the net change in bytes. Each snapshot is given as a directory or a manifest.json path and
+is read with the same reader as pdc-inventory-summary.
+
+Both snapshots are streamed. When their parts are key-ordered the snapshots are compared with a sorted merge that
+holds one record of each in memory; otherwise each snapshot is first spilled to an on-disk SQLite index and the
+indexes are merged in key order. By default the sorted merge is tried first and the index is used if out-of-order
+keys are found.
+
+Usage:
+    python inventory_diff.py <old_inventory> <new_inventory> [--output changes.csv] [--json-output diff.json]
+        [--method {auto,merge,index}] [--spill-dir DIR]
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from itertools import islice
+
+from pds.pdc.inventory_reader import iter_inventory_records
+from pds.pdc.inventory_reader import locate_inventory
+
+
+DIFF_METHODS = ("auto", "merge", "index")
+
+# Records inserted into the spill index per transaction.
+SPILL_BATCH_SIZE = 50000
+
+
+class UnsortedInventoryError(ValueError):
+    """Raised when a snapshot read for a sorted merge is not in key order."""
+
+
+def iter_snapshot_records(inventory_path):
+    """Yield (key, size, e_tag) for the current objects of an inventory snapshot, in file order.
+
+    Noncurrent versions are left out of versioned inventories, and delete markers have no size so the reader
+    already skips them. The e_tag is None when the inventory does not include the ETag field.
+    """
+    file_paths, layout = locate_inventory(inventory_path)
+    fields = ["key", "size"]
+    if "e_tag" in layout.columns:
+        fields.append("e_tag")
+    if "is_latest" in layout.columns:
+        fields.append("is_latest")
+
+    for record in iter_inventory_records(file_paths, layout, tuple(fields)):
+        if "is_latest" in fields and str(record[-1]).lower() != "true":
+            continue
+        yield record[0], record[1], record[2] if "e_tag" in fields else None
+
+
+def _ensure_sorted(records, name):
+    """Pass records through, raising UnsortedInventoryError if their keys are not strictly increasing."""
+    previous_key = None
+    for record in records:
+        if previous_key is not None and record[0] <= previous_key:
+            raise UnsortedInventoryError(f"{name} snapshot is not in key order at {record[0]!r}")
+        previous_key = record[0]
+        yield record
+
+
+def diff_sorted_records(old_records, new_records):
+    """Yield the changes between two key-ordered streams of (key, size, e_tag) records.
+
+    Changes are (change, key, old_size, new_size, old_e_tag, new_e_tag) tuples where change is "added",
+    "deleted", "modified" or "unchanged". A record is modified when its size differs, or when both snapshots have an
+    ETag for it and the ETags differ.
+    """
+    old_records = iter(old_records)
+    new_records = iter(new_records)
+    old = next(old_records, None)
+    new = next(new_records, None)
+
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield "deleted", old[0], old[1], None, old[2], None
+            old = next(old_records, None)
+        elif old is None or new[0] < old[0]:
+            yield "added", new[0], None, new[1], None, new[2]
+            new = next(new_records, None)
+        else:
+            if old[1] != new[1] or (old[2] and new[2] and old[2] != new[2]):
+                yield "modified", old[0], old[1], new[1], old[2], new[2]
+            else:
+                yield "unchanged", old[0], old[1], new[1], old[2], new[2]
+            old = next(old_records, None)
+            new = next(new_records, None)
+
+
+def spill_records(connection, table, records):
+    """Write records to a key-indexed table of the spill database; later duplicates of a key replace earlier ones."""
+    connection.execute(f"CREATE TABLE {table} (key TEXT PRIMARY KEY, size INTEGER, e_tag TEXT) WITHOUT ROWID")
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, SPILL_BATCH_SIZE))
+        if not chunk:
+            break
+        with connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)", chunk)
+
+
+def iter_spilled_records(connection, table):
+    """Yield the records of a spill table in key order."""
+    yield from connection.execute(f"SELECT key, size, e_tag FROM {table} ORDER BY key")
+
+
+def new_diff_totals():
+    """Return zeroed diff totals."""
+    return {
+        "added_objects": 0,
+        "added_bytes": 0,
+        "deleted_objects": 0,
+        "deleted_bytes": 0,
+        "modified_objects": 0,
+        "modified_bytes_delta": 0,
+        "unchanged_objects": 0,
+        "net_bytes": 0,
+    }
+
+
+def apply_change(totals, change):
+    """Add a change, as yielded by diff_sorted_records, to the diff totals."""
+    kind, _key, old_size, new_size, _old_e_tag, _new_e_tag = change
+    if kind == "added":
+        totals["added_objects"] += 1
+        totals["added_bytes"] += new_size
+        totals["net_bytes"] += new_size
+    elif kind == "deleted":
+        totals["deleted_objects"] += 1
+        totals["deleted_bytes"] += old_size
+        totals["net_bytes"] -= old_size
+    elif kind == "modified":
+        totals["modified_objects"] += 1
+        totals["modified_bytes_delta"] += new_size - old_size
+        totals["net_bytes"] += new_size - old_size
+    else:
+        totals["unchanged_objects"] += 1
+
+
+def diff_inventories(old_path, new_path, output_path=None, method="auto", spill_dir=None):
+    """Compare two inventory snapshots.
+
+    Args:
+        old_path (str): Directory or manifest.json path of the earlier snapshot.
+        new_path (str): Directory or manifest.json path of the later snapshot.
+        output_path (str): Optional CSV file receiving one row per added, deleted or modified key.
+        method (str): "merge" to require key-ordered snapshots, "index" to always spill them to disk, or "auto" to
+            try the merge and fall back to the index when the snapshots are not key-ordered.
+        spill_dir (str): Directory for the temporary spill index (defaults to the system temporary directory).
+
+    Returns:
+        totals (dict): Counts and bytes of added, deleted, modified and unchanged objects, and the net bytes.
+        method (str): The method that produced the result, "merge" or "index".
+    """
+    if method in ("auto", "merge"):
+        try:
+            old_records = _ensure_sorted(iter_snapshot_records(old_path), "old")
+            new_records = _ensure_sorted(iter_snapshot_records(new_path), "new")
+            return _collect_changes(diff_sorted_records(old_records, new_records), output_path), "merge"
+        except UnsortedInventoryError as error:
+            if method == "merge":
+                raise
+            print(f"{error}; comparing through an on-disk index instead.")
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as temp_dir:
+        connection = sqlite3.connect(os.path.join(temp_dir, "inventory_diff.sqlite"))
+        try:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            spill_records(connection, "old", iter_snapshot_records(old_path))
+            spill_records(connection, "new", iter_snapshot_records(new_path))
+            changes = diff_sorted_records(
+                iter_spilled_records(connection, "old"), iter_spilled_records(connection, "new")
+            )
+            return _collect_changes(changes, output_path), "index"
+        finally:
+            connection.close()
+
+
+def _collect_changes(changes, output_path):
+    """Total the changes and write the ones that are not "unchanged" to the output CSV file, if any.
+
+    The file is written under a temporary name and renamed once complete, so an abandoned merge never leaves a
+    partial change list behind.
+    """
+    totals = new_diff_totals()
+    if output_path is None:
+        for change in changes:
+            apply_change(totals, change)
+        return totals
+
+    temp_path = f"{output_path}.tmp"
+    try:
+        with open(temp_path, "w", newline="") as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(["change", "key", "old_size", "new_size", "old_etag", "new_etag"])
+            for change in changes:
+                apply_change(totals, change)
+                if change[0] != "unchanged":
+                    writer.writerow(change)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return totals
+
+
+def main():
+    """main."""
+    parser = argparse.ArgumentParser(description="Report the objects that changed between two S3 inventory runs.")
+    parser.add_argument("old_inventory", help="Directory or manifest.json path of the earlier inventory")
+    parser.add_argument("new_inventory", help="Directory or manifest.json path of the later inventory")
+    parser.add_argument("--output", help="Write one CSV row per added, deleted or modified key to this file")
+    parser.add_argument("--json-output", help="Also write the diff totals to this JSON file")
+    parser.add_argument(
+        "--method",
+        choices=DIFF_METHODS,
+        default="auto",
+        help=(
+            "merge: stream key-ordered snapshots; index: spill both snapshots to an on-disk index first; "
+            "auto: merge, falling back to the index for unordered snapshots (default: auto)"
+        ),
+    )
+    parser.add_argument("--spill-dir", help="Directory for the temporary on-disk index (default: system temp dir)")
+
+    args = parser.parse_args()
+
+    for inventory_path in (args.old_inventory, args.new_inventory):
+        if not os.path.exists(inventory_path):
+            print(f"Error: {inventory_path} is not a valid directory or manifest.")
+            sys.exit(1)
+
+    try:
+        totals, method = diff_inventories(
+            args.old_inventory, args.new_inventory, args.output, args.method, args.spill_dir
+        )
+    except (OSError, ValueError, KeyError, RuntimeError) as error:
+        print(f"Error comparing inventories: {error}")
+        sys.exit(1)
+
+    print("\nInventory Diff Summary:")
+    print(f"Compared with: {method}")
+    print(f"Added objects: {totals['added_objects']} ({totals['added_bytes']} bytes)")
+    print(f"Deleted objects: {totals['deleted_objects']} ({totals['deleted_bytes']} bytes)")
+    print(f"Modified objects: {totals['modified_objects']} ({totals['modified_bytes_delta']:+d} bytes)")
+    print(f"Unchanged objects: {totals['unchanged_objects']}")
+    print(f"Net change: {totals['net_bytes']:+d} bytes")
+
+    if args.json_output:
+        with open(args.json_output, "w") as json_file:
+            json.dump(dict(totals, method=method), json_file, indent=2)
+            json_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
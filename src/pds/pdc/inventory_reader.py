@@ -0,0 +1,477 @@
+"""Read S3 inventory files.
+
+S3 Inventory reports are delivered as gzipped CSV, Apache ORC or Apache Parquet parts described by a
+``manifest.json``. The manifest's ``fileFormat`` and ``fileSchema`` entries tell which columns the parts hold, so
+this module uses them to locate the fields a tool needs instead of assuming fixed CSV positions.
+
+Inventory directories without a manifest are read as gzipped CSV with the size in the third column.
+
+Inventories can also be read straight from S3, given an ``s3://bucket/prefix`` or manifest.json URI. Parts are
+streamed from S3 and never staged on disk: gzipped CSV parts are decompressed as they download, while ORC and
+Parquet parts, which need random access, are read into memory.
+
+Reading ORC and Parquet parts requires the optional ``pyarrow`` package. When it is installed, gzipped CSV parts
+are also decompressed and parsed a block at a time by pyarrow, with the same results as the row-by-row csv module
+path used otherwise.
+"""
+import csv
+import functools
+import gzip
+import importlib.util
+import io
+import json
+import os
+import re
+from typing import NamedTuple
+from urllib.parse import unquote_plus
+
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Columns assumed for gzipped CSV inventory files found without a manifest.
+DEFAULT_CSV_COLUMNS = ("bucket", "key", "size")
+
+# Number of rows grouped into each batch yielded by iter_inventory_batches.
+BATCH_SIZE = 65536
+
+# Bytes of gzipped CSV decompressed and parsed at a time by the arrow CSV engine.
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Engines available for parsing gzipped CSV parts: "arrow" parses blocks with pyarrow, "python" parses rows with
+# the csv module, and "auto" uses arrow when pyarrow is installed.
+CSV_ENGINES = ("auto", "python", "arrow")
+
+# Columns holding timestamps, which are yielded as ISO 8601 strings whatever the file format.
+timestamp_columns = {"last_modified_date"}
+
+
+class InventoryLayout(NamedTuple):
+    """File format and column names shared by the parts of an inventory."""
+
+    file_format: str
+    columns: tuple
+
+
+DEFAULT_LAYOUT = InventoryLayout("CSV", DEFAULT_CSV_COLUMNS)
+
+
+def column_name(field_name):
+    """Convert a CSV fileSchema field name such as ``LastModifiedDate`` to its ORC/Parquet column name."""
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "_", field_name.strip()).lower()
+
+
+def parse_file_schema(file_format, file_schema):
+    """Return the column names declared by a manifest fileSchema.
+
+    CSV schemas are comma separated field names, ORC schemas are ``struct<name:type,...>`` and Parquet schemas
+    are ``message s3.inventory { required binary bucket (UTF8); ... }``.
+    """
+    file_format = file_format.upper()
+    if file_format == "CSV":
+        names = [column_name(field) for field in file_schema.split(",")]
+    elif file_format == "ORC":
+        names = re.findall(r"(\w+)\s*:", file_schema[file_schema.index("<") + 1 :])
+    elif file_format == "PARQUET":
+        names = re.findall(r"(?:required|optional|repeated)\s+\w+\s+(\w+)", file_schema)
+    else:
+        raise ValueError(f"Unsupported inventory file format: {file_format}")
+
+    return tuple(names)
+
+
+def load_manifest(manifest_path):
+    """Load an S3 Inventory manifest.json file."""
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def layout_from_manifest(manifest):
+    """Return the InventoryLayout described by a loaded manifest."""
+    file_format = manifest["fileFormat"].upper()
+    return InventoryLayout(file_format, parse_file_schema(file_format, manifest["fileSchema"]))
+
+
+def find_manifest(directory):
+    """Return the path of the manifest.json describing the inventory in a directory, or None.
+
+    A manifest at the top of the directory is preferred. Otherwise the directory tree is searched and a single
+    manifest found there is used; several manifests (e.g. one per inventory run) are ambiguous and rejected.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE_NAME)
+    if os.path.isfile(manifest_path):
+        return manifest_path
+
+    manifest_paths = []
+    for root, _dirs, files in os.walk(directory):
+        if MANIFEST_FILE_NAME in files:
+            manifest_paths.append(os.path.join(root, MANIFEST_FILE_NAME))
+
+    if len(manifest_paths) > 1:
+        raise ValueError(
+            f"Found {len(manifest_paths)} {MANIFEST_FILE_NAME} files under {directory}; pass the one to use instead."
+        )
+
+    return manifest_paths[0] if manifest_paths else None
+
+
+def resolve_manifest_files(manifest, manifest_path):
+    """Return local paths for the data files listed in a manifest, in manifest order.
+
+    S3 delivers a manifest to ``<config>/<run date>/manifest.json`` and its parts to ``<config>/data/``, so a
+    local copy of the configuration prefix keeps the same relative layout. Parts are also looked for next to the
+    manifest. The first candidate path is returned for parts that cannot be found, so that reading them fails
+    with a per-file error rather than silently shrinking the totals.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    config_dir = os.path.dirname(manifest_dir)
+
+    file_paths = []
+    for manifest_file in manifest["files"]:
+        key = manifest_file["key"]
+        relative_path = "data/" + key.rsplit("/data/", 1)[1] if "/data/" in key else os.path.basename(key)
+        candidates = [
+            os.path.join(config_dir, relative_path),
+            os.path.join(manifest_dir, relative_path),
+            os.path.join(manifest_dir, os.path.basename(key)),
+        ]
+        file_paths.append(next((path for path in candidates if os.path.isfile(path)), candidates[0]))
+
+    return file_paths
+
+
+def find_inventory_files(directory):
+    """Return the paths of all gzipped inventory files under a directory, in walk order."""
+    file_paths = []
+    for root, _dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".gz"):
+                file_paths.append(os.path.join(root, file))
+
+    return file_paths
+
+
+def locate_inventory(path):
+    """Return the inventory file paths and layout for a directory or a manifest.json path.
+
+    Returns:
+        file_paths (list): Paths of the inventory data files.
+        layout (InventoryLayout): Format and columns of those files.
+    """
+    manifest_path = path if os.path.isfile(path) else find_manifest(path)
+    if manifest_path is None:
+        return find_inventory_files(path), DEFAULT_LAYOUT
+
+    manifest = load_manifest(manifest_path)
+    return resolve_manifest_files(manifest, manifest_path), layout_from_manifest(manifest)
+
+
+def is_s3_uri(path):
+    """Return whether path is an s3:// URI."""
+    return path.startswith("s3://")
+
+
+def parse_s3_uri(uri):
+    """Split an s3://bucket/key URI into its bucket and key (or prefix)."""
+    if not is_s3_uri(uri):
+        raise ValueError(f"Not an S3 URI: {uri}")
+    bucket, _slash, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def locate_s3_inventory(s3_client, uri):
+    """Return the inventory part URIs and layout for an s3://bucket/prefix or manifest.json URI.
+
+    A prefix is searched for manifest.json the same way find_manifest searches a directory; without one, every
+    gzipped object under the prefix is read as CSV with the size in the third column.
+
+    Returns:
+        uris (list): s3:// URIs of the inventory data files.
+        layout (InventoryLayout): Format and columns of those files.
+    """
+    bucket, key = parse_s3_uri(uri)
+    if key.endswith(MANIFEST_FILE_NAME):
+        manifest_key = key
+        part_keys = None
+    else:
+        manifest_keys = []
+        part_keys = []
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=key):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith("/" + MANIFEST_FILE_NAME) or obj["Key"] == MANIFEST_FILE_NAME:
+                    manifest_keys.append(obj["Key"])
+                elif obj["Key"].endswith(".gz"):
+                    part_keys.append(obj["Key"])
+        if len(manifest_keys) > 1:
+            raise ValueError(
+                f"Found {len(manifest_keys)} {MANIFEST_FILE_NAME} objects under {uri}; pass the one to use instead."
+            )
+        manifest_key = manifest_keys[0] if manifest_keys else None
+
+    if manifest_key is None:
+        return [f"s3://{bucket}/{part_key}" for part_key in part_keys], DEFAULT_LAYOUT
+
+    manifest = json.load(s3_client.get_object(Bucket=bucket, Key=manifest_key)["Body"])
+    uris = [f"s3://{bucket}/{manifest_file['key']}" for manifest_file in manifest["files"]]
+    return uris, layout_from_manifest(manifest)
+
+
+def open_s3_inventory_file(s3_client, uri, layout):
+    """Open an inventory part stored in S3 as a binary file object for iter_inventory_batches.
+
+    Gzipped CSV parts are returned as the streaming response body. ORC and Parquet readers need to seek, so those
+    parts are read into memory.
+    """
+    bucket, key = parse_s3_uri(uri)
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    if layout.file_format == "CSV":
+        return body
+    with body:
+        return io.BytesIO(body.read())
+
+
+def iter_inventory_batches(source, layout, fields, batch_size=BATCH_SIZE, csv_engine="auto"):
+    """Yield the requested fields of an inventory file in batches.
+
+    Each batch is a dict mapping every requested field to a list of values, all lists having the same length.
+    When ``size`` is requested it is yielded as int and rows without a valid size are skipped. Keys, which S3 URL
+    encodes in CSV inventories, are decoded. Other CSV fields are yielded as strings.
+
+    Args:
+        source: Path or binary file object of an inventory data file.
+        layout (InventoryLayout): Format and columns of the file.
+        fields (tuple): Column names to read.
+        batch_size (int): Maximum number of rows per batch.
+        csv_engine (str): Engine parsing gzipped CSV files, from CSV_ENGINES.
+    """
+    missing = [field for field in fields if field not in layout.columns]
+    if missing:
+        raise ValueError(f"Inventory does not include the {', '.join(missing)} field(s)")
+
+    if layout.file_format == "CSV":
+        yield from _iter_csv_batches(source, layout, fields, batch_size, csv_engine)
+    elif layout.file_format == "PARQUET":
+        parquet = _import_pyarrow("parquet")
+        parquet_file = parquet.ParquetFile(source)
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=list(fields)):
+            yield _record_batch_columns(record_batch, fields)
+    elif layout.file_format == "ORC":
+        orc = _import_pyarrow("orc")
+        orc_file = orc.ORCFile(source)
+        for stripe in range(orc_file.nstripes):
+            yield _record_batch_columns(orc_file.read_stripe(stripe, columns=list(fields)), fields)
+    else:
+        raise ValueError(f"Unsupported inventory file format: {layout.file_format}")
+
+
+def iter_inventory_records(file_paths, layout, fields, csv_engine="auto"):
+    """Yield a tuple of the requested fields for every record of a list of inventory files, in file order."""
+    for file_path in file_paths:
+        for batch in iter_inventory_batches(file_path, layout, fields, csv_engine=csv_engine):
+            yield from zip(*(batch[field] for field in fields))
+
+
+def _iter_csv_batches(source, layout, fields, batch_size, csv_engine):
+    """Yield batches of fields from a gzipped CSV inventory file with the selected CSV engine."""
+    if csv_engine == "auto":
+        csv_engine = "arrow" if _has_pyarrow() else "python"
+
+    if csv_engine == "arrow":
+        yield from _iter_csv_batches_arrow(source, layout, fields, batch_size)
+    elif csv_engine == "python":
+        yield from _iter_csv_batches_python(source, layout, fields, batch_size)
+    else:
+        raise ValueError(f"Unsupported CSV engine: {csv_engine}")
+
+
+def _select_row_values(row, indexes, min_length, size_position, key_position):
+    """Return the requested values of a parsed CSV row, or None if the row is skipped."""
+    if len(row) < min_length:
+        return None  # Skip if row doesn't have enough columns.
+    values = [row[index] for index in indexes]
+    if size_position is not None:
+        try:
+            values[size_position] = int(values[size_position])
+        except ValueError:
+            # Skip this row if conversion fails.
+            return None
+    if key_position is not None:
+        values[key_position] = unquote_plus(values[key_position])
+    return values
+
+
+def _iter_csv_batches_python(source, layout, fields, batch_size):
+    """Yield batches of fields from a gzipped CSV inventory file, parsed row by row with the csv module.
+
+    Rows too short to hold every requested field are skipped, as are rows whose size is not an integer. If the
+    file turns out to be corrupt, the rows read so far are yielded before the error is raised.
+    """
+    indexes = [layout.columns.index(field) for field in fields]
+    min_length = max(indexes) + 1
+    size_position = fields.index("size") if "size" in fields else None
+    key_position = fields.index("key") if "key" in fields else None
+
+    batch = [[] for _field in fields]
+    try:
+        with gzip.open(source, mode="rt", newline="") as gz_file:
+            for row in csv.reader(gz_file):
+                values = _select_row_values(row, indexes, min_length, size_position, key_position)
+                if values is None:
+                    continue
+                for column, value in zip(batch, values):
+                    column.append(value)
+                if len(batch[0]) >= batch_size:
+                    yield dict(zip(fields, batch))
+                    batch = [[] for _field in fields]
+    except Exception:
+        if batch[0]:
+            yield dict(zip(fields, batch))
+        raise
+
+    if batch[0]:
+        yield dict(zip(fields, batch))
+
+
+def _iter_csv_batches_arrow(source, layout, fields, batch_size):
+    """Yield batches of fields from a gzipped CSV inventory file, decompressed and parsed in blocks by pyarrow.
+
+    Only the requested columns are converted, and sizes are parsed a whole block at a time. The result is the same
+    as the csv module path: rows whose column count differs from the first row are handed back by pyarrow and
+    re-parsed with the csv module, blocks holding sizes pyarrow cannot parse are converted with int(), and if
+    pyarrow fails part way through a file given by path, the csv module path takes over after the rows already
+    yielded, so a corrupt file also yields the same rows and raises the same error.
+
+    The only visible difference is ordering: re-parsed rows are yielded after the other rows of their block.
+    """
+    pyarrow = _import_pyarrow()
+    arrow_csv = _import_pyarrow("csv")
+
+    indexes = [layout.columns.index(field) for field in fields]
+    min_length = max(indexes) + 1
+    size_position = fields.index("size") if "size" in fields else None
+    key_position = fields.index("key") if "key" in fields else None
+    names = [f"f{index}" for index in dict.fromkeys(indexes)]
+
+    rejected_rows = []
+
+    def handle_invalid_row(invalid_row):
+        for row in csv.reader([invalid_row.text]):
+            values = _select_row_values(row, indexes, min_length, size_position, key_position)
+            if values is not None:
+                rejected_rows.append(values)
+        return "skip"
+
+    rows_yielded = 0
+    try:
+        reader = arrow_csv.open_csv(
+            pyarrow.input_stream(source, compression="gzip", buffer_size=CSV_BLOCK_SIZE),
+            read_options=arrow_csv.ReadOptions(
+                autogenerate_column_names=True, block_size=CSV_BLOCK_SIZE, use_threads=False
+            ),
+            parse_options=arrow_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=handle_invalid_row),
+            convert_options=arrow_csv.ConvertOptions(
+                include_columns=names,
+                include_missing_columns=True,
+                column_types={name: pyarrow.string() for name in names},
+            ),
+        )
+        for record_batch in reader:
+            columns = _arrow_csv_columns(record_batch, indexes, size_position, key_position)
+            if rejected_rows:
+                for column, rejected_column in zip(columns, zip(*rejected_rows)):
+                    column.extend(rejected_column)
+                rejected_rows.clear()
+            for start in range(0, len(columns[0]), batch_size):
+                batch = {field: column[start : start + batch_size] for field, column in zip(fields, columns)}
+                yield batch
+                rows_yielded += len(batch[fields[0]])
+    except Exception:
+        if not isinstance(source, (str, os.PathLike)):
+            raise
+        python_batches = _iter_csv_batches_python(source, layout, fields, batch_size)
+        yield from _skip_batch_rows(python_batches, fields, rows_yielded)
+
+
+def _arrow_csv_columns(record_batch, indexes, size_position, key_position):
+    """Convert the string columns of a pyarrow CSV block to lists of values, one per requested field."""
+    pyarrow = _import_pyarrow()
+    arrays = [record_batch.column(f"f{index}") for index in indexes]
+    if any(array.null_count for array in arrays):
+        # Missing columns are null-filled: every row of the block is too short to hold the requested fields.
+        return [[] for _index in indexes]
+
+    keep = None
+    if size_position is not None:
+        try:
+            arrays[size_position] = arrays[size_position].cast(pyarrow.int64())
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+            sizes = []
+            keep = []
+            for value in arrays[size_position].to_pylist():
+                try:
+                    sizes.append(int(value))
+                    keep.append(True)
+                except ValueError:
+                    keep.append(False)
+            arrays[size_position] = sizes
+
+    columns = []
+    for position, array in enumerate(arrays):
+        if isinstance(array, list):
+            columns.append(array)
+            continue
+        if keep is not None:
+            array = array.filter(pyarrow.array(keep))
+        values = array.to_pylist()
+        if position == key_position:
+            values = [unquote_plus(value) for value in values]
+        columns.append(values)
+
+    return columns
+
+
+def _skip_batch_rows(batches, fields, row_count):
+    """Yield batches after dropping their first row_count rows."""
+    for batch in batches:
+        if row_count >= len(batch[fields[0]]):
+            row_count -= len(batch[fields[0]])
+            continue
+        if row_count:
+            batch = {field: values[row_count:] for field, values in batch.items()}
+            row_count = 0
+        yield batch
+
+
+def _record_batch_columns(record_batch, fields):
+    """Convert a pyarrow RecordBatch to the dict-of-lists batch form used by iter_inventory_batches."""
+    compute = _import_pyarrow("compute")
+    types = _import_pyarrow("types")
+
+    if "size" in fields:
+        record_batch = record_batch.filter(compute.is_valid(record_batch.column("size")))
+
+    batch = {}
+    for field in fields:
+        column = record_batch.column(field)
+        if field in timestamp_columns and types.is_timestamp(column.type):
+            column = compute.strftime(column, format="%Y-%m-%dT%H:%M:%S")
+        batch[field] = column.to_pylist()
+
+    return batch
+
+
+@functools.cache
+def _has_pyarrow():
+    """Return whether the optional pyarrow package is installed."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _import_pyarrow(module_name=None):
+    """Import pyarrow or one of its submodules, explaining how to install the optional dependency if it is missing."""
+    try:
+        return importlib.import_module("pyarrow" if module_name is None else f"pyarrow.{module_name}")
+    except ImportError as error:
+        raise RuntimeError(
+            "Reading ORC/Parquet inventories and the arrow CSV engine require pyarrow; install it with "
+            "'pip install pds.pdc-cloud-tools[arrow]'"
+        ) from error
@@ -0,0 +1,215 @@
+"""Group-by rollups of S3 inventory records.
+
+Rollups total the object count and bytes per key prefix, per storage class and per last-modified month while the
+inventory is read, so the summary needs a single pass over the files. Storage classes and months have a small,
+fixed number of values and are counted exactly. Key prefixes can number in the millions at deeper levels, so they
+are tracked with a bounded Space-Saving summary that keeps the heaviest prefixes by bytes.
+
+Rollups built for separate files (or in separate worker processes) are combined with ``merge``.
+"""
+import heapq
+from collections import defaultdict
+
+
+GROUP_BY_CHOICES = ("prefix", "storage-class", "month")
+
+# Columns read to compute each kind of rollup.
+group_by_fields = {"prefix": "key", "storage-class": "storage_class", "month": "last_modified_date"}
+
+
+class SpaceSaving:
+    """Bounded summary of the heaviest keys by weight (Metwally et al., "Space-Saving").
+
+    At most ``capacity`` keys are tracked. When a new key arrives and the summary is full, the lightest key is
+    evicted and the new key inherits its weight, which is recorded as that key's error. Every key whose true
+    weight exceeds total_weight / capacity is guaranteed to be tracked, and reported weights overestimate true
+    weights by at most their error.
+    """
+
+    def __init__(self, capacity):
+        """Create an empty summary tracking at most capacity keys."""
+        self.capacity = capacity
+        # key -> [bytes, count, bytes_error, count_error]
+        self.entries = {}
+        self.exact = True
+        # Min-heap of (bytes, key), possibly holding stale weights; None until the first eviction.
+        self._heap = None
+
+    def add(self, key, size, count=1):
+        """Add count objects totalling size bytes to key."""
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) < self.capacity:
+                entry = self.entries[key] = [0, 0, 0, 0]
+            else:
+                evicted = self._pop_lightest()
+                entry = self.entries[key] = [evicted[0], evicted[1], evicted[0], evicted[1]]
+                self.exact = False
+        entry[0] += size
+        entry[1] += count
+        self._push(key, entry[0])
+
+    def merge(self, other):
+        """Combine another summary into this one.
+
+        A key missing from a full summary may have been evicted from it, so it is credited with that summary's
+        lightest weight as additional error. The heaviest ``capacity`` keys of the union are kept.
+        """
+        self_floor = self._floor()
+        other_floor = other._floor()
+        merged = {}
+        for key in self.entries.keys() | other.entries.keys():
+            mine = self.entries.get(key, self_floor)
+            theirs = other.entries.get(key, other_floor)
+            merged[key] = [mine[index] + theirs[index] for index in range(4)]
+
+        self.exact = self.exact and other.exact and len(merged) <= self.capacity
+        kept = sorted(merged.items(), key=lambda item: (-item[1][0], item[0]))[: self.capacity]
+        self.entries = dict(kept)
+        self._heap = None
+
+    def items(self):
+        """Return (key, bytes, count, bytes_error, count_error) tuples, heaviest first."""
+        return [
+            (key, entry[0], entry[1], entry[2], entry[3])
+            for key, entry in sorted(self.entries.items(), key=lambda item: (-item[1][0], item[0]))
+        ]
+
+    def _floor(self):
+        """Return the weight credited to keys absent from this summary."""
+        if self.exact or not self.entries:
+            return (0, 0, 0, 0)
+        lightest = min(self.entries.values())
+        return (lightest[0], lightest[1], lightest[0], lightest[1])
+
+    def _push(self, key, size):
+        """Record the current weight of key in the lazily maintained min-heap, once evictions have started."""
+        if self._heap is None:
+            return
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+        else:
+            heapq.heappush(self._heap, (size, key))
+
+    def _rebuild_heap(self):
+        """Rebuild the min-heap from the current entries, dropping stale weights."""
+        self._heap = [(entry[0], key) for key, entry in self.entries.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_lightest(self):
+        """Remove and return the entry of the lightest key."""
+        if self._heap is None:
+            self._rebuild_heap()
+        while True:
+            size, key = heapq.heappop(self._heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == size:
+                return self.entries.pop(key)
+
+    def __getstate__(self):
+        """Drop the heap when pickling; it is rebuilt on demand."""
+        state = self.__dict__.copy()
+        state["_heap"] = None
+        return state
+
+
+def key_prefix(key, depth):
+    """Return the first depth levels of key's path as a prefix ending in "/".
+
+    Objects stored less than depth levels deep are grouped under their parent prefix, so an object's own name is
+    never reported as a prefix. Objects at the top of the bucket have the empty prefix.
+    """
+    parts = key.split("/", depth)
+    return "/".join(parts[: min(depth, len(parts) - 1)]) + "/" if len(parts) > 1 else ""
+
+
+class InventoryRollup:
+    """Object counts and bytes per prefix, storage class and last-modified month."""
+
+    def __init__(self, group_by=GROUP_BY_CHOICES, prefix_depth=1, top_k=1000):
+        """Create empty rollups.
+
+        Args:
+            group_by (tuple): Rollups to compute, from GROUP_BY_CHOICES.
+            prefix_depth (int): Number of key path levels forming a prefix.
+            top_k (int): Maximum number of prefixes tracked.
+        """
+        self.group_by = tuple(group_by)
+        self.prefix_depth = prefix_depth
+        self.top_k = top_k
+        self.prefixes = SpaceSaving(top_k)
+        self.storage_classes = defaultdict(_new_totals)
+        self.months = defaultdict(_new_totals)
+
+    @property
+    def fields(self):
+        """Inventory columns needed to compute the rollups."""
+        return tuple(group_by_fields[group] for group in self.group_by)
+
+    def add_batch(self, batch):
+        """Add a batch of inventory records, as yielded by iter_inventory_batches, to the rollups."""
+        sizes = batch["size"]
+        if "prefix" in self.group_by:
+            depth = self.prefix_depth
+            batch_prefixes = defaultdict(_new_totals)
+            for key, size in zip(batch["key"], sizes):
+                totals = batch_prefixes[key_prefix(key, depth)]
+                totals[0] += 1
+                totals[1] += size
+            for prefix, (count, size) in batch_prefixes.items():
+                self.prefixes.add(prefix, size, count)
+        if "storage-class" in self.group_by:
+            _add_exact(self.storage_classes, batch["storage_class"], sizes)
+        if "month" in self.group_by:
+            _add_exact(self.months, (date[:7] if date else "" for date in batch["last_modified_date"]), sizes)
+
+    def merge(self, other):
+        """Combine the rollups of another InventoryRollup with the same settings into this one."""
+        self.prefixes.merge(other.prefixes)
+        for totals, other_totals in ((self.storage_classes, other.storage_classes), (self.months, other.months)):
+            for group, (count, size) in other_totals.items():
+                totals[group][0] += count
+                totals[group][1] += size
+
+    def to_dict(self):
+        """Return the rollups as a JSON-serializable dict."""
+        result = {}
+        if "prefix" in self.group_by:
+            result["prefix"] = {
+                "depth": self.prefix_depth,
+                "top_k": self.top_k,
+                "exact": self.prefixes.exact,
+                "groups": [
+                    {
+                        "group": prefix,
+                        "objects": count,
+                        "bytes": size,
+                        "max_objects_error": count_error,
+                        "max_bytes_error": size_error,
+                    }
+                    for prefix, size, count, size_error, count_error in self.prefixes.items()
+                ],
+            }
+        if "storage-class" in self.group_by:
+            result["storage_class"] = {"exact": True, "groups": _exact_groups(self.storage_classes)}
+        if "month" in self.group_by:
+            result["month"] = {"exact": True, "groups": _exact_groups(self.months)}
+        return result
+
+
+def _new_totals():
+    """Return zeroed [count, bytes] totals for a group."""
+    return [0, 0]
+
+
+def _add_exact(totals, groups, sizes):
+    """Add the objects of a batch to exact per-group totals."""
+    for group, size in zip(groups, sizes):
+        group_totals = totals[group or ""]
+        group_totals[0] += 1
+        group_totals[1] += size
+
+
+def _exact_groups(totals):
+    """Return exact per-group totals as a list of dicts sorted by group."""
+    return [{"group": group, "objects": count, "bytes": size} for group, (count, size) in sorted(totals.items())]
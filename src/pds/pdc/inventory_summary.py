@@ -1,85 +1,441 @@
 #!/usr/bin/env python
 """Summarize S3 inventory.
 
-This script uses the boto3 library to summarize 1+ S3 inventory files.
+This script uses the boto3 library to summarize 1+ S3 inventory files. The inventory can be given as a directory
+or as the path of its manifest.json; when a manifest is found its fileSchema locates the size column, and ORC and
+Parquet inventories are read as well as gzipped CSV.
+
+The inventory can also be read straight from S3 by giving an s3://bucket/prefix or manifest.json URI, in which case
+the parts are streamed with several concurrent GETs instead of being synced to disk first. The AWS profile is
+taken from --profile or the AWS_PROFILE environment variable, as for pdc-s3-download.
+
+Per-file results of local inventories are cached in a sidecar file next to the inventory, so files unchanged since
+the previous run are not read again.
+
+Optionally, object counts and bytes are also rolled up per key prefix, storage class and last-modified month, and
+the object size distribution (log2 histogram, small-object count and percentiles) is sketched, all in the same
+pass. The summary can be written as JSON and/or CSV.
+
+Usage:
+    python inventory_summary.py <directory_or_manifest_path_or_s3_uri> [--workers N] [--profile PROFILE]
+        [--engine {auto,python,arrow}]
+        [--group-by {prefix,storage-class,month} ...] [--prefix-depth N] [--top-k K] [--size-distribution]
+        [--cache PATH | --no-cache] [--cache-hash] [--json-output summary.json] [--csv-output summary.csv]
 """
+import argparse
 import csv
-import gzip
+import json
 import os
+import sqlite3
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from botocore.exceptions import BotoCoreError
+from botocore.exceptions import ClientError
+from pds.pdc.inventory_cache import default_cache_path
+from pds.pdc.inventory_cache import InventorySummaryCache
+from pds.pdc.inventory_cache import scan_unless_cached
+from pds.pdc.inventory_reader import CSV_ENGINES
+from pds.pdc.inventory_reader import DEFAULT_LAYOUT
+from pds.pdc.inventory_reader import is_s3_uri
+from pds.pdc.inventory_reader import iter_inventory_batches
+from pds.pdc.inventory_reader import locate_inventory
+from pds.pdc.inventory_reader import locate_s3_inventory
+from pds.pdc.inventory_reader import open_s3_inventory_file
+from pds.pdc.inventory_rollup import GROUP_BY_CHOICES
+from pds.pdc.inventory_rollup import InventoryRollup
+from pds.pdc.inventory_sketch import SizeDistribution
+from pds.pdc.s3_download import create_s3_client
 
 
-def process_inventory_file(file_path):
-    """Process a single gzipped CSV inventory file.
+# Default number of concurrent reads for inventories stored in S3.
+DEFAULT_S3_WORKERS = 8
 
-    Assumes the object size is in the third column (index 2).
+
+def _scan_inventory_file(file_path, layout=DEFAULT_LAYOUT, aggregator_factories=(), csv_engine="auto", s3_client=None):
+    """Scan a single inventory file without reporting errors.
+
+    Each aggregator factory is called to create an accumulator (such as an InventoryRollup) that is fed every
+    batch read from the file. Gzipped CSV files are parsed with csv_engine (see inventory_reader.CSV_ENGINES).
+    With an s3_client, file_path is an s3:// URI and the file is streamed from S3.
 
     Returns:
-        count (int): Number of objects in this file.
-        total_size (int): Sum of object sizes in this file.
+        count (int): Number of objects read from this file.
+        total_size (int): Sum of object sizes read from this file.
+        aggregators (list): Accumulators created by aggregator_factories, holding this file's records.
+        error (str): Description of the error that stopped the scan, or None.
     """
     count = 0
     total_size = 0
+    error = None
+    aggregators = [factory() for factory in aggregator_factories]
+
+    fields = ["size"]
+    for aggregator in aggregators:
+        fields.extend(field for field in aggregator.fields if field not in fields)
 
     try:
-        with gzip.open(file_path, mode="rt", newline="") as gz_file:
-            reader = csv.reader(gz_file)
-            for row in reader:
-                if len(row) < 3:
-                    continue  # Skip if row doesn't have enough columns.
-                try:
-                    size = int(row[2])
-                except ValueError:
-                    # Skip this row if conversion fails.
-                    continue
-                total_size += size
-                count += 1
-    except Exception as error:
+        source = file_path if s3_client is None else open_s3_inventory_file(s3_client, file_path, layout)
+        for batch in iter_inventory_batches(source, layout, tuple(fields), csv_engine=csv_engine):
+            sizes = batch["size"]
+            total_size += sum(sizes)
+            count += len(sizes)
+            for aggregator in aggregators:
+                aggregator.add_batch(batch)
+    except Exception as e:
+        error = str(e)
+
+    return count, total_size, aggregators, error
+
+
+def process_inventory_file(file_path, layout=DEFAULT_LAYOUT):
+    """Process a single inventory file.
+
+    The size column is located through the layout, which by default assumes a gzipped CSV file with the object
+    size in the third column (index 2).
+
+    Returns:
+        count (int): Number of objects in this file.
+        total_size (int): Sum of object sizes in this file.
+    """
+    count, total_size, _aggregators, error = _scan_inventory_file(file_path, layout)
+    if error is not None:
         print(f"Error processing file {file_path}: {error}")
 
     return count, total_size
 
 
-def process_inventory_directory(directory):
-    """Process all gzipped CSV inventory files in a directory.
+def process_inventory_directory(directory, workers=1):
+    """Process all inventory files in a directory.
+
+    The files and their layout come from the directory's manifest.json when there is one; otherwise every
+    gzipped CSV file under the directory is read.
+
+    Returns:
+        total_count (int): Total number of objects across all files.
+        overall_size (int): Cumulative object size across all files.
+    """
+    file_paths, layout = locate_inventory(directory)
+    return process_inventory_files(file_paths, layout, workers=workers)
+
+
+def process_inventory_files(file_paths, layout, workers=1):
+    """Process a list of inventory files sharing the same layout.
+
+    Returns:
+        total_count (int): Total number of objects across all files.
+        overall_size (int): Cumulative object size across all files.
+    """
+    total_count, overall_size, _aggregators = summarize_inventory_files(file_paths, layout, workers=workers)
+    return total_count, overall_size
+
+
+def summarize_inventory_files(
+    file_paths, layout, aggregator_factories=(), workers=1, csv_engine="auto", cache=None, s3_client=None
+):
+    """Summarize a list of inventory files sharing the same layout.
+
+    When workers is greater than 1 the files are spread across a pool of processes, or of threads for files read
+    from S3 through s3_client (file_paths then being s3:// URIs). Results are collected in
+    file order, so the totals, the merged aggregators and the per-file progress and error output are the same as
+    for a serial run. Aggregator factories must be picklable (e.g. a class or functools.partial) to be used with
+    workers.
+
+    With an InventorySummaryCache, files whose cached result is still valid are not read again and the results of
+    newly scanned files replace their entries in the cache. The workers take the fingerprints of the files, so that
+    hashing them (see InventorySummaryCache use_hash) is done in parallel.
 
     Returns:
         total_count (int): Total number of objects across all files.
         overall_size (int): Cumulative object size across all files.
+        aggregators (list): One accumulator per aggregator factory, merged across all files.
     """
+    signature = result_signature(layout, aggregator_factories)
+    scan_file = partial(
+        _scan_inventory_file,
+        layout=layout,
+        aggregator_factories=aggregator_factories,
+        csv_engine=csv_engine,
+        s3_client=s3_client,
+    )
+    if cache is not None:
+        cached_fingerprints = [cache.cached_fingerprint(file_path, signature) for file_path in file_paths]
+        scan = partial(scan_unless_cached, use_hash=cache.use_hash, scan=scan_file)
+        arguments = (file_paths, cached_fingerprints)
+    else:
+        scan = scan_file
+        arguments = (file_paths,)
+
+    if workers > 1 and len(file_paths) > 1:
+        executor_class = ProcessPoolExecutor if s3_client is None else ThreadPoolExecutor
+        with executor_class(max_workers=min(workers, len(file_paths))) as executor:
+            results = executor.map(scan, *arguments)
+            return _collect_results(
+                file_paths, _cached_results(file_paths, results, cache, signature, scan_file), aggregator_factories
+            )
+
+    results = map(scan, *arguments)
+    return _collect_results(
+        file_paths, _cached_results(file_paths, results, cache, signature, scan_file), aggregator_factories
+    )
+
+
+def result_signature(layout, aggregator_factories):
+    """Return a string identifying the settings that per-file results depend on, used to validate cached results."""
+    return repr((tuple(layout), [repr(factory) for factory in aggregator_factories]))
+
+
+def _cached_results(file_paths, results, cache, signature, scan_file):
+    """Yield (result, cached) for every file in order, from the worker results.
+
+    Without a cache, the worker results are the scan results. With one, they are (fingerprint, result) pairs from
+    scan_unless_cached, result being None for a file whose cached result is reused; newly scanned results are stored
+    in the cache as they arrive. A file whose entry was removed meanwhile (by another run sharing the cache) is
+    scanned again with scan_file.
+    """
+    for file_path, result in zip(file_paths, results):
+        if cache is None:
+            yield result, False
+            continue
+        fingerprint, result = result
+        cached_result = cache.get(file_path, signature) if result is None else None
+        if cached_result is not None:
+            yield cached_result, True
+            continue
+        if result is None:
+            result = scan_file(file_path)
+        cache.put(file_path, signature, fingerprint, result)
+        yield result, False
+
+
+def _collect_results(file_paths, results, aggregator_factories):
+    """Report and combine per-file (result, cached) pairs in file order."""
     total_count = 0
     overall_size = 0
+    merged_aggregators = [factory() for factory in aggregator_factories]
 
-    # Walk through directory to find all .gz files.
-    for root, _dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".gz"):
-                file_path = os.path.join(root, file)
-                print(f"Processing: {file_path}")
-                count, size = process_inventory_file(file_path)
-                total_count += count
-                overall_size += size
+    for file_path, ((count, size, aggregators, error), cached) in zip(file_paths, results):
+        print(f"Processing: {file_path}" + (" (cached)" if cached else ""))
+        if error is not None:
+            print(f"Error processing file {file_path}: {error}")
+        total_count += count
+        overall_size += size
+        for merged_aggregator, aggregator in zip(merged_aggregators, aggregators):
+            merged_aggregator.merge(aggregator)
 
-    return total_count, overall_size
+    return total_count, overall_size, merged_aggregators
+
+
+def print_rollups(rollups):
+    """Print rollups, as returned by InventoryRollup.to_dict, after the text summary."""
+    for name, rollup in rollups.items():
+        title = name.replace("_", " ")
+        if name == "prefix":
+            qualifier = "" if rollup["exact"] else f", top {rollup['top_k']} by size, approximate"
+            title = f"prefix (depth {rollup['depth']}{qualifier})"
+        print(f"\nObjects by {title}:")
+        for group in rollup["groups"]:
+            print(f"  {group['group'] or '(none)'}: {group['objects']} objects, {group['bytes']} bytes")
+
+
+def print_size_distribution(distribution):
+    """Print a size distribution, as returned by SizeDistribution.to_dict, after the text summary."""
+    print("\nObject size distribution:")
+    print(f"  Smallest: {distribution['min_size']} bytes, largest: {distribution['max_size']} bytes")
+    print(
+        f"  Objects under {distribution['small_object_threshold']} bytes: {distribution['small_objects']} "
+        f"({distribution['small_objects_size']} bytes)"
+    )
+    accuracy = distribution["percentiles_relative_accuracy"]
+    for name, value in distribution["percentiles"].items():
+        print(f"  {name}: {value} bytes (within {accuracy:.0%})")
+    for bucket in distribution["log2_histogram"]:
+        print(f"  {bucket['min_size']} - {bucket['max_size']} bytes: {bucket['objects']} objects")
+
+
+def write_summary_json(output_path, summary):
+    """Write the summary dict to a JSON file."""
+    with open(output_path, "w") as output_file:
+        json.dump(summary, output_file, indent=2)
+        output_file.write("\n")
+
+
+def write_summary_csv(output_path, summary):
+    """Write the summary dict to a CSV file with one row per rollup group, preceded by the grand total."""
+    with open(output_path, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(["rollup", "group", "objects", "bytes"])
+        writer.writerow(["total", "", summary["total_objects"], summary["total_size"]])
+        for name, rollup in summary.get("rollups", {}).items():
+            for group in rollup["groups"]:
+                writer.writerow([name, group["group"], group["objects"], group["bytes"]])
+        distribution = summary.get("size_distribution")
+        if distribution is not None:
+            threshold = distribution["small_object_threshold"]
+            writer.writerow(
+                ["small_objects", f"<{threshold}", distribution["small_objects"], distribution["small_objects_size"]]
+            )
+            for name, value in distribution["percentiles"].items():
+                writer.writerow(["size_percentile", name, "", value])
+            for bucket in distribution["log2_histogram"]:
+                writer.writerow(["size_histogram", f"{bucket['min_size']}-{bucket['max_size']}", bucket["objects"], ""])
 
 
 def main():
     """main."""
-    if len(sys.argv) != 2:
-        print("Usage: python inventory_process.py <directory_path>")
+    parser = argparse.ArgumentParser(description="Summarize the S3 inventory files found in a directory.")
+    parser.add_argument(
+        "inventory_path",
+        help=(
+            "Directory containing the inventory files, the path of an inventory manifest.json, or an "
+            "s3://bucket/prefix or manifest.json URI (inventories without a manifest are read as gzipped CSV "
+            "with the size in the third column)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help=(
+            "Number of processes used to read local inventory files (0 uses all available CPUs, default: 1), or "
+            f"of concurrent reads for inventories in S3 (default: {DEFAULT_S3_WORKERS})"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        default=os.environ.get("AWS_PROFILE"),
+        help="AWS profile used to read inventories in S3 (defaults to AWS_PROFILE environment variable)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=CSV_ENGINES,
+        default="auto",
+        help=(
+            "Parser for gzipped CSV files: arrow parses blocks with pyarrow, python parses rows with the csv module, "
+            "auto uses arrow when pyarrow is installed (default: auto)"
+        ),
+    )
+    parser.add_argument(
+        "--group-by",
+        action="append",
+        choices=GROUP_BY_CHOICES,
+        default=[],
+        help="Also total objects and bytes per key prefix, storage class or last-modified month (repeatable)",
+    )
+    parser.add_argument(
+        "--prefix-depth", type=int, default=1, help="Number of key path levels forming a prefix (default: 1)"
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=1000,
+        help="Maximum number of prefixes tracked; beyond it the heaviest prefixes are approximated (default: 1000)",
+    )
+    parser.add_argument(
+        "--size-distribution",
+        action="store_true",
+        help="Also report the object size distribution: log2 histogram, objects under 128 KiB and percentiles",
+    )
+    parser.add_argument(
+        "--cache",
+        help=(
+            "Per-file result cache for local inventories; unchanged files are not read again "
+            f"(default: {default_cache_path('<directory>')} in the inventory directory)"
+        ),
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Neither read nor update the per-file result cache")
+    parser.add_argument(
+        "--cache-hash",
+        action="store_true",
+        help="Also require a matching SHA-256 of the file content before reusing a cached result",
+    )
+    parser.add_argument("--json-output", help="Also write the summary to this JSON file")
+    parser.add_argument("--csv-output", help="Also write the summary to this CSV file")
+
+    args = parser.parse_args()
+
+    inventory_path = args.inventory_path
+    from_s3 = is_s3_uri(inventory_path)
+    if args.workers is None:
+        workers = DEFAULT_S3_WORKERS if from_s3 else 1
+    else:
+        workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+
+    if not from_s3 and not os.path.exists(inventory_path):
+        print(f"Error: {inventory_path} is not a valid directory or manifest.")
+        sys.exit(1)
+
+    s3_client = None
+    try:
+        if from_s3:
+            s3_client = create_s3_client(args.profile, max_pool_connections=max(workers, 10))
+            file_paths, layout = locate_s3_inventory(s3_client, inventory_path)
+        else:
+            file_paths, layout = locate_inventory(inventory_path)
+    except (OSError, ValueError, KeyError, BotoCoreError, ClientError) as error:
+        print(f"Error reading inventory manifest for {inventory_path}: {error}")
         sys.exit(1)
 
-    directory_path = sys.argv[1]
+    group_by = tuple(dict.fromkeys(args.group_by))
+    aggregator_factories = []
+    if group_by:
+        aggregator_factories.append(partial(InventoryRollup, group_by, args.prefix_depth, args.top_k))
+    if args.size_distribution:
+        aggregator_factories.append(SizeDistribution)
 
-    if not os.path.isdir(directory_path):
-        print(f"Error: {directory_path} is not a valid directory.")
+    required_fields = {"size"}.union(*(factory().fields for factory in aggregator_factories))
+    missing_fields = sorted(required_fields.difference(layout.columns))
+    if missing_fields:
+        print(f"Error: the inventory at {inventory_path} does not include the {', '.join(missing_fields)} field(s).")
         sys.exit(1)
 
-    total_count, overall_size = process_inventory_directory(directory_path)
+    cache = None
+    if not args.no_cache and not from_s3:
+        cache_path = args.cache or default_cache_path(inventory_path)
+        try:
+            cache = InventorySummaryCache(cache_path, use_hash=args.cache_hash)
+        except sqlite3.Error as error:
+            print(f"Warning: not using the result cache {cache_path}: {error}")
+
+    try:
+        total_count, overall_size, aggregators = summarize_inventory_files(
+            file_paths,
+            layout,
+            aggregator_factories,
+            workers=workers,
+            csv_engine=args.engine,
+            cache=cache,
+            s3_client=s3_client,
+        )
+        if cache is not None:
+            evicted = cache.evict_missing()
+            print(
+                f"\nResult cache: {cache.hits} file(s) reused, {cache.misses} scanned, "
+                f"{evicted} removed file(s) evicted"
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+
+    summary = {"total_objects": total_count, "total_size": overall_size}
+    for aggregator in aggregators:
+        if isinstance(aggregator, InventoryRollup):
+            summary["rollups"] = aggregator.to_dict()
+        elif isinstance(aggregator, SizeDistribution):
+            summary["size_distribution"] = aggregator.to_dict()
 
     print("\nFinal Inventory Summary:")
     print(f"Total objects: {total_count}")
     print(f"Total object size: {overall_size} bytes")
+    print_rollups(summary.get("rollups", {}))
+    if "size_distribution" in summary:
+        print_size_distribution(summary["size_distribution"])
+
+    if args.json_output:
+        write_summary_json(args.json_output, summary)
+    if args.csv_output:
+        write_summary_csv(args.csv_output, summary)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,278 @@
+"""Parallel, verified download of large S3 objects.
+
+A large object is fetched as byte ranges on a pool of threads, each range written in place with ``os.pwrite`` into
+a file preallocated to the object's size. Checksums are computed from the data as it streams, so the download is
+verified without reading the file back:
+
+- An object uploaded in parts (an ETag ending in "-N") is fetched part by part with ``PartNumber``, so that ranges
+  match the uploaded parts. The MD5 of each part is combined into the multipart ETag and compared with the object's
+  ETag, and a part's SHA-256, SHA-1 or CRC32 additional checksum is also compared when S3 returns one.
+- An object uploaded whole is fetched in fixed-size ranges and its MD5 is computed in order, each range being read
+  back from the file (usually still in the page cache) once it and the ranges before it have landed, so that no
+  range is held in memory however many downloads run at the same time.
+
+ETags of objects encrypted with SSE-KMS or SSE-C are not MD5 digests, so those objects are only verified against
+additional checksums. Every range is requested with ``If-Match`` on the ETag, so an object replaced during the
+download fails instead of producing a mix of versions. A range whose request or body read fails with a transient
+error (see transfer_control.is_retryable_error) is downloaded again, up to RANGE_MAX_ATTEMPTS times; the progress
+callback is only given the bytes of a retry beyond those the failed attempts already reported.
+"""
+import base64
+import hashlib
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from pds.pdc.transfer_control import backoff_delay
+from pds.pdc.transfer_control import is_retryable_error
+
+
+MB = 1024 * 1024
+
+# Bytes read from a response body at a time.
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Attempts made to download a range failing with a transient error.
+RANGE_MAX_ATTEMPTS = 3
+
+# Additional checksums verified per part, and the functions computing them.
+PART_CHECKSUMS = {"ChecksumSHA256": "sha256", "ChecksumSHA1": "sha1", "ChecksumCRC32": "crc32"}
+
+_MD5_ETAG = re.compile(r'^"?([0-9a-f]{32})(?:-(\d+))?"?$')
+
+
+class RangedDownloadConfig(NamedTuple):
+    """Settings of ranged downloads."""
+
+    # Objects of at least this many bytes are downloaded in ranges.
+    threshold: int = 64 * MB
+    # Bytes per range of objects uploaded whole.
+    part_size: int = 16 * MB
+    # Ranges downloaded at the same time.
+    workers: int = 8
+
+
+DEFAULT_RANGED_CONFIG = RangedDownloadConfig()
+
+
+class IntegrityError(ValueError):
+    """Raised when downloaded data does not match the object's ETag or checksums."""
+
+
+def parse_e_tag(e_tag):
+    """Return (md5_hex, parts_count) for an ETag; parts_count is None for single-part uploads.
+
+    md5_hex is None when the ETag is not in the MD5 format.
+    """
+    match = _MD5_ETAG.match(e_tag or "")
+    if match is None:
+        return None, None
+    return match.group(1), int(match.group(2)) if match.group(2) else None
+
+
+def download_ranged(s3_client, bucket_name, key, file_path, config=DEFAULT_RANGED_CONFIG, callback=None):
+    """Download an object to file_path in parallel ranges, verifying it while it streams.
+
+    Args:
+        s3_client: Thread-safe S3 client with a connection pool of at least ``config.workers`` connections.
+        bucket_name (str): Bucket of the object.
+        key (str): Key of the object.
+        file_path (str): File written; it is created or truncated and preallocated to the object's size.
+        config (RangedDownloadConfig): Range size and number of ranges downloaded at the same time.
+        callback: Called with the number of bytes received as the download progresses.
+
+    Raises:
+        IntegrityError: If the data does not match the object's ETag or a part checksum.
+    """
+    head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    size = head["ContentLength"]
+    e_tag = head["ETag"]
+    md5_hex, parts_count = parse_e_tag(e_tag)
+    encrypted = head.get("SSECustomerAlgorithm") or str(head.get("ServerSideEncryption", "")).startswith("aws:kms")
+    verify_md5 = md5_hex is not None and not encrypted
+
+    request = {"Bucket": bucket_name, "Key": key, "IfMatch": e_tag}
+    descriptor = os.open(file_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        _preallocate(descriptor, size)
+        if parts_count:
+            digests = _download_parts(s3_client, request, parts_count, descriptor, config.workers, callback)
+            actual = hashlib.md5(b"".join(digests), usedforsecurity=False).hexdigest()
+        else:
+            actual = _download_ranges(s3_client, request, size, descriptor, config, verify_md5, callback)
+    finally:
+        os.close(descriptor)
+
+    if verify_md5 and actual != md5_hex:
+        raise IntegrityError(f"Downloaded data of {key} does not match its ETag {e_tag}")
+
+
+def _preallocate(descriptor, size):
+    """Allocate size bytes for a file, falling back to extending it where allocation is not supported."""
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(descriptor, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(descriptor, size)
+
+
+def _download_parts(s3_client, request, parts_count, descriptor, workers, callback):
+    """Download every uploaded part of a multipart object and return the MD5 digest of each, in part order."""
+
+    def download_part(part_number, attempt_callback):
+        response = s3_client.get_object(**request, PartNumber=part_number, ChecksumMode="ENABLED")
+        offset = _range_start(response)
+        checksum = _part_checksum(response)
+        md5 = hashlib.md5(usedforsecurity=False)
+        hashers = [md5] if checksum is None else [md5, checksum[1]]
+        _write_body(response, descriptor, offset, hashers, attempt_callback)
+        if checksum is not None:
+            name, hasher, expected = checksum
+            if _checksum_value(hasher) != expected:
+                raise IntegrityError(f"Part {part_number} of {request['Key']} does not match its {name}")
+        return md5.digest()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_with_retries, download_part, part_number, callback)
+            for part_number in range(1, parts_count + 1)
+        ]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _download_ranges(s3_client, request, size, descriptor, config, verify_md5, callback):
+    """Download an object uploaded whole in fixed-size ranges, returning its MD5 hex digest when verify_md5 is set.
+
+    Ranges are started in order and hashed in order, each read back from the file once it has been written, so the
+    memory used for hashing is one read chunk whatever the part size and number of workers.
+    """
+    ranges = [(start, min(start + config.part_size, size) - 1) for start in range(0, size, config.part_size)]
+    md5 = hashlib.md5(usedforsecurity=False) if verify_md5 else None
+
+    def download_range(byte_range, attempt_callback):
+        start, end = byte_range
+        response = s3_client.get_object(**request, Range=f"bytes={start}-{end}")
+        _write_body(response, descriptor, start, [], attempt_callback)
+
+    with ThreadPoolExecutor(max_workers=config.workers) as executor:
+        futures = [executor.submit(_with_retries, download_range, byte_range, callback) for byte_range in ranges]
+        try:
+            for future, (start, end) in zip(futures, ranges):
+                future.result()
+                if md5 is not None:
+                    _hash_written(descriptor, start, end + 1, md5)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return md5.hexdigest() if md5 is not None else None
+
+
+def _hash_written(descriptor, start, end, hasher):
+    """Update hasher with the bytes from start to end (exclusive) of a file, read back a chunk at a time."""
+    offset = start
+    while offset < end:
+        chunk = os.pread(descriptor, min(READ_CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            raise IntegrityError(f"File ends at {offset} bytes instead of {end}")
+        hasher.update(chunk)
+        offset += len(chunk)
+
+
+def _with_retries(function, argument, callback=None):
+    """Return function(argument, attempt_callback), called again after a jittered backoff on transient errors.
+
+    attempt_callback passes the bytes an attempt receives on to callback, skipping those that earlier attempts
+    already reported, so that a retried range is counted once. It is None when callback is.
+    """
+    reported = 0
+    for attempt in range(1, RANGE_MAX_ATTEMPTS + 1):
+        received = 0
+
+        def attempt_callback(amount):
+            nonlocal reported, received
+            received += amount
+            if received > reported:
+                callback(received - reported)
+                reported = received
+
+        try:
+            return function(argument, attempt_callback if callback is not None else None)
+        except Exception as error:
+            if attempt == RANGE_MAX_ATTEMPTS or not is_retryable_error(error):
+                raise
+        time.sleep(backoff_delay(attempt))
+
+
+def _write_body(response, descriptor, offset, hashers, callback):
+    """Stream a response body into the file at offset, updating hashers."""
+    expected = response["ContentLength"]
+    received = 0
+    body = response["Body"]
+    try:
+        for chunk in body.iter_chunks(READ_CHUNK_SIZE):
+            view = memoryview(chunk)
+            while view:
+                written = os.pwrite(descriptor, view, offset + received)
+                view = view[written:]
+                received += written
+            for hasher in hashers:
+                hasher.update(chunk)
+            if callback is not None:
+                callback(len(chunk))
+    finally:
+        body.close()
+    if received != expected:
+        raise IntegrityError(f"Received {received} of {expected} bytes")
+
+
+def _range_start(response):
+    """Return the first byte offset of a ranged or part response."""
+    content_range = response.get("ContentRange")
+    if not content_range:
+        raise IntegrityError("Response to a part request has no Content-Range")
+    return int(content_range.split()[1].split("-")[0])
+
+
+class _Crc32:
+    """Running CRC32 with the hashlib update interface."""
+
+    def __init__(self):
+        """Start from the CRC32 of no data."""
+        self.value = 0
+
+    def update(self, data):
+        """Add data to the checksum."""
+        self.value = zlib.crc32(data, self.value)
+
+
+def _part_checksum(response):
+    """Return (name, hasher, expected) for the first verifiable additional checksum of a part response, or None.
+
+    Checksums of whole multipart objects ("...-N") and full-object checksums cannot be checked against one part.
+    """
+    if response.get("ChecksumType") == "FULL_OBJECT":
+        return None
+    for name, algorithm in PART_CHECKSUMS.items():
+        expected = response.get(name)
+        if expected and "-" not in expected:
+            hasher = _Crc32() if algorithm == "crc32" else hashlib.new(algorithm)
+            return name, hasher, expected
+    return None
+
+
+def _checksum_value(hasher):
+    """Return the base64 form S3 uses for a finished checksum."""
+    digest = hasher.value.to_bytes(4, "big") if isinstance(hasher, _Crc32) else hasher.digest()
+    return base64.b64encode(digest).decode("ascii")
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+"""Copy objects from one S3 bucket to another without downloading them.
+
+Objects matching a prefix in the source bucket are copied server-side to a
+prefix in the destination bucket, which may belong to another account: the
+bucket is listed with the source profile, and the copies are requested with
+the destination profile, whose credentials must be allowed to read the source
+objects. Key paths below the source prefix are kept under the destination
+prefix (by default the source prefix itself).
+
+Objects are copied with CopyObject, many at a time (--concurrency). Objects
+uploaded in parts are copied part by part with UploadPartCopy, in parallel,
+using the source's part boundaries so that the copy gets the same ETag; this
+is also how objects over the 5 GiB CopyObject limit are copied. Throttled and
+transiently failed copies are retried with backoff, and --adaptive adjusts the
+number of copies in flight as pdc-s3-download does.
+
+Every copy records the ETag of its source in its metadata (x-amz-meta-
+pdc-source-etag), and keeps the source's content headers, user metadata,
+storage class and tags. ACLs, object lock settings and encryption come from
+the destination bucket's defaults.
+
+With --sync, objects already in the destination with the same size and
+either the same ETag or the source ETag in their metadata are skipped: the
+ETag of a copy differs from its source's when the destination encrypts with
+SSE-KMS, or when it was copied in other parts. The destination listing is
+streamed alongside the source listing (a sorted merge, both being in key
+order), or with --listing sharded, whose keys arrive in no order, spilled to
+an on-disk index instead of being held in memory.
+
+Usage:
+    python s3_copy.py --source-prefix prefix/path/ --dest-bucket BUCKET [--dest-prefix prefix/path/]
+        [--dest-profile PROFILE] [--concurrency N] [--part-threads N] [--part-size MIB] [--sync]
+        [--listing {sequential,sharded} [--listing-workers N]] [--adaptive] [--max-attempts N]
+    (Optionally set AWS_PROFILE and AWS_BUCKET in your environment)
+"""
+import argparse
+import math
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+from pds.pdc.inventory_diff import spill_records
+from pds.pdc.ranged_download import parse_e_tag
+from pds.pdc.s3_download import create_s3_client
+from pds.pdc.s3_download import describe_error
+from pds.pdc.s3_download import iter_source_objects
+from pds.pdc.s3_download import LISTING_CHOICES
+from pds.pdc.s3_download import PROGRESS_INTERVAL
+from pds.pdc.s3_download import relative_path_for_key
+from pds.pdc.s3_listing import DEFAULT_LISTING_WORKERS
+from pds.pdc.s3_listing import iter_sharded_objects
+from pds.pdc.transfer_control import AdaptiveConcurrency
+from pds.pdc.transfer_control import DEFAULT_MAX_ATTEMPTS
+from pds.pdc.transfer_control import run_transfers
+from pds.pdc.transfer_metrics import TransferMetrics
+
+
+MB = 1024 * 1024
+
+# Largest object CopyObject can copy in one request.
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * MB
+
+# Most parts in a multipart upload.
+MAX_PARTS = 10000
+
+# Smallest part size S3 accepts for all but the last part of a multipart upload.
+MIN_PART_SIZE = 5 * MB
+
+# Headers of the source object given to its copy, which replaces the source's metadata to record its ETag.
+COPIED_HEADERS = (
+    "CacheControl",
+    "ContentDisposition",
+    "ContentEncoding",
+    "ContentLanguage",
+    "ContentType",
+    "StorageClass",
+)
+
+# User metadata key under which a copy records the ETag of its source.
+SOURCE_E_TAG_METADATA = "pdc-source-etag"
+
+
+class PartCopyConfig(NamedTuple):
+    """Settings of multipart copies."""
+
+    # Bytes per part when the source's part boundaries cannot be reused.
+    part_size: int = 512 * MB
+    # Parts copied at the same time.
+    workers: int = 8
+
+
+DEFAULT_PART_COPY_CONFIG = PartCopyConfig()
+
+
+def destination_key(key, source_prefix, dest_prefix):
+    """Return the destination key of a source key, or None for directory markers and the prefix itself."""
+    relative_path = relative_path_for_key(key, source_prefix)
+    return dest_prefix + relative_path if relative_path is not None else None
+
+
+def is_identical(obj, dest_obj, dest_client=None, dest_bucket_name=None):
+    """Return whether a destination object (a ListObjectsV2 ``Contents`` entry or None) matches the source object.
+
+    Objects of the same size match when their ETags are equal. Otherwise, when dest_client is given, the source ETag
+    recorded in the destination object's metadata by copy_object is compared, which HeadObject returns.
+    """
+    if dest_obj is None or dest_obj["Size"] != obj["Size"]:
+        return False
+    if dest_obj.get("ETag") == obj.get("ETag"):
+        return True
+    if dest_client is None or not obj.get("ETag"):
+        return False
+    head = dest_client.head_object(Bucket=dest_bucket_name, Key=dest_obj["Key"])
+    return head.get("Metadata", {}).get(SOURCE_E_TAG_METADATA) == obj["ETag"].strip('"')
+
+
+def iter_sorted_matches(objects, dest_objects, source_prefix, dest_prefix):
+    """Yield (obj, dest_key, dest_obj) for every source object, pairing the two listings by a sorted merge.
+
+    Both listings must be in key order, as ListObjectsV2 returns them; dest_obj is the destination object at dest_key,
+    or None. dest_key is None for directory markers.
+    """
+    dest_objects = iter(dest_objects)
+    dest_obj = next(dest_objects, None)
+    for obj in objects:
+        dest_key = destination_key(obj["Key"], source_prefix, dest_prefix)
+        if dest_key is None:
+            yield obj, None, None
+            continue
+        while dest_obj is not None and dest_obj["Key"] < dest_key:
+            dest_obj = next(dest_objects, None)
+        yield obj, dest_key, dest_obj if dest_obj is not None and dest_obj["Key"] == dest_key else None
+
+
+def iter_indexed_matches(objects, dest_objects, source_prefix, dest_prefix, spill_dir=None):
+    """Yield (obj, dest_key, dest_obj) as iter_sorted_matches does, for source objects in any order.
+
+    The destination listing is first written to an on-disk index, in a temporary directory under spill_dir.
+    """
+    with tempfile.TemporaryDirectory(dir=spill_dir) as temp_dir:
+        connection = sqlite3.connect(os.path.join(temp_dir, "s3_copy.sqlite"))
+        try:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            spill_records(connection, "dest", ((obj["Key"], obj["Size"], obj.get("ETag")) for obj in dest_objects))
+            for obj in objects:
+                dest_key = destination_key(obj["Key"], source_prefix, dest_prefix)
+                row = None
+                if dest_key is not None:
+                    row = connection.execute("SELECT size, e_tag FROM dest WHERE key = ?", (dest_key,)).fetchone()
+                yield obj, dest_key, {"Key": dest_key, "Size": row[0], "ETag": row[1]} if row is not None else None
+        finally:
+            connection.close()
+
+
+def part_ranges(size, part_size):
+    """Return the inclusive (start, end) byte ranges of the parts of an object of size bytes."""
+    part_size = max(part_size, math.ceil(size / MAX_PARTS))
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def source_part_ranges(s3_client, bucket_name, key, size, e_tag):
+    """Return the byte ranges of the parts a multipart object was uploaded in, or None if they cannot be reused.
+
+    Uploaders use parts of one size but the last, so the size of the first part, and the number of parts from the
+    ETag, give every range. Objects whose parts are of uneven sizes are not recognized and None is returned.
+    """
+    _md5_hex, parts_count = parse_e_tag(e_tag)
+    if not parts_count or parts_count > MAX_PARTS:
+        return None
+    first_part = s3_client.head_object(Bucket=bucket_name, Key=key, PartNumber=1)
+    ranges = part_ranges(size, first_part["ContentLength"])
+    return ranges if len(ranges) == parts_count else None
+
+
+def copy_object(
+    source_client,
+    dest_client,
+    source_bucket_name,
+    key,
+    dest_bucket_name,
+    dest_key,
+    size,
+    e_tag=None,
+    config=DEFAULT_PART_COPY_CONFIG,
+):
+    """Copy one object server-side, in parts when it was uploaded in parts or is too large for CopyObject.
+
+    The copy gets the source's COPIED_HEADERS, user metadata and tags, and records the source ETag in its metadata.
+
+    Args:
+        source_client: S3 client of the source profile, used to read the part layout of the source object.
+        dest_client: S3 client of the destination profile, which makes the copy.
+        source_bucket_name (str): Bucket of the source object.
+        key (str): Key of the source object.
+        dest_bucket_name (str): Bucket of the copy.
+        dest_key (str): Key of the copy.
+        size (int): Size of the source object in bytes.
+        e_tag (str): ETag of the source object; when given, the copy fails if the source object was replaced.
+        config (PartCopyConfig): Part size and number of parts copied at the same time.
+    """
+    copy_source = {"Bucket": source_bucket_name, "Key": key}
+    conditions = {"CopySourceIfMatch": e_tag} if e_tag else {}
+    head = source_client.head_object(Bucket=source_bucket_name, Key=key, **({"IfMatch": e_tag} if e_tag else {}))
+    headers = {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+    headers["Metadata"] = dict(head.get("Metadata", {}), **{SOURCE_E_TAG_METADATA: head["ETag"].strip('"')})
+    ranges = source_part_ranges(source_client, source_bucket_name, key, size, e_tag) if e_tag else None
+    if ranges is None and size > MAX_COPY_OBJECT_SIZE:
+        ranges = part_ranges(size, config.part_size)
+    if ranges is None:
+        # Tags are copied by CopyObject itself (TaggingDirective COPY)
+        dest_client.copy_object(
+            Bucket=dest_bucket_name,
+            Key=dest_key,
+            CopySource=copy_source,
+            MetadataDirective="REPLACE",
+            **headers,
+            **conditions,
+        )
+        return
+
+    tags = source_client.get_object_tagging(Bucket=source_bucket_name, Key=key)["TagSet"]
+    if tags:
+        headers["Tagging"] = urlencode([(tag["Key"], tag["Value"]) for tag in tags])
+    upload = dest_client.create_multipart_upload(Bucket=dest_bucket_name, Key=dest_key, **headers)
+    request = {"Bucket": dest_bucket_name, "Key": dest_key, "UploadId": upload["UploadId"]}
+
+    def copy_part(part_number, byte_range):
+        response = dest_client.upload_part_copy(
+            **request,
+            PartNumber=part_number,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={byte_range[0]}-{byte_range[1]}",
+            **conditions,
+        )
+        return {"PartNumber": part_number, "ETag": response["CopyPartResult"]["ETag"]}
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.workers) as executor:
+            futures = [executor.submit(copy_part, number, byte_range) for number, byte_range in enumerate(ranges, 1)]
+            try:
+                parts = [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        dest_client.complete_multipart_upload(**request, MultipartUpload={"Parts": parts})
+    except BaseException:
+        dest_client.abort_multipart_upload(**request)
+        raise
+
+
+def main():
+    """Parse command-line arguments and copy S3 objects to another bucket."""
+    # Get defaults from environment variables if available
+    default_source_profile = os.environ.get("AWS_PROFILE")
+    default_source_bucket = os.environ.get("AWS_BUCKET")
+
+    parser = argparse.ArgumentParser(
+        description="Copy objects from an S3 bucket (filtered by a prefix) to another bucket, server-side."
+    )
+    parser.add_argument(
+        "--source-profile",
+        default=default_source_profile,
+        help=("AWS profile name for the source bucket " "(defaults to AWS_PROFILE environment variable)"),
+    )
+    parser.add_argument(
+        "--source-bucket",
+        default=default_source_bucket,
+        help=("Name of the source S3 bucket " "(defaults to AWS_BUCKET environment variable)"),
+    )
+    parser.add_argument("--source-prefix", required=True, help="Prefix in the source bucket to filter objects")
+    parser.add_argument("--dest-profile", help="AWS profile name making the copies (defaults to the source profile)")
+    parser.add_argument("--dest-bucket", required=True, help="Name of the destination S3 bucket")
+    parser.add_argument(
+        "--dest-prefix", help="Prefix of the copies in the destination bucket (default: --source-prefix)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Number of objects copied at the same time (default: 16)"
+    )
+    parser.add_argument(
+        "--part-threads",
+        type=int,
+        default=DEFAULT_PART_COPY_CONFIG.workers,
+        help=f"Number of parts of one object copied at the same time (default: {DEFAULT_PART_COPY_CONFIG.workers})",
+    )
+    parser.add_argument(
+        "--part-size",
+        type=int,
+        default=DEFAULT_PART_COPY_CONFIG.part_size // MB,
+        help=(
+            "Part size in MiB of objects over 5 GiB whose source part layout cannot be reused "
+            f"(default: {DEFAULT_PART_COPY_CONFIG.part_size // MB})"
+        ),
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Skip objects already in the destination with the same size and ETag (or source ETag in metadata)",
+    )
+    parser.add_argument(
+        "--listing",
+        choices=LISTING_CHOICES,
+        default="sequential",
+        help="List the bucket with one cursor, or list sub-prefixes in parallel (default: sequential)",
+    )
+    parser.add_argument(
+        "--listing-workers",
+        type=int,
+        default=DEFAULT_LISTING_WORKERS,
+        help=(
+            "Number of sub-prefixes listed at the same time with --listing sharded "
+            f"(default: {DEFAULT_LISTING_WORKERS})"
+        ),
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help=(
+            "Adjust the number of copies in flight, up to --concurrency, to the observed throughput and "
+            "throttling responses"
+        ),
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=DEFAULT_MAX_ATTEMPTS,
+        help=(
+            "Attempts made for an object failing with a throttling or transient error "
+            f"(default: {DEFAULT_MAX_ATTEMPTS})"
+        ),
+    )
+    parser.add_argument("--quiet", action="store_true", help="Do not print a line for every object")
+
+    args = parser.parse_args()
+
+    # Validate that required AWS parameters are provided either via command-line or env variables
+    if not args.source_profile:
+        parser.error("The --source-profile argument is required or set the AWS_PROFILE environment variable.")
+    if not args.source_bucket:
+        parser.error("The --source-bucket argument is required or set the AWS_BUCKET environment variable.")
+    if min(args.concurrency, args.part_threads, args.listing_workers, args.max_attempts) < 1:
+        parser.error("--concurrency, --part-threads, --listing-workers and --max-attempts must be at least 1.")
+    if args.part_size * MB < MIN_PART_SIZE:
+        parser.error(f"--part-size must be at least {MIN_PART_SIZE // MB} (MiB).")
+
+    source_bucket_name = args.source_bucket
+    source_prefix = args.source_prefix
+    dest_bucket_name = args.dest_bucket
+    dest_prefix = args.dest_prefix if args.dest_prefix is not None else source_prefix
+    if source_bucket_name == dest_bucket_name and source_prefix == dest_prefix:
+        parser.error("The destination is the same as the source.")
+    config = PartCopyConfig(part_size=args.part_size * MB, workers=args.part_threads)
+
+    # The source client lists, and reads the headers and part layout of every object copied
+    source_client = create_s3_client(
+        args.source_profile, max_pool_connections=max(10, args.listing_workers * 2 + args.concurrency)
+    )
+    dest_client = create_s3_client(
+        args.dest_profile or args.source_profile, max_pool_connections=max(10, args.concurrency * args.part_threads)
+    )
+
+    if args.listing == "sharded":
+        objects = iter_sharded_objects(source_client, source_bucket_name, source_prefix, args.listing_workers)
+    else:
+        objects = iter_source_objects(source_client, source_bucket_name, source_prefix)
+    metrics = TransferMetrics()
+    controller = AdaptiveConcurrency(args.concurrency) if args.adaptive else None
+    identical = 0
+
+    def skip(obj):
+        metrics.record_skip(obj["Size"])
+
+    def copies():
+        if not args.sync:
+            matches = ((obj, destination_key(obj["Key"], source_prefix, dest_prefix), None) for obj in objects)
+        elif args.listing == "sharded":
+            matches = iter_indexed_matches(
+                objects, iter_source_objects(dest_client, dest_bucket_name, dest_prefix), source_prefix, dest_prefix
+            )
+        else:
+            matches = iter_sorted_matches(
+                objects, iter_source_objects(dest_client, dest_bucket_name, dest_prefix), source_prefix, dest_prefix
+            )
+        for obj, dest_key, dest_obj in metrics.time_listing(matches):
+            if dest_key is None:
+                if not args.quiet:
+                    print(f"Skipping directory marker or empty key: {obj['Key']}")
+                skip(obj)
+                continue
+            yield obj, dest_key, dest_obj
+
+    def copy(item):
+        obj, dest_key, dest_obj = item
+        started = time.monotonic()
+        # Comparing may need a HeadObject request, so it is done concurrently with the copies
+        if is_identical(obj, dest_obj, dest_client, dest_bucket_name):
+            return None
+        if not args.quiet:
+            print(f"Copying s3://{source_bucket_name}/{obj['Key']} to s3://{dest_bucket_name}/{dest_key}...")
+        copy_object(
+            source_client,
+            dest_client,
+            source_bucket_name,
+            obj["Key"],
+            dest_bucket_name,
+            dest_key,
+            obj["Size"],
+            obj.get("ETag"),
+            config,
+        )
+        return time.monotonic() - started
+
+    results = run_transfers(
+        copies(),
+        copy,
+        args.concurrency,
+        controller=controller,
+        max_attempts=args.max_attempts,
+        size_of=lambda item: item[0]["Size"],
+    )
+    metrics.start_progress(PROGRESS_INTERVAL)
+    try:
+        for (obj, _dest_key, _dest_obj), seconds, failure, attempts in results:
+            if failure is None and seconds is None:
+                identical += 1
+                skip(obj)
+            elif failure is None:
+                # Copies happen within S3: their bytes are counted when they complete
+                metrics.record_bytes(obj["Size"])
+                metrics.record_download(obj["Size"], seconds, attempts)
+            else:
+                # Any error of one object is recorded, so that the other objects are still copied
+                tries = f" (after {attempts} attempts)" if attempts > 1 else ""
+                print(f"Error copying {obj['Key']}{tries}: {describe_error(failure)}")
+                metrics.record_failure(obj["Size"], attempts)
+    finally:
+        metrics.stop_progress()
+
+    print(metrics.progress_line())
+    print(
+        f"Copied {metrics.downloaded_objects} object(s), {metrics.downloaded_bytes} bytes, in "
+        f"{metrics.elapsed():.1f} s; {metrics.failed_objects} failed, {metrics.retries} retried attempt(s)."
+    )
+    if controller is not None:
+        print(
+            f"Adaptive concurrency: ended at {controller.limit}, peaked at {controller.peak_limit}, "
+            f"{controller.throttles} throttling response(s)."
+        )
+    if args.sync:
+        print(f"Skipped {identical} identical object(s).")
+    print("Copy complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,330 @@ bucket that match a given prefix. The AWS profile, S3 bucket name, prefix,
 and local destination directory are provided as command-line arguments or
 through the AWS_PROFILE and AWS_BUCKET environment variables.
 
+Objects can be downloaded concurrently with --concurrency. All downloads then
+share one S3 client, and the listing is consumed lazily so that only a bounded
+number of objects is held in memory however many match the prefix.
+
+Every file is written under a temporary name and renamed once complete, given
+the object's LastModified time. With --sync, --retry-failed or --state-file,
+downloaded objects are also recorded in a state journal (by default in the
+destination directory). With --sync, objects whose local copy is current (same
+size and modification time, or same ETag with --compare etag) are skipped, so
+an interrupted run can be restarted without downloading everything again.
+--compare etag relies on the ETags recorded by earlier runs that kept the
+journal.
+
+With --inventory, the objects to download are read from an S3 Inventory of the
+source bucket (a local directory or manifest.json, or an s3:// URI) instead of
+being listed, which saves the listing time and cost for prefixes holding
+millions of keys. The download plan for the prefix is then held in memory, so
+progress is reported against known totals and --largest-first can start the
+largest objects first.
+
+When the bucket is listed, --listing sharded lists sub-prefixes in parallel
+(see s3_listing) and streams the keys to the downloads as they arrive.
+
+Throttled (SlowDown) and transiently failed downloads are retried with a
+jittered exponential backoff. With --adaptive, --concurrency becomes an upper
+bound and the number of downloads in flight is adjusted to the throughput
+observed and the throttling responses received (see transfer_control).
+--max-bandwidth caps the combined download rate.
+
+Objects of at least --ranged-threshold MiB are fetched as parallel byte
+ranges written in place into a preallocated file, and verified against their
+ETag (or part checksums) as they stream (see ranged_download).
+
+With --archive, objects are appended to one tar (optionally gzip or zstd
+compressed) or zip archive instead of being written as separate files, with
+member paths relative to --source-prefix. Each object is buffered in memory
+(or in a spool file when large) only until the single archive writer appends
+it, so memory stays bounded by the number of downloads in flight.
+
+A progress line with the objects and bytes processed, the transfer rate and,
+when the totals are known, an ETA is printed every few seconds (see
+transfer_metrics). At the end, a summary separates the time spent waiting on
+the listing from the time spent transferring. --report-json writes the
+counts, timings and per-object latency and throughput histograms to a JSON
+file, and --prometheus-textfile writes them for the node_exporter textfile
+collector.
+
+Objects that fail are recorded, with the error and the attempts made, in a
+failure journal (in the destination directory, or next to the archive).
+--retry-failed JOURNAL then downloads only the objects of the source bucket
+and prefix listed in a journal, with the same concurrency and backoff,
+instead of listing the bucket again. Entries of other buckets and prefixes
+are kept, and an entry is only removed once its object has been downloaded.
+An archive is never overwritten: failures of an --archive run are retried
+into a new archive, e.g. --retry-failed bundle.tar.failures.jsonl --archive
+bundle-retry.tar, which then holds only the retried objects.
+
+With --dedup-store DIR, each distinct object content (same ETag and size) is
+downloaded once into a content-addressed store, and every key's local path is
+made a hard link to it (or a reflink or copy when the store is on another
+filesystem); see content_store. --sync then compares ETags.
+
 Usage:
-    python s3_download.py --source-prefix prefix/path/to/objects/ --local-dest-dir local/path/
+    python s3_download.py --source-prefix prefix/path/to/objects/ (--local-dest-dir local/path/ | --archive FILE)
+        [--concurrency N] [--archive-format {tar,tar.gz,tar.zst,zip}] [--spool-dir DIR]
+        [--sync [--compare {size-mtime,etag}]] [--inventory PATH_OR_S3_URI [--largest-first]]
+        [--listing {sequential,sharded} [--listing-workers N]] [--adaptive] [--max-bandwidth MB_PER_S]
+        [--ranged-threshold MIB] [--quiet] [--report-json FILE] [--prometheus-textfile FILE]
+        [--failure-journal FILE] [--retry-failed JOURNAL] [--dedup-store DIR]
     (Optionally set AWS_PROFILE and AWS_BUCKET in your environment)
 """
 import argparse
 import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from datetime import timezone
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from pds.pdc.archive_writer import archive_format_for
+from pds.pdc.archive_writer import ARCHIVE_FORMATS
+from pds.pdc.archive_writer import ArchiveWriter
+from pds.pdc.content_store import ContentStore
+from pds.pdc.download_state import default_failures_path
+from pds.pdc.download_state import default_state_path
+from pds.pdc.download_state import DownloadStateJournal
+from pds.pdc.download_state import FailureJournal
+from pds.pdc.download_state import FAILURES_FILE_NAME
+from pds.pdc.download_state import read_failure_journal
+from pds.pdc.inventory_reader import is_s3_uri
+from pds.pdc.inventory_reader import iter_inventory_batches
+from pds.pdc.inventory_reader import locate_inventory
+from pds.pdc.inventory_reader import locate_s3_inventory
+from pds.pdc.inventory_reader import open_s3_inventory_file
+from pds.pdc.ranged_download import download_ranged
+from pds.pdc.ranged_download import IntegrityError
+from pds.pdc.ranged_download import RangedDownloadConfig
+from pds.pdc.s3_listing import DEFAULT_LISTING_WORKERS
+from pds.pdc.s3_listing import iter_sharded_objects
+from pds.pdc.transfer_control import AdaptiveConcurrency
+from pds.pdc.transfer_control import DEFAULT_MAX_ATTEMPTS
+from pds.pdc.transfer_control import run_transfers
+from pds.pdc.transfer_control import TokenBucket
+from pds.pdc.transfer_metrics import TransferMetrics
+
+
+MB = 1024 * 1024
+
+COMPARE_CHOICES = ("size-mtime", "etag")
+
+LISTING_CHOICES = ("sequential", "sharded")
+
+# Seconds between progress lines.
+PROGRESS_INTERVAL = 10.0
+
+# Bytes of a downloaded object buffered in memory, in archive mode, before it is spooled to disk.
+SPOOL_MEMORY = 8 * MB
+
+# Suffix of the temporary file an object is written to before being renamed into place.
+PARTIAL_SUFFIX = ".pdc-partial"
+
+
+def create_s3_client(profile_name=None, max_pool_connections=10):
+    """Create an S3 client for the given AWS profile (the default credential chain when None).
+
+    boto3 clients are thread-safe, so one client can be shared by concurrent requests as long as its connection
+    pool is at least as large as the number of requests in flight.
+    """
+    session = boto3.Session(profile_name=profile_name)
+    return session.client("s3", config=Config(max_pool_connections=max_pool_connections))
+
+
+def iter_source_objects(s3_client, bucket_name, prefix):
+    """Yield the objects (ListObjectsV2 ``Contents`` entries) under a prefix, one listing page at a time."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        yield from page.get("Contents", [])
+
+
+def iter_inventory_objects(inventory_path, bucket_name, prefix, s3_client=None):
+    """Yield the current objects under a prefix listed in an S3 Inventory, in ListObjectsV2 ``Contents`` form.
+
+    Args:
+        inventory_path (str): Inventory directory, manifest.json path, or s3:// URI of either.
+        bucket_name (str): Source bucket; records of other buckets are left out when the inventory names the bucket.
+        prefix (str): Key prefix of the objects to yield.
+        s3_client: Client reading an inventory stored in S3.
+
+    Noncurrent versions of versioned inventories are left out, and delete markers have no size so the reader
+    already skips them. ETag and LastModified are included when the inventory has those fields.
+    """
+    if is_s3_uri(inventory_path):
+        file_paths, layout = locate_s3_inventory(s3_client, inventory_path)
+    else:
+        file_paths, layout = locate_inventory(inventory_path)
+    optional_fields = [
+        field for field in ("bucket", "e_tag", "last_modified_date", "is_latest") if field in layout.columns
+    ]
+    fields = ("key", "size", *optional_fields)
+
+    for file_path in file_paths:
+        source = open_s3_inventory_file(s3_client, file_path, layout) if is_s3_uri(file_path) else file_path
+        for batch in iter_inventory_batches(source, layout, fields):
+            for record in zip(*(batch[field] for field in fields)):
+                record = dict(zip(fields, record))
+                if not record["key"].startswith(prefix):
+                    continue
+                if "bucket" in record and record["bucket"] != bucket_name:
+                    continue
+                if "is_latest" in record and str(record["is_latest"]).lower() != "true":
+                    continue
+                obj = {"Key": record["key"], "Size": record["size"]}
+                if record.get("e_tag"):
+                    # ListObjectsV2 returns ETags in quotes; inventories do not.
+                    obj["ETag"] = f'"{record["e_tag"].strip(chr(34))}"'
+                if record.get("last_modified_date"):
+                    obj["LastModified"] = parse_inventory_timestamp(record["last_modified_date"])
+                yield obj
+
+
+def iter_failed_objects(journal_path, bucket_name, prefix):
+    """Yield the objects of a bucket under a prefix listed in a failure journal, in ListObjectsV2 ``Contents`` form."""
+    for entry in read_failure_journal(journal_path):
+        if entry["bucket"] != bucket_name or not entry["key"].startswith(prefix):
+            continue
+        obj = {"Key": entry["key"], "Size": entry["size"]}
+        if entry.get("e_tag"):
+            obj["ETag"] = entry["e_tag"]
+        if entry.get("last_modified"):
+            obj["LastModified"] = entry["last_modified"]
+        yield obj
+
+
+def parse_inventory_timestamp(value):
+    """Parse an inventory last_modified_date (ISO 8601, UTC when no offset is given) into an aware datetime."""
+    timestamp = datetime.fromisoformat(value)
+    return timestamp if timestamp.tzinfo is not None else timestamp.replace(tzinfo=timezone.utc)
+
+
+def relative_path_for_key(key, source_prefix):
+    """Return the path of an object key relative to the source prefix, or None for directory markers and the prefix."""
+    # Remove the source prefix from the object's key to construct a relative path
+    relative_path = key[len(source_prefix) :]
+
+    # Skip directory markers or keys that resolve to an empty relative path
+    if not relative_path or key.endswith("/"):
+        return None
+
+    return relative_path
+
+
+def local_path_for_key(key, source_prefix, local_dest_dir):
+    """Return the local file path for an object key, or None for directory markers and the prefix itself."""
+    relative_path = relative_path_for_key(key, source_prefix)
+    return os.path.join(local_dest_dir, relative_path) if relative_path is not None else None
+
+
+def object_timestamp(obj):
+    """Return the LastModified time of an object as a POSIX timestamp, or None if it is not known."""
+    last_modified = obj.get("LastModified")
+    return last_modified.timestamp() if last_modified is not None else None
+
+
+def is_up_to_date(obj, local_file_path, compare="size-mtime", journal=None):
+    """Return whether the local copy of an object is current.
+
+    The local file must have the object's size. With compare="size-mtime" its modification time must also match the
+    object's LastModified time to the second; with compare="etag" the journal must hold the object's ETag for the key,
+    recorded when the file was last written.
+    """
+    try:
+        stat = os.stat(local_file_path)
+    except OSError:
+        return False
+    if stat.st_size != obj["Size"]:
+        return False
+
+    if compare == "etag":
+        record = journal.get(obj["Key"]) if journal is not None else None
+        return (
+            record is not None
+            and record[0] == obj["Size"]
+            and record[1] == obj.get("ETag")
+            and record[3] == os.path.abspath(local_file_path)
+            and record[4] == stat.st_mtime_ns
+        )
+
+    timestamp = object_timestamp(obj)
+    return timestamp is not None and int(stat.st_mtime) == int(timestamp)
+
+
+def download_object(
+    s3_client,
+    bucket_name,
+    key,
+    local_file_path,
+    transfer_config=None,
+    last_modified=None,
+    callback=None,
+    size=None,
+    ranged_config=None,
+):
+    """Download one object, creating the local directory structure as needed.
+
+    The object is written to a temporary file next to local_file_path and renamed into place once complete, so a
+    file under the final name is never partial. The file's modification time is set to last_modified, if given.
+    callback, if given, is called with the number of bytes received as the download progresses.
+
+    Objects whose size reaches ranged_config.threshold are downloaded and verified by download_ranged; others are
+    downloaded with download_file and transfer_config.
+    """
+    # Ensure the directory structure exists locally
+    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+    partial_path = local_file_path + PARTIAL_SUFFIX
+    try:
+        if ranged_config is not None and size is not None and size >= ranged_config.threshold:
+            download_ranged(s3_client, bucket_name, key, partial_path, ranged_config, callback)
+        else:
+            s3_client.download_file(bucket_name, key, partial_path, Config=transfer_config, Callback=callback)
+        if last_modified is not None:
+            os.utime(partial_path, (last_modified, last_modified))
+        os.replace(partial_path, local_file_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def download_to_spool(
+    s3_client,
+    bucket_name,
+    key,
+    transfer_config=None,
+    callback=None,
+    size=None,
+    ranged_config=None,
+    spool_dir=None,
+):
+    """Download one object into an anonymous temporary file and return it, open for reading from the start.
+
+    Objects up to SPOOL_MEMORY bytes stay in memory. Objects whose size reaches ranged_config.threshold are downloaded
+    and verified by download_ranged into a file in spool_dir (default: the system temporary directory), which is
+    unlinked once open so it disappears when closed.
+    """
+    if ranged_config is not None and size is not None and size >= ranged_config.threshold:
+        descriptor, spool_path = tempfile.mkstemp(suffix=PARTIAL_SUFFIX, dir=spool_dir)
+        os.close(descriptor)
+        try:
+            download_ranged(s3_client, bucket_name, key, spool_path, ranged_config, callback)
+            return open(spool_path, "rb")
+        finally:
+            os.remove(spool_path)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY, dir=spool_dir)
+    try:
+        s3_client.download_fileobj(bucket_name, key, spool, Config=transfer_config, Callback=callback)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
 
 
 def main():
@@ -37,7 +352,137 @@ def main():
         help=("Name of the source S3 bucket " "(defaults to AWS_BUCKET environment variable)"),
     )
     parser.add_argument("--source-prefix", required=True, help="Prefix in the source bucket to filter objects")
-    parser.add_argument("--local-dest-dir", required=True, help="Local directory where files will be downloaded")
+    parser.add_argument("--local-dest-dir", help="Local directory where files will be downloaded")
+    parser.add_argument(
+        "--archive", help="Write the downloaded objects into this tar or zip archive instead of --local-dest-dir"
+    )
+    parser.add_argument(
+        "--archive-format",
+        choices=ARCHIVE_FORMATS,
+        help="Format of the --archive file (default: from its suffix, e.g. .tar, .tar.gz, .tar.zst or .zip)",
+    )
+    parser.add_argument(
+        "--spool-dir", help="Directory buffering large objects in archive mode (default: system temp dir)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Number of objects downloaded at the same time (default: 1)"
+    )
+    parser.add_argument(
+        "--multipart-threshold",
+        type=int,
+        default=8,
+        help="Size in MiB from which an object is downloaded in parts (default: 8)",
+    )
+    parser.add_argument(
+        "--multipart-chunksize", type=int, default=8, help="Size in MiB of each downloaded part (default: 8)"
+    )
+    parser.add_argument(
+        "--transfer-threads",
+        type=int,
+        default=10,
+        help="Number of threads downloading the parts of one multipart object (default: 10)",
+    )
+    parser.add_argument(
+        "--ranged-threshold",
+        type=int,
+        default=64,
+        help=(
+            "Size in MiB from which an object is fetched as --multipart-chunksize ranges by --transfer-threads "
+            "threads and verified while it streams (default: 64)"
+        ),
+    )
+    parser.add_argument("--quiet", action="store_true", help="Do not print a line for every object")
+    parser.add_argument("--report-json", help="Write the counts, timings and histograms of the run to this JSON file")
+    parser.add_argument(
+        "--prometheus-textfile", help="Write the metrics of the run to this file in the Prometheus text format"
+    )
+    parser.add_argument("--sync", action="store_true", help="Skip objects whose local copy is already up to date")
+    parser.add_argument(
+        "--compare",
+        choices=COMPARE_CHOICES,
+        default="size-mtime",
+        help=(
+            "How --sync decides that a local copy is up to date: same size and modification time, or same size and "
+            "ETag as recorded in the state journal (default: size-mtime)"
+        ),
+    )
+    parser.add_argument(
+        "--state-file",
+        help=(
+            "State journal of downloaded objects, kept with --sync or --retry-failed or when this is given "
+            "(default: a file in --local-dest-dir)"
+        ),
+    )
+    parser.add_argument(
+        "--inventory",
+        help=(
+            "Read the objects to download from this S3 Inventory of the source bucket (directory, manifest.json, "
+            "or s3:// URI of either) instead of listing the bucket"
+        ),
+    )
+    parser.add_argument(
+        "--largest-first", action="store_true", help="Download the largest objects first (requires --inventory)"
+    )
+    parser.add_argument(
+        "--listing",
+        choices=LISTING_CHOICES,
+        default="sequential",
+        help="List the bucket with one cursor, or list sub-prefixes in parallel (default: sequential)",
+    )
+    parser.add_argument(
+        "--listing-workers",
+        type=int,
+        default=DEFAULT_LISTING_WORKERS,
+        help=(
+            "Number of sub-prefixes listed at the same time with --listing sharded "
+            f"(default: {DEFAULT_LISTING_WORKERS})"
+        ),
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help=(
+            "Adjust the number of downloads in flight, up to --concurrency, to the observed throughput and "
+            "throttling responses"
+        ),
+    )
+    parser.add_argument(
+        "--max-bandwidth", type=float, help="Cap the combined download rate, in MiB per second (default: no cap)"
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=DEFAULT_MAX_ATTEMPTS,
+        help=(
+            "Attempts made for an object failing with a throttling or transient error "
+            f"(default: {DEFAULT_MAX_ATTEMPTS})"
+        ),
+    )
+
+    parser.add_argument(
+        "--failure-journal",
+        help=(
+            "Record the objects that fail in this file (default: the --retry-failed journal, "
+            f"{FAILURES_FILE_NAME} in --local-dest-dir, or the --archive path with a .failures.jsonl suffix)"
+        ),
+    )
+    parser.add_argument(
+        "--retry-failed",
+        metavar="JOURNAL",
+        help=(
+            "Download only the objects of the source bucket and prefix listed in this failure journal; with "
+            "--archive, they are written to a new archive"
+        ),
+    )
+
+    parser.add_argument(
+        "--dedup-store",
+        metavar="DIR",
+        help=(
+            "Download each distinct object content (ETag and size) once into this directory and link the local "
+            "files to it; --sync then compares ETags"
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -46,47 +491,289 @@ def main():
         parser.error("The --source-profile argument is required or set the AWS_PROFILE environment variable.")
     if not args.source_bucket:
         parser.error("The --source-bucket argument is required or set the AWS_BUCKET environment variable.")
+    if min(args.concurrency, args.transfer_threads, args.listing_workers, args.max_attempts) < 1:
+        parser.error("--concurrency, --transfer-threads, --listing-workers and --max-attempts must be at least 1.")
+    if args.max_bandwidth is not None and args.max_bandwidth <= 0:
+        parser.error("--max-bandwidth must be positive.")
+    if args.largest_first and not args.inventory:
+        parser.error("--largest-first requires --inventory.")
+    if args.inventory and args.retry_failed:
+        parser.error("--inventory and --retry-failed cannot be combined.")
+    if (args.local_dest_dir is None) == (args.archive is None):
+        parser.error("Exactly one of --local-dest-dir and --archive is required.")
+    if args.archive and (args.sync or args.dedup_store):
+        parser.error("--sync and --dedup-store apply to --local-dest-dir downloads only.")
+    archive_format = None
+    if args.archive:
+        archive_format = args.archive_format or archive_format_for(args.archive)
+        if archive_format is None:
+            parser.error(f"Cannot tell the format of {args.archive}; pass --archive-format.")
+        if os.path.exists(args.archive):
+            parser.error(f"{args.archive} already exists; remove it or write to another --archive.")
 
     source_profile = args.source_profile
     source_bucket_name = args.source_bucket
     source_prefix = args.source_prefix
     local_dest_dir = args.local_dest_dir
 
-    # Create a session for the source AWS profile and initialize S3 resource
-    source_session = boto3.Session(profile_name=source_profile)
-    source_s3 = source_session.resource("s3")
-    source_bucket = source_s3.Bucket(source_bucket_name)
+    transfer_config = TransferConfig(
+        multipart_threshold=args.multipart_threshold * MB,
+        multipart_chunksize=args.multipart_chunksize * MB,
+        max_concurrency=args.transfer_threads,
+    )
+    ranged_config = RangedDownloadConfig(
+        threshold=args.ranged_threshold * MB, part_size=args.multipart_chunksize * MB, workers=args.transfer_threads
+    )
+
+    # Create a client for the source AWS profile, shared by all downloads
+    s3_client = create_s3_client(
+        source_profile, max_pool_connections=max(10, args.concurrency * args.transfer_threads + args.listing_workers)
+    )
 
     # Ensure the local destination directory exists
-    if not os.path.exists(local_dest_dir):
+    if local_dest_dir is not None and not os.path.exists(local_dest_dir):
         os.makedirs(local_dest_dir)
 
-    # Loop through objects with the specified prefix in the source bucket
-    for obj in source_bucket.objects.filter(Prefix=source_prefix):
-        # Remove the source prefix from the object's key to construct a relative path
-        relative_path = obj.key[len(source_prefix) :]
+    if args.retry_failed:
+        try:
+            objects = list(iter_failed_objects(args.retry_failed, source_bucket_name, source_prefix))
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Error reading failure journal {args.retry_failed}: {error}")
+            sys.exit(1)
+        metrics = TransferMetrics(len(objects), sum(obj["Size"] for obj in objects))
+        print(f"Retrying {metrics.total_objects} failed object(s), {metrics.total_bytes} bytes.")
+    elif args.inventory:
+        try:
+            objects = list(iter_inventory_objects(args.inventory, source_bucket_name, source_prefix, s3_client))
+        except (OSError, ValueError, KeyError, RuntimeError, ClientError) as error:
+            print(f"Error reading inventory {args.inventory}: {error}")
+            sys.exit(1)
+        if args.largest_first:
+            objects.sort(key=lambda obj: obj["Size"], reverse=True)
+        metrics = TransferMetrics(len(objects), sum(obj["Size"] for obj in objects))
+        print(f"Inventory lists {metrics.total_objects} object(s), {metrics.total_bytes} bytes.")
+    elif args.listing == "sharded":
+        objects = iter_sharded_objects(s3_client, source_bucket_name, source_prefix, args.listing_workers)
+        metrics = TransferMetrics()
+    else:
+        objects = iter_source_objects(s3_client, source_bucket_name, source_prefix)
+        metrics = TransferMetrics()
 
-        # Skip directory markers or keys that resolve to an empty relative path
-        if not relative_path or obj.key.endswith("/"):
-            print(f"Skipping directory marker or empty key: {obj.key}")
-            continue
+    if args.failure_journal or args.retry_failed:
+        failures_path = args.failure_journal or args.retry_failed
+    elif args.archive:
+        failures_path = f"{args.archive}.failures.jsonl"
+    else:
+        failures_path = default_failures_path(local_dest_dir)
+    try:
+        failures = FailureJournal(failures_path)
+    except (OSError, ValueError, KeyError) as error:
+        print(f"Error reading failure journal {failures_path}: {error}")
+        sys.exit(1)
+
+    if args.archive:
+        journal = None
+        try:
+            archive = ArchiveWriter(args.archive, archive_format)
+        except (OSError, RuntimeError) as error:
+            print(f"Error creating archive {args.archive}: {error}")
+            sys.exit(1)
+    else:
+        # The journal is only kept when it is asked for, so that a plain download leaves no tool files behind
+        if args.sync or args.retry_failed or args.state_file:
+            journal = DownloadStateJournal(args.state_file or default_state_path(local_dest_dir))
+        else:
+            journal = None
+        archive = None
+    store = ContentStore(args.dedup_store) if args.dedup_store else None
+    # Linked files share the stored copy's modification time, so only ETags tell whether they are current.
+    compare = "etag" if store is not None else args.compare
+    up_to_date = 0
+    controller = AdaptiveConcurrency(args.concurrency) if args.adaptive else None
+    bandwidth = TokenBucket(args.max_bandwidth * MB) if args.max_bandwidth else None
 
-        # Construct the local file path
-        local_file_path = os.path.join(local_dest_dir, relative_path)
+    def receive(amount):
+        metrics.record_bytes(amount)
+        if bandwidth is not None:
+            bandwidth.consume(amount)
 
-        # Ensure the directory structure exists locally
-        local_dir = os.path.dirname(local_file_path)
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir)
+    def skip(obj):
+        failures.record_success(source_bucket_name, obj["Key"])
+        metrics.record_skip(obj["Size"])
 
-        print(f"Downloading {obj.key} to {local_file_path}...")
-        try:
-            source_bucket.download_file(obj.key, local_file_path)
-        except ClientError as e:
-            print(f"Error downloading {obj.key}: {e}")
+    def downloads():
+        nonlocal up_to_date
+        # Loop through objects with the specified prefix in the source bucket
+        for obj in metrics.time_listing(objects):
+            relative_path = relative_path_for_key(obj["Key"], source_prefix)
+            if relative_path is None:
+                if not args.quiet:
+                    print(f"Skipping directory marker or empty key: {obj['Key']}")
+                skip(obj)
+                continue
+            if archive is not None:
+                if not args.quiet:
+                    print(f"Downloading {obj['Key']} to {args.archive}:{relative_path}...")
+                yield obj, relative_path
+                continue
+            local_file_path = os.path.join(local_dest_dir, relative_path)
+            if args.sync and is_up_to_date(obj, local_file_path, compare, journal):
+                up_to_date += 1
+                skip(obj)
+                continue
+            if not args.quiet:
+                print(f"Downloading {obj['Key']} to {local_file_path}...")
+            yield obj, local_file_path
+
+    def download(item):
+        started = time.monotonic()
+        return transfer(item), time.monotonic() - started
+
+    def transfer(item):
+        obj, target = item
+        if archive is not None:
+            return download_to_spool(
+                s3_client,
+                source_bucket_name,
+                obj["Key"],
+                transfer_config,
+                receive,
+                obj["Size"],
+                ranged_config,
+                args.spool_dir,
+            )
+        if store is not None and obj.get("ETag"):
+            return store.materialize(
+                obj["ETag"],
+                obj["Size"],
+                target,
+                lambda store_path: download_object(
+                    s3_client,
+                    source_bucket_name,
+                    obj["Key"],
+                    store_path,
+                    transfer_config,
+                    object_timestamp(obj),
+                    receive,
+                    obj["Size"],
+                    ranged_config,
+                ),
+                object_timestamp(obj),
+            )
+        return download_object(
+            s3_client,
+            source_bucket_name,
+            obj["Key"],
+            target,
+            transfer_config,
+            object_timestamp(obj),
+            receive,
+            obj["Size"],
+            ranged_config,
+        )
+
+    results = run_transfers(
+        downloads(),
+        download,
+        args.concurrency,
+        controller=controller,
+        max_attempts=args.max_attempts,
+        size_of=lambda item: item[0]["Size"],
+    )
+    metrics.start_progress(PROGRESS_INTERVAL)
+    try:
+        for (obj, target), result, failure, attempts in results:
+            if failure is None:
+                spool, seconds = result
+                if archive is not None:
+                    with spool:
+                        size = spool.seek(0, os.SEEK_END)
+                        spool.seek(0)
+                        archive.add(target, spool, size, object_timestamp(obj))
+                elif journal is not None:
+                    journal.record(obj["Key"], obj["Size"], obj.get("ETag"), object_timestamp(obj), target)
+                failures.record_success(source_bucket_name, obj["Key"])
+                metrics.record_download(obj["Size"], seconds, attempts)
+            else:
+                # Any error of one object is recorded, so that the other objects are still downloaded
+                tries = f" (after {attempts} attempts)" if attempts > 1 else ""
+                print(f"Error downloading {obj['Key']}{tries}: {describe_error(failure)}")
+                failures.record(source_bucket_name, obj, failure, attempts)
+                metrics.record_failure(obj["Size"], attempts)
+    except BaseException:
+        if archive is not None:
+            archive.abort()
+        failures.abort()
+        raise
+    finally:
+        metrics.stop_progress()
+        if journal is not None:
+            journal.close()
+    failures.close()
+
+    if archive is not None:
+        archive.close()
+        print(f"Wrote {archive.entries} object(s) to {args.archive}.")
+
+    if controller is not None:
+        print(
+            f"Adaptive concurrency: ended at {controller.limit}, peaked at {controller.peak_limit}, "
+            f"{controller.throttles} throttling response(s)."
+        )
 
+    print(metrics.progress_line())
+    report = metrics.to_dict()
+    print(
+        f"Downloaded {metrics.downloaded_objects} object(s), {metrics.downloaded_bytes} bytes, in "
+        f"{report['elapsed_seconds']:.1f} s ({(report['mean_rate_bytes_per_second'] or 0) / 1e6:.2f} MB/s); "
+        f"{metrics.failed_objects} failed, {metrics.retries} retried attempt(s)."
+    )
+    print(
+        f"Listing: waited {metrics.listing_wait_seconds:.1f} s; transfers: {metrics.transfer_seconds:.1f} s "
+        f"of download time, median object latency {_format_seconds(metrics.latency.quantiles.quantile(0.5))}, "
+        f"p99 {_format_seconds(metrics.latency.quantiles.quantile(0.99))}."
+    )
+    extra = {"source_bucket": source_bucket_name, "source_prefix": source_prefix, "concurrency": args.concurrency}
+    if store is not None:
+        print(
+            f"Content store: downloaded {store.stored_objects} distinct object(s), reused stored copies for "
+            f"{store.reused_objects} object(s) ({store.reused_bytes} bytes not downloaded)."
+        )
+        extra["content_store"] = {
+            "stored_objects": store.stored_objects,
+            "reused_objects": store.reused_objects,
+            "reused_bytes": store.reused_bytes,
+        }
+    if controller is not None:
+        extra["adaptive_concurrency"] = {
+            "final_limit": controller.limit,
+            "peak_limit": controller.peak_limit,
+            "throttles": controller.throttles,
+        }
+    if args.report_json:
+        metrics.write_json(args.report_json, extra)
+    if args.prometheus_textfile:
+        metrics.write_prometheus(args.prometheus_textfile)
+
+    if args.sync:
+        print(f"Skipped {up_to_date} up-to-date object(s).")
+    if failures.failures:
+        retry = f"--retry-failed {failures.path}" + (" and a new --archive" if archive is not None else "")
+        print(f"Recorded {failures.failures} failed object(s) in {failures.path}; retry them with {retry}.")
     print("Download complete!")
 
 
+def describe_error(error):
+    """Describe an error, naming its type unless it is an S3 or integrity error whose message says it all."""
+    if isinstance(error, (ClientError, IntegrityError)):
+        return str(error)
+    return f"{type(error).__name__}: {error}"
+
+
+def _format_seconds(seconds):
+    """Format an optional duration in seconds for the run summary."""
+    return "n/a" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+"""Parallel listing of the objects under an S3 prefix.
+
+A single ListObjectsV2 cursor returns at most 1,000 keys per request, one request after another, so listing a
+prefix holding millions of keys is slow however fast each request is. This module lists a prefix as independent
+shards on a pool of threads:
+
+1. The prefix is first listed with ``Delimiter="/"``; the objects directly under it are yielded and each common
+   prefix (sub-directory) becomes a shard.
+2. A shard is listed without a delimiter, so small directory trees cost one request per 1,000 keys as with a
+   sequential listing.
+3. A shard that is still truncated after a few pages is large: it is split by listing the rest of it (the keys
+   after the last key seen) with ``Delimiter="/"`` again. The sub-directory holding the last key seen continues
+   after that key, and every later sub-directory becomes a new shard.
+
+Keys are yielded as soon as a page arrives, in no particular order, through a bounded queue so memory stays flat
+when the consumer is slower than the listing.
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_LISTING_WORKERS = 16
+
+# Pages listed from a shard before it is split into sub-shards.
+DEFAULT_SPLIT_AFTER_PAGES = 5
+
+# Listing pages buffered between the listing threads and the consumer.
+QUEUE_PAGES = 64
+
+_DONE = object()
+
+
+def iter_sharded_objects(
+    s3_client,
+    bucket_name,
+    prefix,
+    workers=DEFAULT_LISTING_WORKERS,
+    split_after_pages=DEFAULT_SPLIT_AFTER_PAGES,
+    page_size=1000,
+):
+    """Yield the objects (ListObjectsV2 ``Contents`` entries) under a prefix, listing shards in parallel.
+
+    Every object is yielded exactly once, in no particular order.
+
+    Args:
+        s3_client: Thread-safe S3 client with a connection pool of at least ``workers`` connections.
+        bucket_name (str): Bucket to list.
+        prefix (str): Key prefix of the objects to yield.
+        workers (int): Number of shards listed at the same time.
+        split_after_pages (int): Number of pages listed from a shard before it is split, at least 1.
+        page_size (int): Maximum number of keys per ListObjectsV2 request.
+
+    Raises:
+        ValueError: If split_after_pages is less than 1.
+    """
+    if split_after_pages < 1:
+        raise ValueError(f"split_after_pages must be at least 1, not {split_after_pages}.")
+    pages = queue.Queue(maxsize=QUEUE_PAGES)
+    stopped = threading.Event()
+    lock = threading.Lock()
+    pending = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def put(item):
+        # Give up if the consumer has stopped, rather than block on a queue nobody drains.
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def submit(task, *args):
+        nonlocal pending
+        with lock:
+            pending += 1
+        executor.submit(run, task, *args)
+
+    def run(task, *args):
+        nonlocal pending
+        try:
+            if not stopped.is_set():
+                task(*args)
+        except Exception as error:
+            put(error)
+        finally:
+            with lock:
+                pending -= 1
+                finished = pending == 0
+            if finished:
+                put(_DONE)
+
+    def list_shard(shard_prefix, start_after):
+        request = {"Bucket": bucket_name, "Prefix": shard_prefix, "MaxKeys": page_size}
+        if start_after is not None:
+            request["StartAfter"] = start_after
+        # Pages may come back empty but truncated, so the last key seen is kept across pages
+        last_key = start_after
+        for _page in range(split_after_pages):
+            response = s3_client.list_objects_v2(**request)
+            contents = response.get("Contents", [])
+            if contents:
+                put(contents)
+                last_key = contents[-1]["Key"]
+            if not response.get("IsTruncated") or stopped.is_set():
+                return
+            request["ContinuationToken"] = response["NextContinuationToken"]
+        split_shard(shard_prefix, last_key)
+
+    def split_shard(shard_prefix, start_after):
+        request = {"Bucket": bucket_name, "Prefix": shard_prefix, "Delimiter": "/", "MaxKeys": page_size}
+        current_prefix = None
+        if start_after is not None:
+            request["StartAfter"] = start_after
+            name, separator, _rest = start_after[len(shard_prefix) :].partition("/")
+            if separator:
+                # The listing stopped inside this sub-directory: continue it after the last key seen. Whether the
+                # delimited listing below also reports it varies, so it is skipped there.
+                current_prefix = shard_prefix + name + "/"
+                submit(list_shard, current_prefix, start_after)
+        while not stopped.is_set():
+            response = s3_client.list_objects_v2(**request)
+            if response.get("Contents"):
+                put(response["Contents"])
+            for common_prefix in response.get("CommonPrefixes", []):
+                if common_prefix["Prefix"] != current_prefix:
+                    submit(list_shard, common_prefix["Prefix"], None)
+            if not response.get("IsTruncated"):
+                return
+            request["ContinuationToken"] = response["NextContinuationToken"]
+
+    submit(split_shard, prefix, None)
+    try:
+        while True:
+            item = pages.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+    finally:
+        stopped.set()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,242 @@
+"""Flow control for concurrent S3 transfers.
+
+S3 throttles request rates per prefix with SlowDown (503) responses, and several transfer jobs sharing a link slow
+each other down. This module provides:
+
+- ``AdaptiveConcurrency``, which raises and lowers the number of requests in flight in the manner of TCP congestion
+  control (additive increase, multiplicative decrease): the limit grows by one each measurement window while
+  throughput keeps up, is halved on throttling, and steps back when growing it made throughput drop.
+- ``TokenBucket``, a shared bandwidth cap.
+- ``run_transfers``, which runs transfer tasks on a thread pool within the controller's limit and retries throttled
+  and transient failures after a jittered exponential backoff, so that they are not dropped.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from boto3.exceptions import RetriesExceededError
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.exceptions import HTTPClientError
+from botocore.exceptions import IncompleteReadError
+
+
+# Error codes S3 (and other AWS services) return when a client sends requests too fast.
+THROTTLE_ERROR_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "TooManyRequestsException",
+    "503",
+}
+
+# Error codes of transient server-side failures, retried without slowing down.
+TRANSIENT_ERROR_CODES = {"InternalError", "ServiceUnavailable", "RequestTimeout", "500", "502", "504"}
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Jittered exponential backoff between attempts, in seconds.
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Seconds over which AdaptiveConcurrency measures throughput before adjusting its limit.
+ADJUST_WINDOW = 2.0
+
+# Relative throughput drop after an increase that makes AdaptiveConcurrency step back.
+THROUGHPUT_TOLERANCE = 0.1
+
+
+def _error_code(error):
+    """Return the error code and HTTP status of a ClientError, or (None, None)."""
+    if not isinstance(error, ClientError):
+        return None, None
+    response = error.response or {}
+    return response.get("Error", {}).get("Code"), response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+
+def is_throttle_error(error):
+    """Return whether an exception is a throttling response."""
+    code, status = _error_code(error)
+    return code in THROTTLE_ERROR_CODES or status in (429, 503)
+
+
+def is_retryable_error(error):
+    """Return whether an exception is a throttling response or a transient failure worth retrying.
+
+    Transient failures include connection errors and responses cut short while their body is read (botocore's
+    ResponseStreamingError, ReadTimeoutError and ConnectionClosedError are HTTPClientErrors), which botocore does
+    not retry itself.
+    """
+    if is_throttle_error(error) or isinstance(
+        error, (RetriesExceededError, BotocoreConnectionError, HTTPClientError, IncompleteReadError)
+    ):
+        return True
+    code, status = _error_code(error)
+    return code in TRANSIENT_ERROR_CODES or (status is not None and status >= 500)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Return a "full jitter" delay before retrying after the given (1-based) failed attempt."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))  # nosec: jitter, not cryptography
+
+
+class AdaptiveConcurrency:
+    """Additive-increase, multiplicative-decrease limit on the number of requests in flight.
+
+    The controller is not thread-safe; it is meant to be driven from the thread collecting transfer results.
+    """
+
+    def __init__(self, maximum, initial=None, minimum=1, window=ADJUST_WINDOW):
+        """Create a controller.
+
+        Args:
+            maximum (int): Highest limit.
+            initial (int): Starting limit (default: the smaller of maximum and 4).
+            minimum (int): Lowest limit.
+            window (float): Seconds of throughput measured before each adjustment.
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.window = window
+        self.limit = max(minimum, min(maximum, initial if initial is not None else 4))
+        self.throttles = 0
+        self.peak_limit = self.limit
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_throttled = False
+        self._previous_throughput = None
+        self._increased = False
+        self._last_decrease = float("-inf")
+
+    def record_success(self, size):
+        """Record a completed transfer of size bytes."""
+        self._window_bytes += size
+        self._maybe_adjust()
+
+    def record_throttle(self):
+        """Record a throttling response, halving the limit at most once per window."""
+        self.throttles += 1
+        self._window_throttled = True
+        now = time.monotonic()
+        if now - self._last_decrease >= self.window:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._last_decrease = now
+            self._increased = False
+            self._start_window(now, None)
+
+    def _maybe_adjust(self):
+        """Adjust the limit once a measurement window has elapsed."""
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+
+        throughput = self._window_bytes / elapsed
+        previous = self._previous_throughput
+        if self._increased and previous is not None and throughput < previous * (1 - THROUGHPUT_TOLERANCE):
+            # More requests in flight did not help: the link or the bucket is saturated.
+            self.limit = max(self.minimum, self.limit - 1)
+            self._increased = False
+        elif not self._window_throttled and self.limit < self.maximum:
+            self.limit += 1
+            self._increased = True
+            self.peak_limit = max(self.peak_limit, self.limit)
+        else:
+            self._increased = False
+        self._start_window(now, throughput)
+
+    def _start_window(self, now, throughput):
+        """Start a new measurement window."""
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_throttled = False
+        self._previous_throughput = throughput
+
+
+class TokenBucket:
+    """Thread-safe bandwidth limiter: ``consume`` blocks callers so that on average at most rate bytes/s pass."""
+
+    def __init__(self, rate, burst=None):
+        """Create a bucket refilled at rate bytes per second, holding at most burst bytes (default: rate)."""
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Take amount bytes from the bucket, sleeping while it is in debt."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_transfers(items, task, concurrency, controller=None, max_attempts=1, size_of=None):
+    """Run task(item) for every item on a pool of threads, yielding (item, result, error, attempts) as each finishes.
+
+    Items are drawn from the iterable only as slots free up, so at most ``concurrency`` items are in flight (fewer
+    while the controller's limit is lower) whatever the length of the iterable. result is the value returned by the
+    task, and error the exception raised by the last attempt (result then being None), or None.
+
+    Args:
+        items: Iterable of items to transfer.
+        task: Callable transferring one item.
+        concurrency (int): Number of threads, the most items ever in flight.
+        controller (AdaptiveConcurrency): Optional controller setting the limit on items in flight, informed of every
+            success and throttling response.
+        max_attempts (int): Attempts made for an item failing with a retryable error (see is_retryable_error)
+            before it is yielded with that error.
+        size_of: Callable returning the bytes transferred for an item, reported to the controller.
+    """
+    items = iter(items)
+    sequence = itertools.count()
+    retries = []  # Min-heap of (ready_time, sequence, item, attempts)
+    in_flight = {}
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            limit = min(concurrency, controller.limit) if controller is not None else concurrency
+            now = time.monotonic()
+            while retries and retries[0][0] <= now and len(in_flight) < limit:
+                _ready, _sequence, item, attempts = heapq.heappop(retries)
+                in_flight[executor.submit(task, item)] = (item, attempts + 1)
+            while not exhausted and len(in_flight) < limit:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    in_flight[executor.submit(task, item)] = (item, 1)
+            if not in_flight and not retries:
+                break
+
+            timeout = max(0.0, retries[0][0] - now) if retries else None
+            if not in_flight:
+                time.sleep(timeout)
+                continue
+            done, _pending = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                item, attempts = in_flight.pop(future)
+                error = future.exception()
+                if controller is not None:
+                    if error is None:
+                        controller.record_success(size_of(item) if size_of is not None else 0)
+                    elif is_throttle_error(error):
+                        controller.record_throttle()
+                if error is not None and attempts < max_attempts and is_retryable_error(error):
+                    ready = time.monotonic() + backoff_delay(attempts)
+                    heapq.heappush(retries, (ready, next(sequence), item, attempts))
+                    continue
+                yield item, None if error is not None else future.result(), error, attempts
@@ -0,0 +1,276 @@
+"""Progress and performance metrics of pdc-s3-download runs.
+
+TransferMetrics counts downloaded, skipped and failed objects and bytes, keeps histograms of per-object latency and
+throughput, and separates the time spent waiting on the object listing from the time spent transferring. Downloads
+report their bytes as they stream, so a background thread prints live progress (with a transfer rate and, when the
+totals are known, an ETA) that keeps moving while large objects are in flight. A final JSON report and a Prometheus
+textfile for the node_exporter textfile collector are also written.
+
+Histograms use fixed buckets, as Prometheus expects; percentiles come from a relative-error QuantileSketch.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from pds.pdc.inventory_sketch import QuantileSketch
+
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Upper bounds of the per-object throughput histogram buckets, in bytes per second.
+THROUGHPUT_BUCKETS = tuple(2**power for power in range(14, 32, 2))
+
+REPORTED_PERCENTILES = (50, 90, 99)
+
+# Seconds of transfers over which the current rate shown in progress lines is measured.
+RATE_WINDOW = 30.0
+
+PROMETHEUS_PREFIX = "pdc_s3_download"
+
+
+class Histogram:
+    """Counts of observed values per fixed bucket, with their sum and estimated percentiles."""
+
+    def __init__(self, bounds):
+        """Create an empty histogram with the given increasing bucket upper bounds (a +Inf bucket is implied)."""
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.quantiles = QuantileSketch()
+
+    def observe(self, value):
+        """Add a value."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.quantiles.add_values([value])
+
+    def to_dict(self):
+        """Return the histogram as a JSON-serializable dict."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "percentiles": {
+                f"p{percentile:g}": self.quantiles.quantile(percentile / 100) for percentile in REPORTED_PERCENTILES
+            },
+            "buckets": [{"le": bound, "count": count} for bound, count in zip(self.bounds + ("+Inf",), self.counts)],
+        }
+
+    def prometheus_lines(self, name, help_text):
+        """Return the histogram in the Prometheus text exposition format."""
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class TransferMetrics:
+    """Counters, histograms and timings of a download run."""
+
+    def __init__(self, total_objects=None, total_bytes=None):
+        """Start measuring a run; the totals are given when the objects are known in advance (e.g. an inventory)."""
+        self.total_objects = total_objects
+        self.total_bytes = total_bytes
+        self.downloaded_objects = 0
+        self.downloaded_bytes = 0
+        self.skipped_objects = 0
+        self.skipped_bytes = 0
+        self.failed_objects = 0
+        self.failed_bytes = 0
+        self.received_bytes = 0
+        self.retries = 0
+        self.listing_wait_seconds = 0.0
+        self.listing_done_seconds = None
+        self.transfer_seconds = 0.0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.started = time.monotonic()
+        self._recent = deque()  # (time, bytes) received recently
+        self._lock = threading.Lock()
+        self._stop_progress = None
+        self._progress_thread = None
+
+    @property
+    def processed_objects(self):
+        """Objects downloaded, skipped or failed so far."""
+        return self.downloaded_objects + self.skipped_objects + self.failed_objects
+
+    @property
+    def processed_bytes(self):
+        """Bytes of the objects downloaded, skipped or failed so far."""
+        return self.downloaded_bytes + self.skipped_bytes + self.failed_bytes
+
+    def elapsed(self):
+        """Seconds since the run started."""
+        return time.monotonic() - self.started
+
+    def time_listing(self, objects):
+        """Pass objects through, adding the time spent waiting for each to the listing wait time."""
+        objects = iter(objects)
+        while True:
+            start = time.monotonic()
+            obj = next(objects, None)
+            self.listing_wait_seconds += time.monotonic() - start
+            if obj is None:
+                self.listing_done_seconds = self.elapsed()
+                return
+            yield obj
+
+    def record_download(self, size, seconds, attempts=1):
+        """Record an object of size bytes downloaded in seconds (by its last attempt)."""
+        self.downloaded_objects += 1
+        self.downloaded_bytes += size
+        self.retries += attempts - 1
+        self.transfer_seconds += seconds
+        self.latency.observe(seconds)
+        if seconds > 0:
+            self.throughput.observe(size / seconds)
+
+    def record_bytes(self, amount):
+        """Record amount bytes received (negative when a transfer gives back bytes it retries); thread-safe."""
+        now = time.monotonic()
+        with self._lock:
+            self.received_bytes += amount
+            self._recent.append((now, amount))
+            while self._recent and self._recent[0][0] < now - RATE_WINDOW:
+                self._recent.popleft()
+
+    def record_skip(self, size):
+        """Record an object that did not need downloading."""
+        self.skipped_objects += 1
+        self.skipped_bytes += size
+
+    def record_failure(self, size, attempts=1):
+        """Record an object that could not be downloaded."""
+        self.failed_objects += 1
+        self.failed_bytes += size
+        self.retries += attempts - 1
+
+    def current_rate(self):
+        """Return the rate bytes were received at over the last RATE_WINDOW seconds, in bytes per second."""
+        now = time.monotonic()
+        elapsed = min(now - self.started, RATE_WINDOW)
+        with self._lock:
+            received = sum(amount for received_time, amount in self._recent if received_time >= now - RATE_WINDOW)
+        return max(0.0, received / elapsed) if elapsed > 0 else 0.0
+
+    def progress_line(self):
+        """Return a one-line summary of the progress so far.
+
+        The bytes shown include those received by transfers still in flight.
+        """
+        rate = self.current_rate()
+        done_bytes = self.skipped_bytes + self.failed_bytes + self.received_bytes
+        objects = f"{self.processed_objects}"
+        data = f"{done_bytes / 1e6:.1f} MB"
+        eta = ""
+        if self.total_objects is not None:
+            objects += f"/{self.total_objects}"
+            data += f"/{self.total_bytes / 1e6:.1f} MB"
+            remaining = max(0, self.total_bytes - done_bytes)
+            if rate > 0:
+                eta = f", ETA {_format_duration(remaining / rate)}"
+        return f"Progress: {objects} object(s), {data}, {rate / 1e6:.2f} MB/s, {self.failed_objects} failed{eta}"
+
+    def start_progress(self, interval):
+        """Print a progress line every interval seconds from a background thread, until stop_progress is called."""
+        self._stop_progress = threading.Event()
+
+        def report():
+            while not self._stop_progress.wait(interval):
+                print(self.progress_line(), flush=True)
+
+        self._progress_thread = threading.Thread(target=report, name="pdc-progress", daemon=True)
+        self._progress_thread.start()
+
+    def stop_progress(self):
+        """Stop printing progress lines."""
+        if self._progress_thread is not None:
+            self._stop_progress.set()
+            self._progress_thread.join()
+            self._progress_thread = None
+
+    def to_dict(self):
+        """Return the metrics as a JSON-serializable dict."""
+        elapsed = self.elapsed()
+        return {
+            "elapsed_seconds": elapsed,
+            "objects": {
+                "downloaded": self.downloaded_objects,
+                "skipped": self.skipped_objects,
+                "failed": self.failed_objects,
+                "total": self.total_objects,
+            },
+            "bytes": {
+                "downloaded": self.downloaded_bytes,
+                "skipped": self.skipped_bytes,
+                "failed": self.failed_bytes,
+                "total": self.total_bytes,
+            },
+            "retries": self.retries,
+            "mean_rate_bytes_per_second": self.downloaded_bytes / elapsed if elapsed > 0 else None,
+            "listing": {
+                "wait_seconds": self.listing_wait_seconds,
+                "completed_after_seconds": self.listing_done_seconds,
+            },
+            "transfer": {"busy_seconds": self.transfer_seconds},
+            "object_latency_seconds": self.latency.to_dict(),
+            "object_throughput_bytes_per_second": self.throughput.to_dict(),
+        }
+
+    def write_json(self, path, extra=None):
+        """Write the metrics, with any extra entries, as a JSON report."""
+        with open(path, "w") as json_file:
+            json.dump(dict(self.to_dict(), **(extra or {})), json_file, indent=2)
+            json_file.write("\n")
+
+    def write_prometheus(self, path):
+        """Write the metrics in the Prometheus text format, atomically as the textfile collector requires."""
+        prefix = PROMETHEUS_PREFIX
+        lines = [f"# HELP {prefix}_objects Objects processed by the last run.", f"# TYPE {prefix}_objects gauge"]
+        for status, count in (
+            ("downloaded", self.downloaded_objects),
+            ("skipped", self.skipped_objects),
+            ("failed", self.failed_objects),
+        ):
+            lines.append(f'{prefix}_objects{{status="{status}"}} {count}')
+        lines += [f"# HELP {prefix}_bytes Bytes processed by the last run.", f"# TYPE {prefix}_bytes gauge"]
+        for status, size in (
+            ("downloaded", self.downloaded_bytes),
+            ("skipped", self.skipped_bytes),
+            ("failed", self.failed_bytes),
+        ):
+            lines.append(f'{prefix}_bytes{{status="{status}"}} {size}')
+        for name, help_text, value in (
+            ("duration_seconds", "Wall time of the last run.", self.elapsed()),
+            ("listing_wait_seconds", "Time the last run waited on the object listing.", self.listing_wait_seconds),
+            ("transfer_busy_seconds", "Sum of the object download times of the last run.", self.transfer_seconds),
+            ("retries", "Download attempts retried by the last run.", self.retries),
+            ("last_run_timestamp_seconds", "Time the last run finished.", time.time()),
+        ):
+            lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} gauge"]
+            lines.append(f"{prefix}_{name} {value}")
+        lines += self.latency.prometheus_lines(f"{prefix}_object_latency_seconds", "Download time per object.")
+        lines += self.throughput.prometheus_lines(
+            f"{prefix}_object_throughput_bytes_per_second", "Download rate per object."
+        )
+
+        partial_path = f"{path}.pdc-partial"
+        with open(partial_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(partial_path, path)
+
+
+def _format_duration(seconds):
+    """Format a duration in seconds as H:MM:SS."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,5 @@
+"""The password expiration Lambda imports its modules by name, from the directory it is deployed from."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, "src", "pds", "cognito"))
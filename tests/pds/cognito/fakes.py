@@ -0,0 +1,65 @@
+"""In-memory stand-ins for the Cognito client and the notification outbox of a password expiration check."""
+from concurrent.futures import Future
+
+
+class FakeCognito:
+    """Cognito client of one user pool, listing users and auth events page_size at a time."""
+
+    def __init__(self, users, events, page_size=10):
+        """Serve the given ListUsers entries, and the auth events (newest first) of each username."""
+        self.users = users
+        self.events = events
+        self.page_size = page_size
+        self.served_events = {}
+        self.resets = []
+
+    def describe_user_pool(self, UserPoolId):
+        return {"UserPool": {"Name": "pool"}}
+
+    def list_users(self, UserPoolId, AttributesToGet=None, PaginationToken=None):
+        start = int(PaginationToken or 0)
+        response = {"Users": self.users[start : start + self.page_size]}
+        if start + self.page_size < len(self.users):
+            response["PaginationToken"] = str(start + self.page_size)
+        return response
+
+    def admin_list_user_auth_events(self, UserPoolId, Username, NextToken=None):
+        start = int(NextToken or 0)
+        page = self.events.get(Username, [])[start : start + self.page_size]
+        self.served_events.setdefault(Username, []).extend(page)
+        response = {"AuthEvents": page}
+        if start + self.page_size < len(self.events.get(Username, [])):
+            response["NextToken"] = str(start + self.page_size)
+        return response
+
+    def admin_set_user_password(self, UserPoolId, Username, Password, Permanent):
+        self.resets.append(Username)
+
+
+class FakeOutbox:
+    """Outbox delivering every message at once."""
+
+    def __init__(self):
+        """Start with no message sent."""
+        self.sent = []
+
+    def send(self, to_email, subject, body):
+        self.sent.append((to_email, subject))
+        future = Future()
+        future.set_result(1)
+        return future
+
+
+def user(username, created, status="CONFIRMED"):
+    """Return the ListUsers entry of a user with an email address."""
+    return {
+        "Username": username,
+        "UserStatus": status,
+        "UserCreateDate": created,
+        "Attributes": [{"Name": "email", "Value": f"{username}@example.com"}],
+    }
+
+
+def event(created, event_type="SignIn"):
+    """Return a successful auth event."""
+    return {"CreationDate": created, "EventType": event_type, "EventResponse": "Pass"}
@@ -0,0 +1,261 @@
+import copy
+import os
+import tempfile
+import unittest
+from concurrent.futures import Future
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import boto3
+import enforce_password_expiration
+from moto import mock_aws
+from password_state import DynamoDBPasswordStateStore
+from password_state import JsonPasswordStateStore
+
+from .fakes import event
+from .fakes import FakeCognito
+from .fakes import FakeOutbox
+from .fakes import user
+
+POOL = "us-west-2_pool"
+
+
+def leased(owner, minutes, processed=()):
+    """Return a checkpoint of page "2" leased to owner for the given minutes from now (negative: expired)."""
+    return {
+        "run_started": "2026-10-18T06:00:00",
+        "pagination_token": "2",
+        "processed": list(processed),
+        "owner": owner,
+        "lease_expires": (datetime.now() + timedelta(minutes=minutes)).isoformat(),
+    }
+
+
+class LeaseTests:
+    """Tests of take_lease shared by the state stores, which setUp assigns to self.store."""
+
+    def test_one_of_two_runs_takes_a_new_checkpoint(self):
+        self.assertTrue(self.store.take_lease(POOL, leased("scheduled", 10), None))
+        self.assertFalse(self.store.take_lease(POOL, leased("reinvoked", 10), None))
+        self.assertEqual(self.store.load_checkpoint(POOL)["owner"], "scheduled")
+
+    def test_one_of_two_runs_resumes_a_checkpoint(self):
+        self.store.save_checkpoint(POOL, leased("first", -1))
+        previous = self.store.load_checkpoint(POOL)
+
+        self.assertTrue(self.store.take_lease(POOL, leased("scheduled", 10), previous))
+        self.assertFalse(self.store.take_lease(POOL, leased("reinvoked", 10), previous))
+
+    def test_changed_checkpoint_is_not_resumed(self):
+        self.store.save_checkpoint(POOL, leased("first", -1))
+        previous = self.store.load_checkpoint(POOL)
+        released = {**leased("other", 0, ["alice"]), "lease_expires": None}
+        self.store.save_checkpoint(POOL, released)
+
+        self.assertFalse(self.store.take_lease(POOL, leased("late", 10), previous))
+        self.assertEqual(self.store.load_checkpoint(POOL), released)
+
+    def test_owner_renews_its_lease(self):
+        self.store.save_checkpoint(POOL, leased("owner", 5))
+        previous = self.store.load_checkpoint(POOL)
+
+        self.assertTrue(self.store.take_lease(POOL, leased("owner", 10), previous))
+
+
+class JsonLeaseTests(LeaseTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JsonPasswordStateStore(os.path.join(self.directory.name, "states.json"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class DynamoDBLeaseTests(LeaseTests, unittest.TestCase):
+    def setUp(self):
+        # Started here, as the class decorator would not cover the inherited tests
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        dynamodb = boto3.resource("dynamodb", region_name="us-west-2")
+        dynamodb.create_table(
+            TableName="password-state",
+            KeySchema=[
+                {"AttributeName": "user_pool_id", "KeyType": "HASH"},
+                {"AttributeName": "username", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "user_pool_id", "AttributeType": "S"},
+                {"AttributeName": "username", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.store = DynamoDBPasswordStateStore("password-state", dynamodb)
+
+
+class StalledOutbox(FakeOutbox):
+    """Outbox whose messages stay queued."""
+
+    def send(self, to_email, subject, body):
+        self.sent.append((to_email, subject))
+        self.futures = getattr(self, "futures", []) + [Future()]
+        return self.futures[-1]
+
+
+class CheckLeaseTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JsonPasswordStateStore(os.path.join(self.directory.name, "states.json"))
+        now = datetime.now()
+        users = [user("expired", now - timedelta(days=200)), user("warned", now - timedelta(days=200))]
+        events = {
+            "expired": [event(now - timedelta(days=100))],
+            "warned": [event(now - timedelta(days=80), "PasswordChange")],
+        }
+        self.cognito = FakeCognito(users, events)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_check(self, outbox, run_id, remaining_millis=None):
+        with mock.patch.object(enforce_password_expiration.boto3, "client", return_value=self.cognito):
+            return enforce_password_expiration.password_expiration_check(
+                POOL,
+                "https://login.example.com",
+                90,
+                14,
+                outbox,
+                "expired {username}",
+                "Expired {username}",
+                "warning {username}",
+                "Warning {username}",
+                state_store=self.store,
+                remaining_millis=remaining_millis,
+                run_id=run_id,
+            )
+
+    def test_run_losing_the_lease_handles_no_user(self):
+        load_checkpoint = self.store.load_checkpoint
+
+        def load_then_lose(user_pool_id):
+            # Another invocation takes the lease between this run's load and its own take_lease
+            checkpoint = load_checkpoint(user_pool_id)
+            self.store.take_lease(user_pool_id, leased("scheduled", 10), checkpoint)
+            return checkpoint
+
+        outbox = FakeOutbox()
+        with mock.patch.object(self.store, "load_checkpoint", side_effect=load_then_lose):
+            self.assertIsNone(self.run_check(outbox, "reinvoked"))
+        self.assertEqual(outbox.sent, [])
+        self.assertEqual(self.cognito.resets, [])
+
+    def test_notifications_are_not_waited_for_past_the_time_budget(self):
+        stalled = StalledOutbox()
+        with mock.patch.object(enforce_password_expiration, "checkpoint_margin", 0):
+            completed = self.run_check(stalled, "first", lambda: enforce_password_expiration.state_save_margin * 1000)
+
+        self.assertFalse(completed)
+        self.assertTrue(all(future.cancelled() for future in stalled.futures))
+        self.assertEqual(self.cognito.resets, [])
+        checkpoint = self.store.load_checkpoint(POOL)
+        self.assertEqual((checkpoint["processed"], checkpoint["lease_expires"]), ([], None))
+
+        outbox = FakeOutbox()
+        self.assertTrue(self.run_check(outbox, "second"))
+        self.assertEqual(self.cognito.resets, ["expired"])
+        self.assertEqual(sorted(subject for _to, subject in outbox.sent), ["Expired expired", "Warning warned"])
+
+
+class FailingOutbox(FakeOutbox):
+    """Outbox failing to deliver the messages of the given users."""
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = failing
+
+    def send(self, to_email, subject, body):
+        if to_email.split("@")[0] not in self.failing:
+            return super().send(to_email, subject, body)
+        future = Future()
+        future.set_exception(ConnectionError("SMTP server went away"))
+        return future
+
+
+class CheckpointProgressTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JsonPasswordStateStore(os.path.join(self.directory.name, "states.json"))
+        now = datetime.now()
+        self.expired = [f"expired{number}" for number in range(6)]
+        users = [user(username, now - timedelta(days=200)) for username in self.expired]
+        events = {username: [event(now - timedelta(days=100))] for username in self.expired}
+        self.cognito = FakeCognito(users, events, page_size=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_check(self, outbox):
+        with mock.patch.object(enforce_password_expiration.boto3, "client", return_value=self.cognito):
+            return enforce_password_expiration.password_expiration_check(
+                POOL,
+                "https://login.example.com",
+                90,
+                14,
+                outbox,
+                "expired {username}",
+                "Expired {username}",
+                "warning {username}",
+                "Warning {username}",
+                max_workers=1,
+                state_store=self.store,
+                run_id="run",
+            )
+
+    def test_checkpoint_is_saved_at_each_page(self):
+        saved = []
+        save_checkpoint = self.store.save_checkpoint
+
+        def record(user_pool_id, checkpoint):
+            saved.append(copy.deepcopy(checkpoint))
+            save_checkpoint(user_pool_id, checkpoint)
+
+        with mock.patch.object(self.store, "save_checkpoint", side_effect=record):
+            self.assertTrue(self.run_check(FakeOutbox()))
+
+        boundaries = [(checkpoint["pagination_token"], checkpoint["processed"]) for checkpoint in saved[:-1]]
+        self.assertEqual(boundaries, [("2", []), ("4", [])])
+        self.assertTrue(all(checkpoint["lease_expires"] is not None for checkpoint in saved[:-1]))
+        self.assertIsNone(saved[-1])
+
+        # A run killed after the second page boundary is resumed from there, without notifying the first pages again
+        self.cognito.resets = []
+        self.store.save_checkpoint(POOL, {**saved[1], "lease_expires": None})
+        outbox = FakeOutbox()
+        self.assertTrue(self.run_check(outbox))
+        self.assertEqual([subject for _to, subject in outbox.sent], ["Expired expired4", "Expired expired5"])
+        self.assertEqual(self.cognito.resets, ["expired4", "expired5"])
+
+    def test_failed_notifications_are_not_recorded_as_handled(self):
+        admin_list_user_auth_events = self.cognito.admin_list_user_auth_events
+
+        def fail_for_last(UserPoolId, Username, NextToken=None):
+            if Username == "expired5":
+                raise RuntimeError("Cognito is unavailable")
+            return admin_list_user_auth_events(UserPoolId, Username, NextToken)
+
+        with mock.patch.object(self.cognito, "admin_list_user_auth_events", side_effect=fail_for_last):
+            with self.assertRaises(RuntimeError):
+                self.run_check(FailingOutbox({"expired4"}))
+        self.assertEqual(self.cognito.resets, self.expired[:4])
+        checkpoint = self.store.load_checkpoint(POOL)
+        self.assertEqual((checkpoint["pagination_token"], checkpoint["processed"]), ("4", []))
+
+        outbox = FakeOutbox()
+        self.assertTrue(self.run_check(outbox))
+        self.assertEqual([subject for _to, subject in outbox.sent], ["Expired expired4", "Expired expired5"])
+        self.assertEqual(self.cognito.resets, self.expired)
+
+
+if __name__ == "__main__":
+    unittest.main()
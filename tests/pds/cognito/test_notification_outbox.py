@@ -0,0 +1,132 @@
+import smtplib
+import socket
+import threading
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import enforce_password_expiration
+from aiosmtpd.controller import Controller
+from notification_outbox import SmtpOutbox
+from run_metrics import RunMetrics
+
+from .fakes import event
+from .fakes import FakeCognito
+from .fakes import user
+
+
+def free_port():
+    """Return a local TCP port nothing listens on."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class Handler:
+    """aiosmtpd handler answering the DATA commands with the given replies, then accepting every message.
+
+    A reply of None drops the connection without answering.
+    """
+
+    def __init__(self, replies=()):
+        """Answer the first DATA commands with replies."""
+        self.replies = list(replies)
+        self.received = []
+        self.sessions = set()
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            reply = self.replies.pop(0) if self.replies else "250 OK"
+            if reply is None:
+                server.transport.close()
+            elif reply.startswith("250"):
+                self.received.append(envelope.rcpt_tos[0])
+                self.sessions.add(session.peer)
+        return reply or "451 Closed"
+
+
+class OutboxTests(unittest.TestCase):
+    def start_server(self, handler):
+        self.port = free_port()
+        controller = Controller(handler, hostname="127.0.0.1", port=self.port)
+        controller.start()
+        self.addCleanup(controller.stop)
+        self.connections = 0
+
+    def connect(self):
+        self.connections += 1
+        return smtplib.SMTP("127.0.0.1", self.port, timeout=5)
+
+    def test_messages_are_delivered_over_pooled_connections(self):
+        handler = Handler()
+        self.start_server(handler)
+        outbox = SmtpOutbox(self.connect, "noreply@example.com", connections=3)
+
+        futures = [outbox.send(f"user{number}@example.com", "Subject", "Body") for number in range(30)]
+        outbox.close()
+
+        self.assertEqual([future.result() for future in futures], [1] * 30)
+        self.assertEqual(sorted(handler.received), sorted(f"user{number}@example.com" for number in range(30)))
+        self.assertLessEqual(self.connections, 3)
+        self.assertLessEqual(len(handler.sessions), 3)
+        self.assertEqual((outbox.sent, outbox.failed, outbox.reconnects), (30, 0, 0))
+
+    def test_reconnects_after_421(self):
+        handler = Handler(["421 Service not available, closing transmission channel"])
+        self.start_server(handler)
+        outbox = SmtpOutbox(self.connect, "noreply@example.com", connections=1, retry_delay=0)
+
+        future = outbox.send("user@example.com", "Subject", "Body")
+        outbox.close()
+
+        self.assertEqual(future.result(), 2)
+        self.assertEqual(handler.received, ["user@example.com"])
+        self.assertEqual((self.connections, outbox.reconnects, outbox.retries), (2, 1, 1))
+
+    def test_reconnects_after_dropped_connection(self):
+        handler = Handler([None])
+        self.start_server(handler)
+        outbox = SmtpOutbox(self.connect, "noreply@example.com", connections=1, retry_delay=0)
+
+        future = outbox.send("user@example.com", "Subject", "Body")
+        outbox.close()
+
+        self.assertEqual(future.result(), 2)
+        self.assertEqual(handler.received, ["user@example.com"])
+        self.assertEqual((self.connections, outbox.reconnects), (2, 1))
+
+    def test_undelivered_notification_leaves_password_unreset(self):
+        handler = Handler(["451 Requested action aborted: try again later"] * 3)
+        self.start_server(handler)
+        metrics = RunMetrics()
+        outbox = SmtpOutbox(self.connect, "noreply@example.com", connections=1, max_attempts=3, retry_delay=0)
+        now = datetime.now()
+        users = [user("expired", now - timedelta(days=200))]
+        cognito = FakeCognito(users, {"expired": [event(now - timedelta(days=100))]})
+
+        with mock.patch.object(enforce_password_expiration.boto3, "client", return_value=cognito):
+            completed = enforce_password_expiration.password_expiration_check(
+                "us-west-2_pool",
+                "https://login.example.com",
+                90,
+                14,
+                outbox,
+                "expired {username} {temp_password}",
+                "Expired {username}",
+                "warning {username}",
+                "Warning {username}",
+                metrics=metrics,
+            )
+        outbox.close()
+
+        self.assertTrue(completed)
+        self.assertEqual(cognito.resets, [])
+        self.assertEqual(handler.received, [])
+        self.assertEqual((outbox.failed, outbox.retries), (1, 2))
+        self.assertEqual(metrics.counts["not_reset"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from unittest import mock
+
+import enforce_password_expiration
+from password_state import JsonPasswordStateStore
+
+from .fakes import event
+from .fakes import FakeCognito
+from .fakes import FakeOutbox
+from .fakes import user
+
+POOL = "us-west-2_pool"
+
+
+def run_check(cognito, state_store=None):
+    """Run a password expiration check of 90 days, with warnings 14 days ahead; return the resets and emails."""
+    outbox = FakeOutbox()
+    with mock.patch.object(enforce_password_expiration.boto3, "client", return_value=cognito):
+        completed = enforce_password_expiration.password_expiration_check(
+            POOL,
+            "https://login.example.com",
+            90,
+            14,
+            outbox,
+            "expired {username}",
+            "Expired {username}",
+            "warning {username}",
+            "Warning {username}",
+            request_rate=1000,
+            state_store=state_store,
+        )
+    assert completed
+    return sorted(cognito.resets), sorted(outbox.sent)
+
+
+class IncrementalScanTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JsonPasswordStateStore(os.path.join(self.directory.name, "states.json"))
+        now = datetime.now()
+        generator = random.Random(21)
+        self.users = [user("renewed", now - timedelta(days=400)), user("warned", now - timedelta(days=400))]
+        self.events = {
+            "renewed": [event(now - timedelta(days=100)), event(now - timedelta(days=200))],
+            "warned": [event(now - timedelta(days=20)), event(now - timedelta(days=80), "PasswordChange")],
+        }
+        for number in range(40):
+            username = f"user{number}"
+            self.users.append(user(username, now - timedelta(days=generator.randint(1, 400))))
+            days = sorted(generator.sample(range(1, 300), generator.randint(0, 12)))
+            self.events[username] = [
+                event(now - timedelta(days=day), generator.choice(["SignIn"] * 4 + ["PasswordChange"])) for day in days
+            ]
+        # Auth events of the second run, newest first
+        self.new_events = {"renewed": [event(now - timedelta(hours=1), "PasswordChange")]}
+        for username in generator.sample(sorted(self.events), 15):
+            self.new_events.setdefault(username, []).append(
+                event(now - timedelta(hours=2), generator.choice(["SignIn", "PasswordChange"]))
+            )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_second_run_only_reads_newer_events(self):
+        run_check(FakeCognito(self.users, self.events, page_size=1), self.store)
+        watermarks = {username: state["newest_event"] for username, state in self.store.load(POOL).items()}
+        events = {username: self.new_events.get(username, []) + history for username, history in self.events.items()}
+
+        incremental = FakeCognito(self.users, events, page_size=1)
+        resets, emails = run_check(incremental, self.store)
+
+        for username, served in incremental.served_events.items():
+            examined = [item for item in served if item["CreationDate"] <= watermarks[username]]
+            # Paging stops at the first event examined by the first run
+            self.assertLessEqual(len(examined), 1, username)
+        full_scan = FakeCognito(self.users, events, page_size=1)
+        self.assertEqual((resets, emails), run_check(full_scan))
+        self.assertLess(
+            sum(map(len, incremental.served_events.values())), sum(map(len, full_scan.served_events.values()))
+        )
+        self.assertNotIn("renewed", resets)
+        self.assertIn(("warned@example.com", "Warning warned"), emails)
+        self.assertTrue(resets)
+
+    def test_first_run_with_empty_store_matches_full_scan(self):
+        incremental = run_check(FakeCognito(self.users, self.events), self.store)
+
+        self.assertEqual(incremental, run_check(FakeCognito(self.users, self.events)))
+        self.assertIn("renewed", incremental[0])
+        self.assertIsNone(self.store.load_checkpoint(POOL))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from pds.pdc.archive_writer import archive_format_for
+from pds.pdc.archive_writer import ArchiveWriter
+
+MEMBERS = {"data/file1.dat": os.urandom(1000), "data/file2.dat": b"", "label.xml": b"<Product/>"}
+MTIME = 1700000000
+
+
+def write_archive(path, archive_format):
+    """Write MEMBERS into an archive at path."""
+    writer = ArchiveWriter(path, archive_format)
+    for name, body in MEMBERS.items():
+        writer.add(name, io.BytesIO(body), len(body), MTIME)
+    writer.close()
+    return writer
+
+
+def read_tar(path):
+    """Return {name: (body, mtime)} of the members of a tar archive."""
+    with tarfile.open(path) as archive:
+        return {member.name: (archive.extractfile(member).read(), member.mtime) for member in archive}
+
+
+class ArchiveWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_tar_formats(self):
+        for archive_format in ("tar", "tar.gz"):
+            with self.subTest(archive_format=archive_format):
+                path = os.path.join(self.directory.name, f"bundle.{archive_format}")
+                writer = write_archive(path, archive_format)
+                self.assertEqual(writer.entries, len(MEMBERS))
+                self.assertEqual(read_tar(path), {name: (body, MTIME) for name, body in MEMBERS.items()})
+
+    def test_zstd_tar(self):
+        try:
+            import zstandard
+        except ImportError:
+            self.skipTest("zstandard is not installed")
+        path = os.path.join(self.directory.name, "bundle.tar.zst")
+        write_archive(path, "tar.zst")
+        with open(path, "rb") as compressed:
+            with zstandard.ZstdDecompressor().stream_reader(compressed) as reader:
+                with tarfile.open(fileobj=reader, mode="r|") as archive:
+                    members = {member.name: archive.extractfile(member).read() for member in archive}
+        self.assertEqual(members, MEMBERS)
+
+    def test_zip(self):
+        path = os.path.join(self.directory.name, "bundle.zip")
+        writer = ArchiveWriter(path, "zip")
+        for name, body in MEMBERS.items():
+            writer.add(name, io.BytesIO(body), len(body), MTIME)
+        writer.add("old.txt", io.BytesIO(b"old"), 3, 0)
+        writer.close()
+
+        with zipfile.ZipFile(path) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual({name: archive.read(name) for name in MEMBERS}, MEMBERS)
+            # Zip timestamps cannot predate 1980
+            self.assertEqual(archive.getinfo("old.txt").date_time[:3], (1980, 1, 1))
+
+    def test_archive_only_appears_when_closed(self):
+        path = os.path.join(self.directory.name, "bundle.tar")
+        writer = ArchiveWriter(path, "tar")
+        writer.add("label.xml", io.BytesIO(b"<Product/>"), 10)
+        self.assertFalse(os.path.exists(path))
+        writer.abort()
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            ArchiveWriter(os.path.join(self.directory.name, "bundle.rar"), "rar")
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_format_from_suffix(self):
+        self.assertEqual(archive_format_for("bundle.TGZ"), "tar.gz")
+        self.assertEqual(archive_format_for("bundle.tar.zst"), "tar.zst")
+        self.assertEqual(archive_format_for("bundle.zip"), "zip")
+        self.assertIsNone(archive_format_for("bundle.rar"))
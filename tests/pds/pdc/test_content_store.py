@@ -0,0 +1,114 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from pds.pdc import content_store
+from pds.pdc.content_store import ContentStore
+from pds.pdc.content_store import link_or_copy
+
+E_TAG = '"0123456789abcdef0123456789abcdef"'
+
+
+class ContentStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ContentStore(os.path.join(self.directory.name, "store"))
+        self.fetched = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fetch(self, body):
+        def write(path):
+            self.fetched.append(path)
+            with open(path, "wb") as stored:
+                stored.write(body)
+
+        return write
+
+    def read(self, path):
+        with open(path, "rb") as local_file:
+            return local_file.read()
+
+    def test_path_for_is_safe(self):
+        path = self.store.path_for('"../a/b-3"', 10)
+        self.assertEqual(os.path.dirname(os.path.dirname(path)), self.store.root)
+        self.assertEqual(os.path.basename(path), "___a_b-3-10")
+
+    def test_content_is_downloaded_once_and_linked(self):
+        paths = [os.path.join(self.directory.name, "dest", name) for name in ("a.dat", "sub/b.dat")]
+        methods = [self.store.materialize(E_TAG, 4, path, self.fetch(b"data")) for path in paths]
+
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(methods, ["hardlink", "hardlink"])
+        self.assertEqual([self.read(path) for path in paths], [b"data", b"data"])
+        self.assertTrue(os.path.samefile(paths[0], paths[1]))
+        self.assertEqual((self.store.stored_objects, self.store.reused_objects, self.store.reused_bytes), (1, 1, 4))
+
+    def test_stored_copy_of_another_size_is_not_reused(self):
+        self.store.materialize(E_TAG, 4, os.path.join(self.directory.name, "a.dat"), self.fetch(b"data"))
+        self.store.materialize(E_TAG, 5, os.path.join(self.directory.name, "b.dat"), self.fetch(b"data2"))
+        self.assertEqual(len(self.fetched), 2)
+        self.assertEqual(self.read(os.path.join(self.directory.name, "b.dat")), b"data2")
+
+    def test_concurrent_keys_of_the_same_content_wait_for_one_download(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch(path):
+            started.set()
+            release.wait(5)
+            self.fetch(b"data")(path)
+
+        paths = [os.path.join(self.directory.name, f"file{number}.dat") for number in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            owner = executor.submit(self.store.materialize, E_TAG, 4, paths[0], slow_fetch)
+            started.wait(5)
+            waiters = [executor.submit(self.store.materialize, E_TAG, 4, path, slow_fetch) for path in paths[1:]]
+            release.set()
+            [future.result() for future in [owner, *waiters]]
+
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual([self.read(path) for path in paths], [b"data"] * 4)
+        self.assertEqual((self.store.stored_objects, self.store.reused_objects), (1, 3))
+
+    def test_failed_download_is_retried(self):
+        path = os.path.join(self.directory.name, "a.dat")
+        with self.assertRaises(OSError):
+            self.store.materialize(E_TAG, 4, path, mock.Mock(side_effect=OSError("reset")))
+        self.assertFalse(os.path.exists(path))
+
+        self.store.materialize(E_TAG, 4, path, self.fetch(b"data"))
+        self.assertEqual(self.read(path), b"data")
+        self.assertEqual(self.store.stored_objects, 1)
+
+
+class LinkOrCopyTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "source")
+        with open(self.source, "wb") as source:
+            source.write(b"data")
+        self.target = os.path.join(self.directory.name, "dest", "target")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_relinking_the_same_file(self):
+        self.assertEqual(link_or_copy(self.source, self.target), "hardlink")
+        self.assertEqual(link_or_copy(self.source, self.target), "hardlink")
+        self.assertEqual(os.listdir(os.path.dirname(self.target)), ["target"])
+
+    def test_falls_back_to_a_copy_with_the_given_time(self):
+        with mock.patch.object(content_store.os, "link", side_effect=OSError("cross-device link")):
+            with mock.patch.object(content_store, "_reflink", return_value=False):
+                method = link_or_copy(self.source, self.target, last_modified=1700000000)
+
+        self.assertEqual(method, "copy")
+        self.assertFalse(os.path.samefile(self.source, self.target))
+        self.assertEqual(os.stat(self.target).st_mtime, 1700000000)
+        with open(self.target, "rb") as target:
+            self.assertEqual(target.read(), b"data")
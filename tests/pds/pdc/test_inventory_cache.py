@@ -0,0 +1,76 @@
+import contextlib
+import gzip
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from functools import partial
+
+from pds.pdc.inventory_cache import InventorySummaryCache
+from pds.pdc.inventory_reader import DEFAULT_LAYOUT
+from pds.pdc.inventory_rollup import InventoryRollup
+from pds.pdc.inventory_summary import summarize_inventory_files
+
+
+def write_inventory_file(path, sizes):
+    """Write a gzipped CSV inventory part of the default layout with objects of the given sizes."""
+    rows = "".join(f'"pds","key{number}","{size}"\n' for number, size in enumerate(sizes))
+    with open(path, "wb") as part:
+        part.write(gzip.compress(rows.encode()))
+
+
+class InventorySummaryCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = [os.path.join(self.directory.name, f"part-{number}.csv.gz") for number in range(3)]
+        for number, path in enumerate(self.paths):
+            write_inventory_file(path, [10 * (number + 1), 5])
+        self.cache_path = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def summarize(self, workers=1, use_hash=False, aggregator_factories=()):
+        cache = InventorySummaryCache(self.cache_path, use_hash=use_hash)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                count, size, _aggregators = summarize_inventory_files(
+                    self.paths, DEFAULT_LAYOUT, aggregator_factories, workers=workers, cache=cache
+                )
+            return count, size, cache.hits, cache.misses
+        finally:
+            cache.close()
+
+    def entries(self):
+        with contextlib.closing(sqlite3.connect(self.cache_path)) as connection:
+            return connection.execute("SELECT COUNT(*) FROM file_results").fetchone()[0]
+
+    def test_unchanged_files_are_reused(self):
+        self.assertEqual(self.summarize(), (6, 75, 0, 3))
+        self.assertEqual(self.summarize(), (6, 75, 3, 0))
+
+    def test_fingerprints_are_taken_by_the_workers(self):
+        self.assertEqual(self.summarize(workers=2, use_hash=True), (6, 75, 0, 3))
+        self.assertEqual(self.summarize(workers=2, use_hash=True), (6, 75, 3, 0))
+
+    def test_changed_file_replaces_its_entry(self):
+        self.summarize()
+        write_inventory_file(self.paths[1], [1000])
+        stat = os.stat(self.paths[1])
+        os.utime(self.paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual(self.summarize(), (5, 1050, 2, 1))
+        self.assertEqual(self.entries(), 3)
+
+    def test_other_settings_replace_the_entries(self):
+        self.summarize()
+        rollup = partial(InventoryRollup, group_by=("prefix",))
+
+        self.assertEqual(self.summarize(aggregator_factories=(rollup,)), (6, 75, 0, 3))
+        self.assertEqual(self.summarize(aggregator_factories=(rollup,)), (6, 75, 3, 0))
+        self.assertEqual(self.entries(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from pds.pdc.inventory_diff import diff_inventories
+from pds.pdc.inventory_diff import UnsortedInventoryError
+
+OLD_RECORDS = [("a.xml", 10, "e1"), ("b.img", 20, "e2"), ("c.img", 30, "e3"), ("e.xml", 7, "e5")]
+NEW_RECORDS = [("a.xml", 10, "e1"), ("b.img", 25, "e2x"), ("d.xml", 5, "e4"), ("e.xml", 7, "e5x")]
+EXPECTED_CHANGES = [
+    ["change", "key", "old_size", "new_size", "old_etag", "new_etag"],
+    ["modified", "b.img", "20", "25", "e2", "e2x"],
+    ["deleted", "c.img", "30", "", "e3", ""],
+    ["added", "d.xml", "", "5", "", "e4"],
+    ["modified", "e.xml", "7", "7", "e5", "e5x"],
+]
+EXPECTED_TOTALS = {
+    "added_objects": 1,
+    "added_bytes": 5,
+    "deleted_objects": 1,
+    "deleted_bytes": 30,
+    "modified_objects": 2,
+    "modified_bytes_delta": 5,
+    "unchanged_objects": 1,
+    "net_bytes": -20,
+}
+
+
+def write_snapshot(directory, parts):
+    """Write an inventory snapshot of Bucket, Key, Size and ETag columns, one gzipped CSV file per list of records."""
+    os.makedirs(directory)
+    for number, records in enumerate(parts):
+        rows = "".join(f'"pds","{key}","{size}","{e_tag}"\n' for key, size, e_tag in records)
+        with open(os.path.join(directory, f"part-{number}.csv.gz"), "wb") as part:
+            part.write(gzip.compress(rows.encode()))
+    manifest = {
+        "fileFormat": "CSV",
+        "fileSchema": "Bucket, Key, Size, ETag",
+        "files": [{"key": f"config/data/part-{number}.csv.gz"} for number in range(len(parts))],
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    return directory
+
+
+class InventoryDiffTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old = write_snapshot(os.path.join(self.directory.name, "old"), [OLD_RECORDS[:2], OLD_RECORDS[2:]])
+        self.output = os.path.join(self.directory.name, "changes.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def snapshot(self, name, parts):
+        return write_snapshot(os.path.join(self.directory.name, name), parts)
+
+    def diff(self, new, method="auto"):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            totals, used = diff_inventories(self.old, new, self.output, method, spill_dir=self.directory.name)
+        return totals, used, output.getvalue()
+
+    def changes(self):
+        with open(self.output, newline="") as changes_file:
+            return list(csv.reader(changes_file))
+
+    def test_sorted_snapshots_are_merged(self):
+        totals, method, _output = self.diff(self.snapshot("new", [NEW_RECORDS[:3], NEW_RECORDS[3:]]))
+
+        self.assertEqual((totals, method), (EXPECTED_TOTALS, "merge"))
+        self.assertEqual(self.changes(), EXPECTED_CHANGES)
+        self.assertFalse(os.path.exists(f"{self.output}.tmp"))
+
+    def test_unsorted_snapshot_falls_back_to_the_index(self):
+        new = self.snapshot("new", [NEW_RECORDS[2:], NEW_RECORDS[:2]])
+
+        totals, method, output = self.diff(new)
+
+        self.assertEqual((totals, method), (EXPECTED_TOTALS, "index"))
+        self.assertIn("not in key order", output)
+        self.assertEqual(self.changes(), EXPECTED_CHANGES)
+
+    def test_merge_method_rejects_unsorted_snapshot(self):
+        new = self.snapshot("new", [NEW_RECORDS[2:], NEW_RECORDS[:2]])
+
+        with self.assertRaises(UnsortedInventoryError):
+            self.diff(new, "merge")
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_index_keeps_the_last_record_of_a_key(self):
+        new = self.snapshot("new", [NEW_RECORDS, [("a.xml", 11, "e1b")]])
+
+        totals, method, _output = self.diff(new, "index")
+
+        self.assertEqual(method, "index")
+        self.assertEqual(totals["modified_objects"], 3)
+        self.assertIn(["modified", "a.xml", "10", "11", "e1", "e1b"], self.changes())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import gzip
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pds.pdc import inventory_reader
+from pds.pdc.inventory_reader import DEFAULT_LAYOUT
+from pds.pdc.inventory_reader import iter_inventory_batches
+
+ROWS = [
+    '"pds","a%2Fb+c.xml","100"',
+    '"pds","plain.xml","5"',
+    '"pds","bad-size.xml","NaN"',
+    '"pds","short"',
+    '"pds","extra.xml","7","extra column"',
+    '"pds","multi\nline.xml","9"',
+]
+
+
+def records(path, csv_engine, fields=("key", "size")):
+    """Return the records read from an inventory file with an engine, and the error that stopped reading, if any."""
+    read = []
+    try:
+        for batch in iter_inventory_batches(path, DEFAULT_LAYOUT, fields, batch_size=100, csv_engine=csv_engine):
+            read.extend(zip(*(batch[field] for field in fields)))
+    except Exception as error:
+        return read, type(error)
+    return read, None
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+class ArrowCsvEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "part.csv.gz")
+        # Blocks of 1 KiB, so that the file is parsed in many blocks
+        patcher = mock.patch.object(inventory_reader, "CSV_BLOCK_SIZE", 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, rows, truncate=False):
+        content = gzip.compress("".join(row + "\n" for row in rows).encode())
+        with open(self.path, "wb") as part:
+            part.write(content[: len(content) * 3 // 4] if truncate else content)
+
+    def test_same_records_as_the_csv_module(self):
+        self.write(ROWS + [f'"pds","key{number}","{number}"' for number in range(2000)])
+
+        arrow_records, arrow_error = records(self.path, "arrow")
+        python_records, python_error = records(self.path, "python")
+
+        self.assertEqual((arrow_error, python_error), (None, None))
+        # Rows re-parsed after pyarrow rejected them come after the other rows of their block
+        self.assertEqual(sorted(arrow_records), sorted(python_records))
+        self.assertEqual(len(python_records), 2004)
+        self.assertIn(("a/b c.xml", 100), arrow_records)
+        self.assertIn(("extra.xml", 7), arrow_records)
+        self.assertIn(("multi\nline.xml", 9), arrow_records)
+        self.assertNotIn("bad-size.xml", {key for key, _size in arrow_records})
+
+    def test_corrupt_file_yields_the_same_records_then_fails(self):
+        self.write([f'"pds","key{number}","{number}"' for number in range(5000)], truncate=True)
+
+        arrow_records, arrow_error = records(self.path, "arrow")
+        python_records, python_error = records(self.path, "python")
+
+        self.assertIsNotNone(python_error)
+        self.assertEqual(arrow_error, python_error)
+        self.assertEqual(arrow_records, python_records)
+        self.assertTrue(python_records)
+
+    def test_unknown_engine_is_rejected(self):
+        self.write(ROWS)
+        self.assertEqual(records(self.path, "pandas")[1], ValueError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import gzip
+import json
+import unittest
+from functools import partial
+
+import boto3
+from moto import mock_aws
+from pds.pdc.inventory_reader import DEFAULT_LAYOUT
+from pds.pdc.inventory_reader import InventoryLayout
+from pds.pdc.inventory_reader import locate_s3_inventory
+from pds.pdc.inventory_rollup import InventoryRollup
+from pds.pdc.inventory_summary import summarize_inventory_files
+
+BUCKET = "inventory-bucket"
+
+
+def gzipped_csv(rows):
+    return gzip.compress("".join(",".join(f'"{value}"' for value in row) + "\n" for row in rows).encode())
+
+
+@mock_aws
+class S3InventoryTests(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET)
+
+    def put(self, key, body):
+        self.s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+    def test_manifest_layout(self):
+        parts = {
+            "config/data/part-1.csv.gz": gzipped_csv(
+                [("pds", "a/one.xml", "STANDARD", "100"), ("pds", "a/two.img", "GLACIER", "2000")]
+            ),
+            "config/data/part-2.csv.gz": gzipped_csv([("pds", "b/three.xml", "STANDARD", "30")]),
+        }
+        for key, body in parts.items():
+            self.put(key, body)
+        manifest = {
+            "fileFormat": "CSV",
+            "fileSchema": "Bucket, Key, StorageClass, Size",
+            "files": [{"key": key} for key in parts],
+        }
+        self.put("config/2024-01-01T00-00Z/manifest.json", json.dumps(manifest))
+
+        uris, layout = locate_s3_inventory(self.s3, f"s3://{BUCKET}/config/")
+        self.assertEqual(uris, [f"s3://{BUCKET}/{key}" for key in parts])
+        self.assertEqual(layout, InventoryLayout("CSV", ("bucket", "key", "storage_class", "size")))
+
+        count, size, (rollup,) = summarize_inventory_files(
+            uris,
+            layout,
+            aggregator_factories=(partial(InventoryRollup, group_by=("storage-class",)),),
+            workers=2,
+            s3_client=self.s3,
+        )
+        self.assertEqual((count, size), (3, 2130))
+        self.assertEqual(dict(rollup.storage_classes), {"STANDARD": [2, 130], "GLACIER": [1, 2000]})
+
+    def test_manifest_uri(self):
+        self.put("config/data/part-1.csv.gz", gzipped_csv([("pds", "a/one.xml", "7")]))
+        manifest = {
+            "fileFormat": "CSV",
+            "fileSchema": "Bucket, Key, Size",
+            "files": [{"key": "config/data/part-1.csv.gz"}],
+        }
+        self.put("config/run/manifest.json", json.dumps(manifest))
+
+        uris, _layout = locate_s3_inventory(self.s3, f"s3://{BUCKET}/config/run/manifest.json")
+        self.assertEqual(uris, [f"s3://{BUCKET}/config/data/part-1.csv.gz"])
+
+    def test_csv_parts_layout(self):
+        self.put("parts/one.csv.gz", gzipped_csv([("pds", "a/one.xml", "10"), ("pds", "a/two.xml", "20")]))
+        self.put("parts/two.csv.gz", gzipped_csv([("pds", "b/three.xml", "5")]))
+        self.put("parts/readme.txt", b"not an inventory part")
+
+        uris, layout = locate_s3_inventory(self.s3, f"s3://{BUCKET}/parts/")
+        self.assertEqual(sorted(uris), [f"s3://{BUCKET}/parts/one.csv.gz", f"s3://{BUCKET}/parts/two.csv.gz"])
+        self.assertEqual(layout, DEFAULT_LAYOUT)
+
+        count, size, _aggregators = summarize_inventory_files(uris, layout, s3_client=self.s3)
+        self.assertEqual((count, size), (3, 35))
+
+    def test_several_manifests_are_rejected(self):
+        for run in ("run-1", "run-2"):
+            self.put(f"config/{run}/manifest.json", json.dumps({"fileFormat": "CSV", "fileSchema": "Key", "files": []}))
+
+        with self.assertRaises(ValueError):
+            locate_s3_inventory(self.s3, f"s3://{BUCKET}/config/")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ResponseStreamingError
+from moto import mock_aws
+from pds.pdc import ranged_download
+from pds.pdc.ranged_download import download_ranged
+from pds.pdc.ranged_download import IntegrityError
+from pds.pdc.ranged_download import RangedDownloadConfig
+from pds.pdc.transfer_control import is_retryable_error
+
+BUCKET = "ranged-bucket"
+KB = 1024
+
+
+class BrokenBody:
+    """Response body failing after its first chunk, like a connection reset while streaming."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_chunks(self, chunk_size):
+        yield next(self.body.iter_chunks(chunk_size))
+        raise ResponseStreamingError(error="Connection reset by peer")
+
+    def close(self):
+        self.body.close()
+
+
+class CorruptBody:
+    """Response body with its first byte flipped."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_chunks(self, chunk_size):
+        chunks = self.body.iter_chunks(chunk_size)
+        first = next(chunks)
+        yield bytes([first[0] ^ 0xFF]) + first[1:]
+        yield from chunks
+
+    def close(self):
+        self.body.close()
+
+
+@mock_aws
+class RangedDownloadRetryTests(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.data = os.urandom(100 * KB)
+        self.s3.put_object(Bucket=BUCKET, Key="object.img", Body=self.data)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "object.img")
+        self.config = RangedDownloadConfig(threshold=0, part_size=16 * KB, workers=4)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def failing_get_object(self, failures, body_class=BrokenBody):
+        get_object = self.s3.get_object
+
+        def patched(**request):
+            response = get_object(**request)
+            if request.get("Range") == f"bytes={32 * KB}-{48 * KB - 1}" and failures:
+                failures.pop()
+                response["Body"] = body_class(response["Body"])
+            return response
+
+        return patched
+
+    def test_streaming_errors_are_retryable(self):
+        self.assertTrue(is_retryable_error(ResponseStreamingError(error="reset")))
+
+    def test_range_failing_while_streaming_is_downloaded_again(self):
+        failures = [True]
+        with mock.patch.object(ranged_download, "backoff_delay", return_value=0):
+            with mock.patch.object(self.s3, "get_object", self.failing_get_object(failures)):
+                download_ranged(self.s3, BUCKET, "object.img", self.path, self.config)
+
+        self.assertEqual(failures, [])
+        with open(self.path, "rb") as downloaded:
+            self.assertEqual(downloaded.read(), self.data)
+
+    def test_retried_range_is_reported_once(self):
+        received = []
+        with mock.patch.object(ranged_download, "backoff_delay", return_value=0):
+            with mock.patch.object(self.s3, "get_object", self.failing_get_object([True, True])):
+                download_ranged(self.s3, BUCKET, "object.img", self.path, self.config, callback=received.append)
+
+        self.assertEqual(sum(received), len(self.data))
+
+    def test_corrupt_range_fails_verification(self):
+        with mock.patch.object(self.s3, "get_object", self.failing_get_object([True], CorruptBody)):
+            with self.assertRaises(IntegrityError):
+                download_ranged(self.s3, BUCKET, "object.img", self.path, self.config)
+
+    def test_range_failing_every_attempt_raises(self):
+        failures = [True] * ranged_download.RANGE_MAX_ATTEMPTS
+        with mock.patch.object(ranged_download, "backoff_delay", return_value=0):
+            with mock.patch.object(self.s3, "get_object", self.failing_get_object(failures)):
+                with self.assertRaises(ResponseStreamingError):
+                    download_ranged(self.s3, BUCKET, "object.img", self.path, self.config)
+
+
+if __name__ == "__main__":
+    unittest.main()
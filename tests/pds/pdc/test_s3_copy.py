@@ -0,0 +1,160 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from moto import mock_aws
+from pds.pdc import s3_copy
+from pds.pdc.s3_copy import copy_object
+from pds.pdc.s3_copy import iter_sorted_matches
+from pds.pdc.s3_copy import MB
+from pds.pdc.s3_copy import SOURCE_E_TAG_METADATA
+
+SOURCE = "source-bucket"
+DEST = "dest-bucket"
+
+
+@mock_aws
+class S3CopyTests(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=SOURCE)
+        self.s3.create_bucket(Bucket=DEST)
+
+    def put(self, key, body, **extra_args):
+        self.s3.put_object(Bucket=SOURCE, Key=key, Body=body, **extra_args)
+        return self.s3.head_object(Bucket=SOURCE, Key=key)
+
+    def put_in_parts(self, key, body, part_size, **extra_args):
+        config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size)
+        self.s3.upload_fileobj(io.BytesIO(body), SOURCE, key, Config=config, ExtraArgs=extra_args)
+        return self.s3.head_object(Bucket=SOURCE, Key=key)
+
+    def run_main(self, *arguments):
+        sys_argv = ["pdc-s3-copy", "--source-profile", "default", "--source-bucket", SOURCE, "--dest-bucket", DEST]
+        output = io.StringIO()
+        with mock.patch.object(sys, "argv", sys_argv + list(arguments)):
+            with mock.patch.object(s3_copy, "create_s3_client", return_value=self.s3):
+                with contextlib.redirect_stdout(output):
+                    s3_copy.main()
+        return output.getvalue()
+
+    def tags(self, bucket, key):
+        return {tag["Key"]: tag["Value"] for tag in self.s3.get_object_tagging(Bucket=bucket, Key=key)["TagSet"]}
+
+    def test_single_part_copy(self):
+        head = self.put(
+            "bundle/label.xml",
+            b"<Product/>",
+            ContentType="application/xml",
+            Metadata={"mission": "insight"},
+            StorageClass="STANDARD_IA",
+            Tagging="release=1&node=geo",
+        )
+        with mock.patch.object(self.s3, "create_multipart_upload", wraps=self.s3.create_multipart_upload) as upload:
+            copy_object(self.s3, self.s3, SOURCE, "bundle/label.xml", DEST, "copy/label.xml", 10, head["ETag"])
+
+        upload.assert_not_called()
+        copy = self.s3.get_object(Bucket=DEST, Key="copy/label.xml")
+        self.assertEqual(copy["Body"].read(), b"<Product/>")
+        self.assertEqual(copy["ETag"], head["ETag"])
+        self.assertEqual(copy["ContentType"], "application/xml")
+        self.assertEqual(copy["StorageClass"], "STANDARD_IA")
+        self.assertEqual(copy["Metadata"], {"mission": "insight", SOURCE_E_TAG_METADATA: head["ETag"].strip('"')})
+        self.assertEqual(self.tags(DEST, "copy/label.xml"), {"release": "1", "node": "geo"})
+
+    def test_multipart_copy_keeps_e_tag_and_metadata(self):
+        body = os.urandom(12 * MB)
+        head = self.put_in_parts(
+            "bundle/data.img",
+            body,
+            5 * MB,
+            ContentType="application/x-pds",
+            Metadata={"mission": "insight"},
+            StorageClass="STANDARD_IA",
+            Tagging="release=1&note=a b",
+        )
+        self.assertTrue(head["ETag"].endswith('-3"'))
+
+        copy_object(self.s3, self.s3, SOURCE, "bundle/data.img", DEST, "copy/data.img", len(body), head["ETag"])
+
+        copy = self.s3.get_object(Bucket=DEST, Key="copy/data.img")
+        self.assertEqual(copy["ETag"], head["ETag"])
+        self.assertEqual(copy["ContentType"], "application/x-pds")
+        self.assertEqual(copy["Metadata"], {"mission": "insight", SOURCE_E_TAG_METADATA: head["ETag"].strip('"')})
+        self.assertEqual(copy["StorageClass"], "STANDARD_IA")
+        self.assertEqual(self.tags(DEST, "copy/data.img"), {"release": "1", "note": "a b"})
+        self.assertEqual(copy["Body"].read(), body)
+
+    def test_sync_skips_unchanged_keys(self):
+        self.put("bundle/a.xml", b"a")
+        self.put("bundle/b.xml", b"b")
+        self.run_main("--source-prefix", "bundle/", "--dest-prefix", "copy/", "--quiet")
+        self.put("bundle/b.xml", b"changed")
+
+        with mock.patch.object(s3_copy, "copy_object", wraps=s3_copy.copy_object) as copy:
+            output = self.run_main("--source-prefix", "bundle/", "--dest-prefix", "copy/", "--quiet", "--sync")
+
+        self.assertEqual([call.args[3] for call in copy.call_args_list], ["bundle/b.xml"])
+        self.assertIn("Skipped 1 identical object(s).", output)
+        self.assertEqual(self.s3.get_object(Bucket=DEST, Key="copy/b.xml")["Body"].read(), b"changed")
+
+    def test_sync_compares_the_source_e_tag_recorded_in_metadata(self):
+        body = os.urandom(6 * MB)
+        for name in ("same", "recorded", "unrecorded", "stale"):
+            self.put(f"bundle/{name}.img", body)
+        source_e_tag = self.s3.head_object(Bucket=SOURCE, Key="bundle/same.img")["ETag"].strip('"')
+        self.s3.put_object(Bucket=DEST, Key="copy/same.img", Body=body)
+        # Copies whose ETag differs from the source's, as after a copy in other parts or with SSE-KMS
+        config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+        for name, metadata in (
+            ("recorded", {SOURCE_E_TAG_METADATA: source_e_tag}),
+            ("unrecorded", {}),
+            ("stale", {SOURCE_E_TAG_METADATA: "0" * 32}),
+        ):
+            self.s3.upload_fileobj(
+                io.BytesIO(body), DEST, f"copy/{name}.img", Config=config, ExtraArgs={"Metadata": metadata}
+            )
+
+        for listing in ("sequential", "sharded"):
+            with self.subTest(listing=listing):
+                with mock.patch.object(s3_copy, "copy_object", wraps=s3_copy.copy_object) as copy:
+                    output = self.run_main(
+                        "--source-prefix", "bundle/", "--dest-prefix", "copy/", "--sync", "--listing", listing
+                    )
+                self.assertEqual(
+                    sorted(call.args[3] for call in copy.call_args_list), ["bundle/stale.img", "bundle/unrecorded.img"]
+                )
+                self.assertIn("Skipped 2 identical object(s).", output)
+                # Put the copies back as they were for the next listing
+                for name in ("unrecorded", "stale"):
+                    self.s3.upload_fileobj(io.BytesIO(body), DEST, f"copy/{name}.img", Config=config)
+
+    def test_sorted_merge_of_listings(self):
+        objects = [{"Key": key, "Size": 1} for key in ("src/", "src/a", "src/b/c", "src/d", "src/e")]
+        dest_objects = [{"Key": key, "Size": 2} for key in ("dst/0", "dst/a", "dst/b", "dst/b/c", "dst/c", "dst/e")]
+
+        matches = list(iter_sorted_matches(objects, dest_objects, "src/", "dst/"))
+
+        self.assertEqual(
+            [(obj["Key"], dest_key, dest_obj and dest_obj["Key"]) for obj, dest_key, dest_obj in matches],
+            [
+                ("src/", None, None),
+                ("src/a", "dst/a", "dst/a"),
+                ("src/b/c", "dst/b/c", "dst/b/c"),
+                ("src/d", "dst/d", None),
+                ("src/e", "dst/e", "dst/e"),
+            ],
+        )
+
+    def test_part_size_below_s3_minimum_is_rejected(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            self.run_main("--source-prefix", "bundle/", "--part-size", "4")
+
+
+if __name__ == "__main__":
+    unittest.main()
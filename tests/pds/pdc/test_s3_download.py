@@ -0,0 +1,301 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from pds.pdc import s3_download
+from pds.pdc.download_state import FAILURES_FILE_NAME
+from pds.pdc.download_state import read_failure_journal
+from pds.pdc.download_state import STATE_FILE_NAME
+
+BUCKET = "download-bucket"
+
+
+def failing(function, keys):
+    """Wrap a download function so that it fails with AccessDenied for the given keys (its third argument)."""
+
+    def wrapper(*arguments, **keywords):
+        if arguments[2] in keys:
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "GetObject")
+        return function(*arguments, **keywords)
+
+    return wrapper
+
+
+@mock_aws
+class S3DownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.objects = {f"bundle/data/file{number}.dat": os.urandom(number * 100) for number in range(1, 13)}
+        self.objects["bundle/label.xml"] = b"<Product/>"
+        for key, body in self.objects.items():
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        self.s3.put_object(Bucket=BUCKET, Key="bundle/data/", Body=b"")
+        self.s3.put_object(Bucket=BUCKET, Key="other/file.dat", Body=b"other")
+        self.directory = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.directory.name, "dest")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_main(self, *arguments, client=None):
+        argv = ["pdc-s3-download", "--source-profile", "default", "--source-bucket", BUCKET, *arguments]
+        output = io.StringIO()
+        with mock.patch.object(sys, "argv", argv):
+            with mock.patch.object(s3_download, "create_s3_client", return_value=client or self.s3):
+                with contextlib.redirect_stdout(output):
+                    s3_download.main()
+        return output.getvalue()
+
+    def local_files(self, root=None):
+        root = root or self.dest
+        files = {}
+        for directory, _subdirectories, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                with open(path, "rb") as local_file:
+                    files[os.path.relpath(path, root)] = local_file.read()
+        return files
+
+    def expected_files(self):
+        return {key[len("bundle/") :]: body for key, body in self.objects.items()}
+
+    def test_concurrent_download(self):
+        output = self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--concurrency", "4")
+
+        self.assertEqual(self.local_files(), self.expected_files())
+        self.assertIn("Downloaded 13 object(s)", output)
+        head = self.s3.head_object(Bucket=BUCKET, Key="bundle/label.xml")
+        self.assertEqual(
+            int(os.stat(os.path.join(self.dest, "label.xml")).st_mtime), int(head["LastModified"].timestamp())
+        )
+
+    def test_concurrent_download_matches_serial_download(self):
+        serial = os.path.join(self.directory.name, "serial")
+        self.run_main("--source-prefix", "bundle/data/", "--local-dest-dir", serial, "--quiet")
+        self.run_main("--source-prefix", "bundle/data/", "--local-dest-dir", self.dest, "--concurrency", "8", "--quiet")
+
+        self.assertEqual(self.local_files(), self.local_files(serial))
+        self.assertEqual(len(self.local_files()), 12)
+
+    def test_sync_skips_current_files(self):
+        self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--sync", "--quiet")
+        self.objects["bundle/data/file1.dat"] = b"resized"
+        self.s3.put_object(Bucket=BUCKET, Key="bundle/data/file1.dat", Body=b"resized")
+
+        with mock.patch.object(s3_download, "download_object", wraps=s3_download.download_object) as download:
+            output = self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--sync", "--quiet")
+
+        self.assertEqual([call.args[2] for call in download.call_args_list], ["bundle/data/file1.dat"])
+        self.assertIn("Skipped 12 up-to-date object(s).", output)
+        files = {path: body for path, body in self.local_files().items() if not path.startswith(STATE_FILE_NAME)}
+        self.assertEqual(files, self.expected_files())
+
+    def test_sync_compares_etags_from_the_journal(self):
+        arguments = ("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--sync", "--compare", "etag")
+        self.run_main(*arguments, "--quiet")
+        # Same size, and possibly the same LastModified second: only the ETag tells the object changed
+        self.objects["bundle/label.xml"] = b"<Changed/>"
+        self.s3.put_object(Bucket=BUCKET, Key="bundle/label.xml", Body=b"<Changed/>")
+
+        output = self.run_main(*arguments)
+
+        self.assertIn("Skipped 12 up-to-date object(s).", output)
+        with open(os.path.join(self.dest, "label.xml"), "rb") as label:
+            self.assertEqual(label.read(), b"<Changed/>")
+
+    def test_state_journal_is_only_kept_when_asked_for(self):
+        self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--quiet")
+        self.assertFalse(os.path.exists(os.path.join(self.dest, STATE_FILE_NAME)))
+
+        state_file = os.path.join(self.directory.name, "state.sqlite")
+        self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--state-file", state_file)
+        self.assertTrue(os.path.exists(state_file))
+        self.assertEqual(self.local_files(), self.expected_files())
+
+    def write_inventory(self, records):
+        """Write a local inventory of the given (bucket, key, size, e_tag, is_latest, last_modified) records."""
+        inventory = os.path.join(self.directory.name, "inventory")
+        os.makedirs(inventory)
+        rows = "".join(",".join(f'"{value}"' for value in record) + "\n" for record in records)
+        with open(os.path.join(inventory, "part-0.csv.gz"), "wb") as part:
+            part.write(gzip.compress(rows.encode()))
+        manifest = {
+            "fileFormat": "CSV",
+            "fileSchema": "Bucket, Key, Size, ETag, IsLatest, LastModifiedDate",
+            "files": [{"key": "config/data/part-0.csv.gz"}],
+        }
+        with open(os.path.join(inventory, "manifest.json"), "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        return inventory
+
+    def inventory_record(self, key, bucket=BUCKET, is_latest="true"):
+        head = self.s3.head_object(Bucket=BUCKET, Key=key)
+        last_modified = head["LastModified"].strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return bucket, key, head["ContentLength"], head["ETag"].strip('"'), is_latest, last_modified
+
+    def test_inventory_drives_the_download(self):
+        listed = ["bundle/label.xml", "bundle/data/file3.dat", "bundle/data/file12.dat", "bundle/data/file7.dat"]
+        inventory = self.write_inventory(
+            [self.inventory_record(key) for key in listed]
+            + [
+                self.inventory_record("bundle/data/file1.dat", bucket="another-bucket"),
+                self.inventory_record("bundle/data/file2.dat", is_latest="false"),
+                self.inventory_record("other/file.dat"),
+            ]
+        )
+
+        with mock.patch.object(s3_download, "download_object", wraps=s3_download.download_object) as download:
+            output = self.run_main(
+                "--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--inventory", inventory, "--largest-first"
+            )
+
+        self.assertIn("Inventory lists 4 object(s)", output)
+        self.assertEqual(
+            [call.args[2] for call in download.call_args_list],
+            ["bundle/data/file12.dat", "bundle/data/file7.dat", "bundle/data/file3.dat", "bundle/label.xml"],
+        )
+        self.assertEqual(self.local_files(), {key[len("bundle/") :]: self.objects[key] for key in listed})
+        head = self.s3.head_object(Bucket=BUCKET, Key="bundle/data/file3.dat")
+        self.assertEqual(
+            int(os.stat(os.path.join(self.dest, "data", "file3.dat")).st_mtime), int(head["LastModified"].timestamp())
+        )
+
+    def test_largest_first_requires_an_inventory(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--largest-first")
+
+    def test_archive(self):
+        archive_path = os.path.join(self.directory.name, "bundle.tar.gz")
+        spool = os.path.join(self.directory.name, "spool")
+        os.makedirs(spool)
+        # Objects larger than 500 bytes go through spool files
+        with mock.patch.object(s3_download, "SPOOL_MEMORY", 500):
+            output = self.run_main(
+                "--source-prefix", "bundle/", "--archive", archive_path, "--concurrency", "4", "--spool-dir", spool
+            )
+
+        self.assertIn("Wrote 13 object(s)", output)
+        self.assertEqual(os.listdir(spool), [])
+        with tarfile.open(archive_path) as archive:
+            members = {member.name: archive.extractfile(member).read() for member in archive}
+            label = archive.getmember("label.xml")
+        self.assertEqual(members, self.expected_files())
+        head = self.s3.head_object(Bucket=BUCKET, Key="bundle/label.xml")
+        self.assertEqual(label.mtime, int(head["LastModified"].timestamp()))
+
+    def test_zip_archive(self):
+        archive_path = os.path.join(self.directory.name, "bundle.out")
+        self.run_main("--source-prefix", "bundle/", "--archive", archive_path, "--archive-format", "zip", "--quiet")
+
+        with zipfile.ZipFile(archive_path) as archive:
+            self.assertEqual({name: archive.read(name) for name in archive.namelist()}, self.expected_files())
+
+    def test_archive_options(self):
+        archive_path = os.path.join(self.directory.name, "bundle.out")
+        for arguments in (
+            ("--archive", archive_path),
+            ("--archive", f"{archive_path}.tar", "--local-dest-dir", self.dest),
+            ("--archive", f"{archive_path}.tar", "--sync"),
+        ):
+            with self.subTest(arguments=arguments):
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                    self.run_main("--source-prefix", "bundle/", *arguments)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_retry_keeps_the_entries_it_does_not_cover(self):
+        failed = {"bundle/data/file3.dat", "bundle/data/file5.dat"}
+        with mock.patch.object(s3_download, "download_object", failing(s3_download.download_object, failed)):
+            output = self.run_main("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--quiet")
+        journal = os.path.join(self.dest, FAILURES_FILE_NAME)
+        self.assertIn(f"Recorded 2 failed object(s) in {journal}", output)
+        self.assertEqual({entry["key"] for entry in read_failure_journal(journal)}, failed)
+
+        # Entries of another bucket and of another prefix, recorded by other runs
+        with open(journal, "a") as journal_file:
+            for bucket, key in (("another-bucket", "bundle/data/file1.dat"), (BUCKET, "other/file.dat")):
+                entry = {"bucket": bucket, "key": key, "size": 5, "e_tag": None, "last_modified": None}
+                journal_file.write(json.dumps(entry) + "\n")
+
+        # A successful run of the same objects only drops their entries
+        with mock.patch.object(s3_download, "download_object", wraps=s3_download.download_object) as download:
+            self.run_main(
+                "--source-prefix", "bundle/data/", "--local-dest-dir", os.path.join(self.dest, "data"),
+                "--retry-failed", journal, "--quiet",
+            )
+        self.assertEqual(sorted(call.args[2] for call in download.call_args_list), sorted(failed))
+        files = {path: body for path, body in self.local_files().items() if ".pdc-s3-download" not in path}
+        self.assertEqual(files, self.expected_files())
+        self.assertEqual(
+            [(entry["bucket"], entry["key"]) for entry in read_failure_journal(journal)],
+            [("another-bucket", "bundle/data/file1.dat"), (BUCKET, "other/file.dat")],
+        )
+
+        self.run_main("--source-prefix", "other/", "--local-dest-dir", self.dest, "--failure-journal", journal)
+        self.assertEqual([entry["bucket"] for entry in read_failure_journal(journal)], ["another-bucket"])
+
+    def test_archive_failures_are_retried_into_a_new_archive(self):
+        archive_path = os.path.join(self.directory.name, "bundle.tar")
+        failed = {"bundle/data/file3.dat"}
+        with mock.patch.object(s3_download, "download_to_spool", failing(s3_download.download_to_spool, failed)):
+            output = self.run_main("--source-prefix", "bundle/", "--archive", archive_path, "--quiet")
+        journal = f"{archive_path}.failures.jsonl"
+        self.assertIn(f"retry them with --retry-failed {journal} and a new --archive", output)
+        with open(archive_path, "rb") as archive_file:
+            archived = archive_file.read()
+
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            self.run_main("--source-prefix", "bundle/", "--archive", archive_path, "--retry-failed", journal)
+        with open(archive_path, "rb") as archive_file:
+            self.assertEqual(archive_file.read(), archived)
+
+        retry_path = os.path.join(self.directory.name, "bundle-retry.tar")
+        self.run_main("--source-prefix", "bundle/", "--archive", retry_path, "--retry-failed", journal, "--quiet")
+        with tarfile.open(retry_path) as archive:
+            self.assertEqual(archive.getnames(), ["data/file3.dat"])
+        self.assertFalse(os.path.exists(journal))
+
+    def test_dedup_store_downloads_each_content_once(self):
+        for key in ("bundle/v1/copy.dat", "bundle/v2/copy.dat"):
+            self.objects[key] = self.objects["bundle/data/file4.dat"]
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=self.objects[key])
+        store = os.path.join(self.directory.name, "store")
+        report = os.path.join(self.directory.name, "report.json")
+        arguments = ("--source-prefix", "bundle/", "--local-dest-dir", self.dest, "--dedup-store", store)
+
+        with mock.patch.object(s3_download, "download_object", wraps=s3_download.download_object) as download:
+            output = self.run_main(*arguments, "--report-json", report, "--quiet")
+
+        self.assertEqual(download.call_count, 13)
+        self.assertIn("reused stored copies for 2 object(s) (800 bytes not downloaded)", output)
+        with open(report) as report_file:
+            self.assertEqual(
+                json.load(report_file)["content_store"],
+                {"stored_objects": 13, "reused_objects": 2, "reused_bytes": 800},
+            )
+        self.assertEqual(self.local_files(), self.expected_files())
+        self.assertTrue(
+            os.path.samefile(os.path.join(self.dest, "v1", "copy.dat"), os.path.join(self.dest, "data", "file4.dat"))
+        )
+
+        # Another destination sharing the store downloads nothing
+        other = os.path.join(self.directory.name, "other")
+        with mock.patch.object(s3_download, "download_object", wraps=s3_download.download_object) as download:
+            self.run_main("--source-prefix", "bundle/", "--local-dest-dir", other, "--dedup-store", store, "--quiet")
+        download.assert_not_called()
+        self.assertEqual(self.local_files(other), self.expected_files())
+
+
+if __name__ == "__main__":
+    unittest.main()
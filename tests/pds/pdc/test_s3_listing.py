@@ -0,0 +1,57 @@
+import unittest
+
+import boto3
+from moto import mock_aws
+from pds.pdc.s3_listing import iter_sharded_objects
+
+BUCKET = "listing-bucket"
+
+
+class EmptyFirstPages:
+    """S3 client whose listings without a delimiter start with an empty, truncated page."""
+
+    def __init__(self, s3_client):
+        """Wrap s3_client."""
+        self.s3_client = s3_client
+
+    def list_objects_v2(self, **request):
+        if "Delimiter" not in request and "ContinuationToken" not in request:
+            return {"IsTruncated": True, "NextContinuationToken": "empty-page"}
+        if request.get("ContinuationToken") == "empty-page":
+            del request["ContinuationToken"]
+        return self.s3_client.list_objects_v2(**request)
+
+
+@mock_aws
+class ShardedListingTests(unittest.TestCase):
+    def setUp(self):
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.keys = {"bundle/readme.txt"}
+        for directory in ("data", "browse", "document"):
+            for subdirectory in range(3):
+                for number in range(7):
+                    self.keys.add(f"bundle/{directory}/{subdirectory}/file{number}.xml")
+        for key in self.keys | {"other/file.xml"}:
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=b"")
+
+    def listed_keys(self, s3_client, split_after_pages):
+        keys = [obj["Key"] for obj in iter_sharded_objects(s3_client, BUCKET, "bundle/", 4, split_after_pages, 5)]
+        self.assertEqual(len(keys), len(set(keys)))
+        return set(keys)
+
+    def test_every_key_is_listed_once(self):
+        for split_after_pages in (1, 2, 100):
+            with self.subTest(split_after_pages=split_after_pages):
+                self.assertEqual(self.listed_keys(self.s3, split_after_pages), self.keys)
+
+    def test_empty_truncated_pages_are_split(self):
+        self.assertEqual(self.listed_keys(EmptyFirstPages(self.s3), 1), self.keys)
+
+    def test_split_after_pages_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            next(iter_sharded_objects(self.s3, BUCKET, "bundle/", split_after_pages=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
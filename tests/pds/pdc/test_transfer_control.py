@@ -0,0 +1,212 @@
+import threading
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ClientError
+from botocore.exceptions import ReadTimeoutError
+from pds.pdc import transfer_control
+from pds.pdc.transfer_control import AdaptiveConcurrency
+from pds.pdc.transfer_control import backoff_delay
+from pds.pdc.transfer_control import is_retryable_error
+from pds.pdc.transfer_control import is_throttle_error
+from pds.pdc.transfer_control import run_transfers
+from pds.pdc.transfer_control import TokenBucket
+
+
+def client_error(code, status):
+    """Return a ClientError with the given error code and HTTP status."""
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "GetObject"
+    )
+
+
+class FakeClock:
+    """Stand-in for time.monotonic, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ErrorClassificationTests(unittest.TestCase):
+    def test_throttling_responses(self):
+        self.assertTrue(is_throttle_error(client_error("SlowDown", 503)))
+        self.assertTrue(is_throttle_error(client_error("Unknown", 429)))
+        self.assertFalse(is_throttle_error(client_error("InternalError", 500)))
+        self.assertFalse(is_throttle_error(ValueError("SlowDown")))
+
+    def test_retryable_errors(self):
+        self.assertTrue(is_retryable_error(client_error("SlowDown", 503)))
+        self.assertTrue(is_retryable_error(client_error("InternalError", 500)))
+        self.assertTrue(is_retryable_error(client_error("Unknown", 502)))
+        self.assertTrue(is_retryable_error(ReadTimeoutError(endpoint_url="https://s3")))
+        self.assertFalse(is_retryable_error(client_error("NoSuchKey", 404)))
+        self.assertFalse(is_retryable_error(client_error("AccessDenied", 403)))
+        self.assertFalse(is_retryable_error(ValueError("broken")))
+
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(1, 20):
+            delay = backoff_delay(attempt, base=0.5, cap=4.0)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4.0, 0.5 * 2 ** (attempt - 1)))
+
+
+class AdaptiveConcurrencyTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(transfer_control.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_initial_limit_is_bounded(self):
+        self.assertEqual(AdaptiveConcurrency(maximum=16).limit, 4)
+        self.assertEqual(AdaptiveConcurrency(maximum=2).limit, 2)
+        self.assertEqual(AdaptiveConcurrency(maximum=16, initial=0, minimum=2).limit, 2)
+
+    def test_limit_grows_each_window_up_to_the_maximum(self):
+        controller = AdaptiveConcurrency(maximum=6, initial=4, window=1.0)
+        for _window in range(5):
+            self.clock.now += 1.0
+            controller.record_success(1000)
+        self.assertEqual(controller.limit, 6)
+        self.assertEqual(controller.peak_limit, 6)
+
+    def test_no_adjustment_within_a_window(self):
+        controller = AdaptiveConcurrency(maximum=16, initial=4, window=1.0)
+        self.clock.now += 0.5
+        controller.record_success(1000)
+        self.assertEqual(controller.limit, 4)
+
+    def test_throttle_halves_the_limit_once_per_window(self):
+        controller = AdaptiveConcurrency(maximum=16, initial=8, window=1.0)
+        controller.record_throttle()
+        controller.record_throttle()
+        self.assertEqual(controller.limit, 4)
+        self.assertEqual(controller.throttles, 2)
+
+        self.clock.now += 1.0
+        controller.record_throttle()
+        self.assertEqual(controller.limit, 2)
+
+    def test_throttled_window_does_not_grow(self):
+        controller = AdaptiveConcurrency(maximum=16, initial=8, window=1.0)
+        controller.record_throttle()
+        self.clock.now += 0.5
+        controller.record_throttle()
+        self.clock.now += 0.5
+        controller.record_success(1000)
+        self.assertEqual(controller.limit, 4)
+
+    def test_steps_back_when_growth_lowers_throughput(self):
+        controller = AdaptiveConcurrency(maximum=16, initial=4, window=1.0)
+        self.clock.now += 1.0
+        controller.record_success(1000)  # First window: no previous throughput, grows to 5
+        self.assertEqual(controller.limit, 5)
+        self.clock.now += 1.0
+        controller.record_success(500)  # Throughput halved after growing: steps back to 4
+        self.assertEqual(controller.limit, 4)
+
+    def test_never_below_minimum(self):
+        controller = AdaptiveConcurrency(maximum=16, initial=2, minimum=2, window=1.0)
+        for _window in range(3):
+            self.clock.now += 1.0
+            controller.record_throttle()
+        self.assertEqual(controller.limit, 2)
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_sleeps_while_in_debt(self):
+        clock = FakeClock()
+        with mock.patch.object(transfer_control.time, "monotonic", clock), mock.patch.object(
+            transfer_control.time, "sleep"
+        ) as sleep:
+            bucket = TokenBucket(rate=100)
+            bucket.consume(100)
+            sleep.assert_not_called()
+            bucket.consume(50)
+            sleep.assert_called_once_with(0.5)
+
+            sleep.reset_mock()
+            clock.now += 2.0  # Refills, but never beyond the burst capacity
+            bucket.consume(100)
+            sleep.assert_not_called()
+            bucket.consume(100)
+            sleep.assert_called_once_with(1.0)
+
+
+class RunTransfersTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(transfer_control, "backoff_delay", return_value=0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_yields_every_item(self):
+        results = list(run_transfers(range(1, 21), lambda item: item * 2, concurrency=4))
+        self.assertEqual(sorted(result for _item, result, _error, _attempts in results), list(range(2, 42, 2)))
+        self.assertTrue(all(error is None and attempts == 1 for _item, _result, error, attempts in results))
+
+    def test_retries_throttled_items(self):
+        failures = {"a": 2, "b": 0}
+        lock = threading.Lock()
+
+        def task(item):
+            with lock:
+                if failures[item]:
+                    failures[item] -= 1
+                    raise client_error("SlowDown", 503)
+            return item.upper()
+
+        controller = AdaptiveConcurrency(maximum=4)
+        results = {item: (result, error, attempts) for item, result, error, attempts in run_transfers(
+            ["a", "b"], task, concurrency=4, controller=controller, max_attempts=3
+        )}
+        self.assertEqual(results, {"a": ("A", None, 3), "b": ("B", None, 1)})
+        self.assertEqual(controller.throttles, 2)
+
+    def test_gives_up_after_max_attempts(self):
+        error = client_error("InternalError", 500)
+        task = mock.Mock(side_effect=error)
+        [(item, result, raised, attempts)] = run_transfers(["a"], task, concurrency=2, max_attempts=3)
+        self.assertEqual((item, result, raised, attempts), ("a", None, error, 3))
+        self.assertEqual(task.call_count, 3)
+
+    def test_does_not_retry_permanent_errors(self):
+        task = mock.Mock(side_effect=client_error("NoSuchKey", 404))
+        [(_item, _result, raised, attempts)] = run_transfers(["a"], task, concurrency=2, max_attempts=5)
+        self.assertEqual(attempts, 1)
+        self.assertEqual(raised.response["Error"]["Code"], "NoSuchKey")
+
+    def test_bounds_items_in_flight(self):
+        in_flight = [0]
+        peak = [0]
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def task(item):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            release.wait(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return item
+
+        controller = AdaptiveConcurrency(maximum=8, initial=2)
+        results = list(run_transfers(range(30), task, concurrency=8, controller=controller))
+        self.assertEqual(len(results), 30)
+        self.assertLessEqual(peak[0], 2)
+
+    def test_draws_items_lazily(self):
+        drawn = []
+
+        def items():
+            for number in range(100):
+                drawn.append(number)
+                yield number
+
+        transfers = run_transfers(items(), lambda item: item, concurrency=3)
+        next(transfers)
+        self.assertLessEqual(len(drawn), 4)
+        transfers.close()
@@ -0,0 +1,113 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pds.pdc import transfer_metrics
+from pds.pdc.transfer_metrics import TransferMetrics
+
+
+class FakeClock:
+    """Stand-in for time.monotonic, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TransferMetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(transfer_metrics.time, "monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate_and_eta(self):
+        metrics = TransferMetrics(total_objects=4, total_bytes=100_000_000)
+        metrics.record_skip(10_000_000)
+        self.clock.now += 10.0
+        metrics.record_bytes(20_000_000)
+        metrics.record_download(20_000_000, 10.0)
+
+        self.assertEqual(metrics.current_rate(), 2_000_000)
+        # 70 MB left at 2 MB/s
+        self.assertEqual(
+            metrics.progress_line(), "Progress: 2/4 object(s), 30.0 MB/100.0 MB, 2.00 MB/s, 0 failed, ETA 0:00:35"
+        )
+
+    def test_progress_counts_bytes_in_flight(self):
+        metrics = TransferMetrics(total_objects=1, total_bytes=50_000_000)
+        self.clock.now += 5.0
+        metrics.record_bytes(10_000_000)
+
+        self.assertEqual(
+            metrics.progress_line(), "Progress: 0/1 object(s), 10.0 MB/50.0 MB, 2.00 MB/s, 0 failed, ETA 0:00:20"
+        )
+
+    def test_rate_only_counts_the_recent_window(self):
+        metrics = TransferMetrics()
+        metrics.record_bytes(50_000_000)
+        self.clock.now += transfer_metrics.RATE_WINDOW * 2
+        metrics.record_bytes(30_000_000)
+
+        self.assertEqual(metrics.current_rate(), 30_000_000 / transfer_metrics.RATE_WINDOW)
+        self.assertEqual(metrics.progress_line(), "Progress: 0 object(s), 80.0 MB, 1.00 MB/s, 0 failed")
+
+    def test_retried_bytes_given_back(self):
+        metrics = TransferMetrics()
+        self.clock.now += 1.0
+        metrics.record_bytes(1000)
+        metrics.record_bytes(-1000)
+        metrics.record_bytes(1000)
+
+        self.assertEqual(metrics.received_bytes, 1000)
+        self.assertEqual(metrics.current_rate(), 1000)
+
+    def test_report(self):
+        metrics = TransferMetrics()
+        metrics.record_bytes(300)
+        metrics.record_download(100, 0.02, attempts=3)
+        metrics.record_download(200, 2.0)
+        metrics.record_failure(50, attempts=2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.json")
+            metrics.write_json(path, {"bucket": "pds"})
+            with open(path) as report_file:
+                report = json.load(report_file)
+            prometheus_path = os.path.join(directory, "metrics.prom")
+            metrics.write_prometheus(prometheus_path)
+            with open(prometheus_path) as prometheus_file:
+                prometheus = prometheus_file.read()
+
+        self.assertEqual(report["bucket"], "pds")
+        self.assertEqual(report["objects"]["downloaded"], 2)
+        self.assertEqual(report["bytes"]["failed"], 50)
+        self.assertEqual(report["retries"], 3)
+        self.assertEqual(report["object_latency_seconds"]["count"], 2)
+        self.assertIn('pdc_s3_download_objects{status="failed"} 1', prometheus)
+        self.assertIn('pdc_s3_download_object_latency_seconds_bucket{le="+Inf"} 2', prometheus)
+
+
+class ProgressThreadTests(unittest.TestCase):
+    def test_prints_while_transfers_are_in_flight(self):
+        metrics = TransferMetrics(total_objects=1, total_bytes=1_000_000)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            metrics.start_progress(0.01)
+            metrics.record_bytes(500_000)
+            deadline = time.monotonic() + 5
+            while "0.5 MB/1.0 MB" not in output.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            metrics.stop_progress()
+            printed = output.getvalue()
+            time.sleep(0.05)
+
+        self.assertIn("Progress: 0/1 object(s), 0.5 MB/1.0 MB", printed)
+        self.assertEqual(output.getvalue(), printed)